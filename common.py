@@ -6,7 +6,8 @@ import winreg
 import pathlib
 from hurry.filesize import size
 from datetime import datetime
-from os import path, environ, makedirs, listdir
+from functools import lru_cache
+from os import path, environ, makedirs
 
 
 def app_name():
@@ -18,10 +19,15 @@ def app_name():
 app_name = app_name()
 data_path = path.join(environ['LOCALAPPDATA'], 'RemoteDir', app_name)
 cache_path = path.join(data_path, 'Cache')
+catalog_path = path.join(data_path, 'Catalog')
 config_file = path.join(data_path, 'config.ini')
 log_dir = path.join(data_path, 'Log')
 my_knownhosts = path.join(data_path, 'known_hosts')
 thumb_dir = '.rdthumbnails'
+# thumbnails for each icon size, the base level is stored in thumb_dir itself so older clients read it
+base_level = 'Huge'
+thumb_levels = {'Small': 'small', 'Medium': 'medium', base_level: ''}
+thumb_sizes = {'Small': (96, 96), 'Medium': (144, 144), base_level: (300, 200)}
 button_height = 20
 hidden_files = [thumb_dir]
 forbidden_names = [thumb_dir]
@@ -221,13 +227,13 @@ def menu_popup(originator, buttons, callback, widget=None, mouse_pos=None):
     Clock.schedule_once(open_popup, .1)
 
 
-def thumbnail_popup(originator, destination, filename, sftp):
+def thumbnail_popup(originator, destination, filename, remote_dir):
     from kivy.uix.popup import Popup
     from popups.thumbnailpopup import ThumbnailPopup
     from kivy.clock import Clock
 
     def open_popup(_):
-        content = ThumbnailPopup(originator, destination, filename, sftp)
+        content = ThumbnailPopup(originator, destination, filename, remote_dir)
         popup = Popup(
             title=f'Drop thumbnail for {filename}',
             auto_dismiss=True,
@@ -278,9 +284,14 @@ def info_popup():
 
 
 def get_progid(filename):
+    return progid(os.path.splitext(filename)[1].lower())
+
+
+@lru_cache(maxsize=None)
+def progid(ext):
+    """Registry is read once per extension"""
     # noinspection PyBroadException
     try:
-        ext = os.path.splitext(filename)[1]
         partial_key = r'Software\Microsoft\Windows\CurrentVersion\Explorer\FileExts\{}\UserChoice'.format(ext)
         with winreg.ConnectRegistry(None, winreg.HKEY_CURRENT_USER) as reg:
             with winreg.OpenKey(reg, partial_key) as key_object:
@@ -291,6 +302,7 @@ def get_progid(filename):
         return value
 
 
+@lru_cache(maxsize=65536)
 def convert_file_size(_size):
     return size(_size)
 
@@ -303,6 +315,7 @@ def pure_windows_path(*args):
     return rf'{str(pathlib.PureWindowsPath(*args))}'
 
 
+@lru_cache(maxsize=65536)
 def unix_time(timestamp):
 
     # if you encounter a "year is out of range" error the timestamp
@@ -336,6 +349,15 @@ def get_dir_attrs(_path, sftp):
     return attrs
 
 
+def remote_mtime(_path, sftp):
+    """mtime of remote directory after a change made in it, None if it can't be read"""
+    # noinspection PyBroadException
+    try:
+        return sftp.stat(_path).st_mtime
+    except Exception:
+        return None
+
+
 def file_ext(name):
     return os.path.splitext(name)[1]
 
@@ -384,18 +406,21 @@ def _log_file():
 log_file = _log_file()
 
 
-def find_thumb(dst_path, filename):
-    path_to_thumbnails = pure_windows_path(cache_path, dst_path.strip('/'), thumb_dir)
+def find_thumb(dst_path, filename, level=base_level):
+    """
+    Returns (local path, mtime) of cached thumbnail of filename in remote dst_path or None.
+    Base level is used until the requested level is cached.
+    """
+    from managers.thumbindex import thumb_index
+    thumbnail = thumb_index.find(dst_path, filename, level)
+    if not thumbnail and level != base_level:
+        thumbnail = thumb_index.find(dst_path, filename)
+    return thumbnail
 
-    if not path.exists(path_to_thumbnails):
-        return None
-    thumbnails = listdir(path_to_thumbnails)
-    for thumbnail in thumbnails:
-        _thumbnail = '.'.join(thumbnail.split('.')[0: -1])
-        if _thumbnail == filename:
-            return pure_windows_path(path_to_thumbnails, thumbnail)
-    else:
-        return None
+
+def thumb_level_dir(path, level=base_level):
+    """Remote thumbnails directory of level of path"""
+    return posix_path(path, thumb_dir, thumb_levels[level])
 
 
 def thumbnails():
@@ -407,3 +432,49 @@ def thumbnails():
         return False
     else:
         return enable_thumbnails
+
+
+def fast_remove():
+    # noinspection PyBroadException
+    try:
+        config = get_config()
+        enable_fast_remove = config.getboolean('SETTINGS', 'fast_remove')
+    except Exception:
+        return False
+    else:
+        return enable_fast_remove
+
+
+def thumbnail_bundles():
+    # noinspection PyBroadException
+    try:
+        config = get_config()
+        enable_bundles = config.getboolean('SETTINGS', 'thumbnail_bundles')
+    except Exception:
+        return False
+    else:
+        return enable_bundles
+
+
+def publish_thumbnails():
+    # noinspection PyBroadException
+    try:
+        config = get_config()
+        enable_publish = config.getboolean('SETTINGS', 'publish_thumbnails')
+    except Exception:
+        return False
+    else:
+        return enable_publish
+
+
+def cache_limits():
+    """Size of cache in MB and days files are kept in it unused, 0 is no limit"""
+    # noinspection PyBroadException
+    try:
+        config = get_config()
+        size = config.getint('SETTINGS', 'cache_size', fallback=2048)
+        days = config.getint('SETTINGS', 'cache_days', fallback=60)
+    except Exception:
+        return 2048, 60
+    else:
+        return size, days
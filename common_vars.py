@@ -1,4 +1,4 @@
-from os import path, environ, makedirs, listdir
+from os import path, environ, makedirs
 
 
 
@@ -80,15 +80,6 @@ log_file = _log_file()
 
 
 def find_thumb(dst_path, filename):
-    from common_funcs import pure_windows_path
-    path_to_thumbnails = pure_windows_path(cache_path, dst_path.strip('/'), thumb_dir)
-
-    if not path.exists(path_to_thumbnails):
-        return None
-    thumbnails = listdir(path_to_thumbnails)
-    for thumbnail in thumbnails:
-        _thumbnail = '.'.join(thumbnail.split('.')[0: -1])
-        if _thumbnail == filename:
-            return pure_windows_path(path_to_thumbnails, thumbnail)
-    else:
-        return None
+    """Returns local path of cached thumbnail of filename in remote dst_path or None"""
+    from managers.thumbindex import thumb_index
+    return thumb_index.get(dst_path, filename)
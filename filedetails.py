@@ -2,18 +2,11 @@ from iconcontroller import IconController
 
 
 class FileDetails(IconController):
+    heights = {'Small': 34, 'Medium': 45, 'Huge': 55}
 
-    def __init__(self, attrs, file_type,space, **kwargs):
-        super().__init__(attrs, file_type, space, **kwargs)
-        space.add_widget(self)
-
-    def resize(self, size):
-        if size == 'Small':
-            self.height = 34
-        elif size == 'Medium':
-            self.height = 45
-        else:
-            self.height = 55
+    @classmethod
+    def layout_size(cls, size):
+        return None, cls.heights.get(size, cls.heights['Huge'])
 
     def set_pos(self, _, dy):
         self.y += dy
@@ -0,0 +1,107 @@
+from common import get_progid, convert_file_size, unix_time, find_thumb, base_level
+from managers.cachemanager import cache_manager
+import posixpath
+import re
+
+digits = re.compile(r'(\d+)')
+
+
+def natural_key(name):
+    """'file 2' goes before 'file 10'. Text parts are on even positions so keys are always comparable."""
+    parts = digits.split(name.casefold())
+    return tuple(int(part) if i % 2 else part for i, part in enumerate(parts))
+
+
+sort_keys = {
+    'dirs': lambda file: file.file_type != 'dir',
+    'name': lambda file: natural_key(file.filename),
+    'type': lambda file: posixpath.splitext(file.filename)[1].casefold(),
+    'size': lambda file: file.attrs.st_size,
+    'st_atime': lambda file: file.attrs.st_atime,
+    'st_mtime': lambda file: file.attrs.st_mtime,
+}
+
+
+class FileItem:
+    """
+    One entry of FilesSpace.
+    Icons are recycled while scrolling and show different files, so everything about a file,
+    including focus, lives here. Values shown only by icons are computed when the item
+    is shown for the first time.
+    """
+    __slots__ = ('attrs', 'filename', 'path', 'file_type', 'focus', 'rename',
+                 '_description', '_date_added', '_date_modified', '_filesize', '_sort_keys', '_thumbnail')
+
+    def __init__(self, attrs):
+        self.focus = False
+        # new directory waits for user to type its name
+        self.rename = False
+        self.set_attrs(attrs)
+
+    def set_attrs(self, attrs):
+        self.attrs = attrs
+        self.filename = attrs.filename
+        self.path = attrs.path
+        self.file_type = 'dir' if attrs.longname[0] == 'd' else 'file'
+        self._description = None
+        self._date_added = None
+        self._date_modified = None
+        self._filesize = None
+        self._sort_keys = None
+        self._thumbnail = None
+
+    def get(self, key, default=None):
+        # RecycleView reads layout options of data items with get
+        return default
+
+    @property
+    def description(self):
+        if self._description is None:
+            self._description = 'Directory' if self.file_type == 'dir' else get_progid(self.filename)
+        return self._description
+
+    @property
+    def date_added(self):
+        if self._date_added is None:
+            self._date_added = unix_time(self.attrs.st_atime)
+        return self._date_added
+
+    @property
+    def date_modified(self):
+        if self._date_modified is None:
+            self._date_modified = unix_time(self.attrs.st_mtime)
+        return self._date_modified
+
+    @property
+    def filesize(self):
+        if self._filesize is None:
+            self._filesize = convert_file_size(self.attrs.st_size)
+        return self._filesize
+
+    def sort_key(self, key):
+        """Key of sort_keys, computed once per file"""
+        if self._sort_keys is None:
+            self._sort_keys = {}
+        value = self._sort_keys.get(key)
+        if value is None:
+            value = self._sort_keys[key] = sort_keys[key](self)
+        return value
+
+    def thumbnail(self, level=base_level):
+        """
+        (path, mtime) of image shown by icon, looked up once until refresh_thumbnail.
+        mtime is None for images of the app.
+        """
+        if self._thumbnail is None:
+            thumbnail = find_thumb(self.path, self.filename, level) if self.attrs.thumbnail else None
+            if thumbnail:
+                self._thumbnail = thumbnail
+                cache_manager.touch(thumbnail[0])
+            elif self.file_type == 'dir':
+                self._thumbnail = 'img/dir.png', None
+            else:
+                self._thumbnail = 'img/unknown.png', None
+        return self._thumbnail
+
+    def refresh_thumbnail(self):
+        self._thumbnail = None
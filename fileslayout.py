@@ -0,0 +1,60 @@
+from kivy.uix.recyclegridlayout import RecycleGridLayout
+from bisect import bisect_right
+
+
+class FilesLayout(RecycleGridLayout):
+    """
+    Grid layout of FilesSpace which finds icons by position with binary search over
+    positions of columns and rows, instead of going through them one by one.
+    RecycleView uses get_view_index_at to find visible icons on every scroll.
+    """
+    def cell_at(self, pos):
+        """Returns column and row of the grid at pos, clamped to the grid"""
+        x, y = pos
+        col_pos = self._cols_pos
+        row_pos = self._rows_pos
+        ix = min(max(bisect_right(col_pos, x) - 1, 0), len(col_pos) - 1)
+        iy = min(max(bisect_right(row_pos, y) - 1, 0), len(row_pos) - 1)
+        return ix, iy
+
+    def cell_index(self, ix, iy):
+        cols, rows = len(self._cols), len(self._rows)
+        if not self._fills_from_left_to_right:
+            ix = cols - ix - 1
+        if self._fills_from_top_to_bottom:
+            iy = rows - iy - 1
+        return (iy * cols + ix) if self._fills_row_first else (ix * rows + iy)
+
+    def get_view_index_at(self, pos):
+        if not self._cols_pos or not self._rows_pos:
+            return 0
+        return self.cell_index(*self.cell_at(pos))
+
+    def index_at(self, pos):
+        """Returns index of data which icon is at pos or None"""
+        if not self._cols_pos or not self._rows_pos:
+            return None
+        index = self.get_view_index_at(pos)
+        if not 0 <= index < len(self.view_opts) or not self.collides(index, *pos, *pos):
+            return None
+        return index
+
+    def indexes_in(self, x, y, right, top):
+        """Returns indexes of data which icons overlap the rectangle, only cells under it are checked"""
+        if not self._cols_pos or not self._rows_pos:
+            return []
+        ix, iy = self.cell_at((x, y))
+        iright, itop = self.cell_at((right, top))
+        indexes = []
+        count = len(self.view_opts)
+        for col in range(ix, iright + 1):
+            for row in range(iy, itop + 1):
+                index = self.cell_index(col, row)
+                if index < count and self.collides(index, x, y, right, top):
+                    indexes.append(index)
+        return indexes
+
+    def collides(self, index, x, y, right, top):
+        opt = self.view_opts[index]
+        (ox, oy), (width, height) = opt['pos'], opt['size']
+        return not (ox + width < x or ox > right or oy + height < y or oy > top)
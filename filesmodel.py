@@ -0,0 +1,191 @@
+from kivy.clock import Clock
+from fileitem import FileItem
+from common import hidden_files
+
+
+class FilesModel:
+    """
+    Files shown by FilesSpace keyed by filename, in the order they are shown.
+    Changes are collected and passed to subscribers at most once per frame as a diff
+    of the shown list, so adding thousands of uploaded files one by one costs one update per frame
+    and the view lays out only what changed. A file replaced by a file of the same name
+    keeps its place. Lookups by name are O(1), position of a file is looked up in an index
+    of the shown list, which is built when it is needed after a change.
+    """
+    # more removed files than this part of shown ones are passed as a new list
+    max_removed_part = .5
+
+    def __init__(self):
+        self.files = {}
+        # files passed to subscribers and files added since
+        self.shown = []
+        self.pending = []
+        self.positions = None
+        # files were removed or replaced, shown files may be stale until flush
+        self.dirty = False
+        # order of files changed, subscribers get the whole list
+        self.reordered = False
+        self.order_keys = []
+        self.subscribers = []
+        self.trigger = Clock.create_trigger(self.flush)
+
+    def __len__(self):
+        return len(self.files)
+
+    def __contains__(self, name):
+        return name in self.files
+
+    def subscribe(self, callback):
+        """
+        callback(change, value) is called after every change of the shown list, change is one of
+        'reset' with the new list, 'modified' with list of (index, file), 'removed' with list of
+        (start, stop) ranges from the last one and 'appended' with list of files.
+        Changes of one flush come in this order and each applies to the list left by the previous one.
+        """
+        self.subscribers.append(callback)
+
+    def unsubscribe(self, callback):
+        self.subscribers.remove(callback)
+
+    def notify(self, change, value):
+        for callback in self.subscribers:
+            callback(change, value)
+
+    def get(self, name):
+        return self.files.get(name)
+
+    def position(self, file):
+        """Index of file in the shown list"""
+        if self.positions is None:
+            self.positions = {file: index for index, file in enumerate(self.shown)}
+        return self.positions.get(file)
+
+    def reset(self, attrs_list):
+        """Replaces all files and notifies subscribers at once"""
+        self.files = {}
+        self.shown = []
+        self.pending = []
+        self.dirty = False
+        self.order_keys = []
+        self.extend(attrs_list)
+        self.reordered = True
+        self.trigger.cancel()
+        self.flush()
+
+    def extend(self, attrs_list):
+        for attrs in attrs_list:
+            self.add(attrs)
+
+    def add(self, attrs):
+        """Adds file at the end, a file of the same name is replaced. Returns FileItem of the file."""
+        if attrs.filename in hidden_files:
+            return None
+        file = FileItem(attrs)
+        if attrs.filename in self.files:
+            self.dirty = True
+        self.files[attrs.filename] = file
+        self.pending.append(file)
+        self.trigger()
+        return file
+
+    def remove(self, name):
+        file = self.files.pop(name, None)
+        if file:
+            self.dirty = True
+            self.trigger()
+        return file
+
+    def rename(self, file, old):
+        """File was renamed, its attrs already have the new name"""
+        if self.files.get(old) is file:
+            del self.files[old]
+        if file.filename in self.files:
+            self.dirty = True
+            self.trigger()
+        self.files[file.filename] = file
+
+    def sort(self, keys):
+        """
+        Stable multi-key sort. keys is list of (key, reverse) from the most significant one.
+        Key names are in fileitem.sort_keys. Files are sorted on flush.
+        """
+        self.order_keys = keys
+        self.reordered = True
+        self.trigger()
+
+    def is_current(self, file):
+        return self.files.get(file.filename) is file
+
+    def compact(self):
+        """New shown list of current files in the order they were added"""
+        shown = self.shown + self.pending
+        if self.dirty:
+            shown = [file for file in shown if self.is_current(file)]
+        self.pending = []
+        self.dirty = False
+        self.positions = None
+        return shown
+
+    def flush(self, *_):
+        if self.reordered:
+            self.reordered = False
+            shown = self.compact()
+            # sorting is stable, so sorting by each key from the least significant gives multi-key order
+            for key, reverse in reversed(self.order_keys):
+                shown.sort(key=lambda file: file.sort_key(key), reverse=reverse)
+            self.order_keys = []
+            self.shown = shown
+            self.notify('reset', shown)
+            return
+
+        modified, removed = self.changes() if self.dirty else ([], [])
+        if len(removed) > len(self.shown) * self.max_removed_part:
+            self.shown = self.compact()
+            self.notify('reset', self.shown)
+            return
+
+        shown = self.shown
+        placed = {file for _, file in modified}
+        appended = [file for file in self.pending if file not in placed and self.is_current(file)]
+        for index, file in modified:
+            shown[index] = file
+        ranges = []
+        for index in reversed(removed):
+            if ranges and ranges[-1][0] == index + 1:
+                ranges[-1][0] = index
+            else:
+                ranges.append([index, index + 1])
+        for start, stop in ranges:
+            del shown[start:stop]
+        shown.extend(appended)
+        self.pending = []
+        self.dirty = False
+        self.positions = None
+
+        if modified:
+            self.notify('modified', modified)
+        if ranges:
+            self.notify('removed', [tuple(_range) for _range in ranges])
+        if appended:
+            self.notify('appended', appended)
+
+    def changes(self):
+        """
+        Returns (modified, removed) of shown files, modified is list of (index, file) of shown files
+        replaced by a file of the same name, removed is a sorted list of indexes.
+        """
+        files = self.files
+        shown_files = set(self.shown)
+        modified = []
+        removed = []
+        for index, file in enumerate(self.shown):
+            current = files.get(file.filename)
+            if current is file:
+                continue
+            # a shown file renamed to the name of this one is not moved here
+            if current is not None and current not in shown_files:
+                modified.append((index, current))
+                shown_files.add(current)
+            else:
+                removed.append(index)
+        return modified, removed
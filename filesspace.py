@@ -1,12 +1,13 @@
-from kivy.uix.stacklayout import StackLayout
+from kivy.uix.recycleview import RecycleView
 from kivy.graphics import Color, Rectangle
 from kivy.properties import ObjectProperty
 from kivy.core.window import Window
-from common import confirm_popup, menu_popup, posix_path, is_file, mk_logger, thumbnail_popup, hidden_files
+from kivy.clock import Clock
+from common import confirm_popup, menu_popup, posix_path, mk_logger, thumbnail_popup
 import win32clipboard as clipboard
 from filetile import FileTile
 from filedetails import FileDetails
-import os
+from filesmodel import FilesModel
 import copy
 from functools import partial
 
@@ -17,7 +18,13 @@ ex_log = mk_logger(name=f'{__name__}-EX',
 ex_log = ex_log.exception
 
 
-class FilesSpace(StackLayout):
+class FilesSpace(RecycleView):
+    """
+    Files of current directory. data holds FileItem of every file but icons are made
+    only for the visible ones and reused while scrolling, so big directories cost
+    as much as small ones. Anything about a file has to be kept in its FileItem.
+    Files are added, removed and sorted through model, data is updated from it once per frame.
+    """
     originator = ObjectProperty()
 
     def __init__(self, **kwargs):
@@ -31,112 +38,231 @@ class FilesSpace(StackLayout):
         self.marked_files = set()
         self.copied_files = []
         self.pressed_key = ''
-        self.sort_by = 'filename'
+        self.sort_by = 'name'
         self.reverse = False
         self.moving = False
         self.icon = FileTile
+        self.size_name = 'Small'
         self.rectangle = None
         self.mark_rectangle = None
         self.p_touch = None
         self.touched_file = None
+        self.hovered_file = None
+        # files inside marking rectangle
+        self.marked_area = set()
         self.mark = None
-        self.attrs_list = None
         self.touch = None
         self.thumb = True
+        # level of thumbnails shown by icons
+        self.level = self.thumb_level()
+        self.model = FilesModel()
+        self.model.subscribe(self.show)
+        self.report_visible = Clock.create_trigger(self.visible_changed, .1)
+
+    def on_kv_post(self, base_widget):
+        self.set_layout()
+
+    def on_width(self, *_):
+        self.set_layout()
+
+    def set_layout(self):
+        """Sets size of icons and number of columns of the layout for current icon and its size"""
+        layout = self.layout_manager
+        if not layout:
+            return
+        width, height = self.icon.layout_size(self.size_name)
+        if self.icon is FileTile:
+            spacing = layout.spacing[0]
+            layout.default_size_hint = None, None
+            layout.cols = max(1, int((self.width - self.bar_width + spacing) // (width + spacing)))
+        else:
+            layout.default_size_hint = 1, None
+            layout.cols = 1
+        layout.default_size = width, height
+
+    def show(self, change, value):
+        """Applies change of FilesModel to data, so only changed items are laid out again"""
+        if change == 'reset':
+            self.data = value
+        elif change == 'modified':
+            for index, file in value:
+                self.data[index] = file
+        elif change == 'removed':
+            for start, stop in value:
+                del self.data[start:stop]
+        elif change == 'appended':
+            self.data.extend(value)
+        self.report_visible()
+
+    def on_scroll_y(self, *_):
+        self.report_visible()
+
+    def visible_changed(self, _):
+        self.originator.visible_files([icon.item.filename for icon in self.visible_icons() if icon.item])
 
     def get_file_index(self, file):
-        return self.children.index(file)
+        return self.model.position(file)
+
+    def visible_icons(self):
+        return self.view_adapter.views.values()
+
+    def icon_of(self, file):
+        """Returns icon showing the file or None if file is not visible"""
+        for icon in self.visible_icons():
+            if icon.item is file:
+                return icon
+        return None
+
+    def refresh_item(self, file):
+        """Updates icon of the file after its FileItem was changed"""
+        icon = self.icon_of(file)
+        if icon:
+            icon.refresh_view_attrs(self, self.get_file_index(file), file)
+
+    def refresh_focus(self):
+        for icon in self.visible_icons():
+            icon.focus = icon.item.focus
+
+    def set_focus(self, file, focus):
+        file.focus = focus
+        icon = self.icon_of(file)
+        if icon:
+            icon.focus = focus
+
+    def restore_positions(self):
+        """Moves dragged icons back to their place in layout"""
+        view_opts = self.layout_manager.view_opts
+        for index, icon in self.view_adapter.views.items():
+            icon.pos = view_opts[index]['pos']
 
     def fill(self, attrs_list):
-        self.clear_widgets()
-        self.attrs_list = attrs_list
-        for attrs in self.attrs_list:
-            self.add_icon(attrs)
+        self.marked_files.clear()
+        self.model.reset(attrs_list)
+        self.scroll_y = 1
+
+    def extend(self, attrs_list):
+        """Adds next part of listed directory"""
+        self.model.extend(attrs_list)
 
     def add_icon(self, attrs, new_dir=False):
         """New dir means the dir was created remotely"""
-        if attrs.filename in hidden_files:
-            return
-        icon = self.icon.from_attrs(attrs=attrs, space=self)
-        if new_dir:
-            icon.enable_rename()
+        file = self.model.add(attrs)
+        if file and new_dir:
+            file.rename = True
+            # new files are at the end, icon enables rename when it shows up
+            self.scroll_y = 0
 
     def add_file(self, attrs):
-        # in case file was overwritten during upload
-        # find the file and remove it from view.
-        for file in self.children:
-            if file.filename == attrs.filename:
-                self.remove_widget(file)
-                self.attrs_list.remove(file.attrs)
-                break
-        self.attrs_list.append(attrs)
+        # file overwritten during upload replaces the old one
+        old = self.model.get(attrs.filename)
+        if old:
+            self.marked_files.discard(old)
         self.add_icon(attrs)
 
+    def find_file(self, name):
+        return self.model.get(name)
+
     def refresh_thumbnail(self, name):
-        for file in self.children:
-            if file.filename == name:
-                file.set_thumbnail()
-                break
+        # thumbnail of not visible file is looked up when its icon shows up
+        file = self.model.get(name)
+        if not file:
+            return
+        file.refresh_thumbnail()
+        icon = self.icon_of(file)
+        if icon:
+            icon.set_thumbnail(reload=True)
 
     def rename_file(self, old, new, file):
         self.originator.rename_file(old=old, new=new, file=file)
 
+    def enable_rename(self, file):
+        icon = self.icon_of(file)
+        if icon:
+            icon.enable_rename()
+        else:
+            file.rename = True
+
     def remove_file(self, file):
         """
-        Removes icon from filespace.
-        Icon can be given as filename (str) or object as instance of FileTile, FileDetails etc.
+        Removes file from filespace.
+        File can be given as filename (str) or FileItem.
         """
         if type(file) == str:
-            for _file in self.children:
-                if file == _file.filename:
-                    file = _file
-                    break
-            else:
+            file = self.find_file(file)
+            if not file:
                 return
+        elif self.model.get(file.filename) is not file:
+            return
 
-        for i, attrs in enumerate(self.attrs_list):
-            if file.filename == attrs.filename:
-                self.attrs_list.pop(i)
+        self.marked_files.discard(file)
+        self.model.remove(file.filename)
 
-        self.remove_widget(file)
+    def file_renamed(self, file, old):
+        """attrs of file were changed to the renamed ones"""
+        self.model.rename(file, old)
+        self.refresh_item(file)
 
     def sort_files(self, sort_by=None):
-
+        """
+        Sorts files in place, directories first. Icons are reused, only their data changes.
+        Files equal by chosen key are sorted by name.
+        """
         if sort_by == 'Name':
-            self.sort_by = 'filename'
+            self.sort_by = 'name'
         elif sort_by == 'Date added':
             self.sort_by = 'st_atime'
         elif sort_by == 'Date modified':
             self.sort_by = 'st_mtime'
         elif sort_by == 'Size':
-            self.sort_by = 'st_size'
+            self.sort_by = 'size'
+        elif sort_by == 'Type':
+            self.sort_by = 'type'
 
-        self.attrs_list.sort(key=lambda x: (x.__dict__[self.sort_by]), reverse=self.reverse)
-        self.fill(self.attrs_list)
+        keys = [('dirs', False), (self.sort_by, self.reverse)]
+        if self.sort_by != 'name':
+            keys.append(('name', False))
+        self.model.sort(keys)
 
     def file_size(self, size):
-        for file in self.children:
-            file.resize(size)
-
-        self.do_layout()
+        self.size_name = size
+        self.set_layout()
+        self.level_changed()
+
+    def thumb_level(self):
+        """Level of thumbnails which fits the icons, details show small pictures"""
+        return 'Small' if self.icon is FileDetails else self.size_name
+
+    def level_changed(self):
+        """Icons show thumbnails of the new level, cached ones at once and the rest when fetched"""
+        level = self.thumb_level()
+        if level == self.level:
+            return
+        self.level = level
+        for file in self.model.files.values():
+            file.refresh_thumbnail()
+        for icon in self.visible_icons():
+            if icon.item:
+                icon.set_thumbnail()
+        self.originator.thumb_level_changed()
 
     # mouse behavior [on_touch_down, on_touch_up, on_touch_move]
     def on_mouse_move(self, *args):
         mouse_pos = args[1]
 
         if not self.originator.mouse_locked:
-            for child in self.children:
-                
-                if child.focus:
-                    child.background_color = child.focused_color
-
-                elif child.collide_point(*child.to_widget(*mouse_pos))\
-                        and not (is_file(child.attrs) and self.moving):
-                    # do not change background color of icons when moving files and mouse dosesn't point directory
-                    child.background_color = child.active_color
-
-                else:
-                    child.background_color = child.unactive_color
+            hovered = None
+            if self.collide_point(*self.to_widget(*mouse_pos)):
+                hovered = self.file_at(self.to_layout(*mouse_pos))
+
+            if hovered is not self.hovered_file:
+                # only icons of previous and current hovered file change their color
+                previous, self.hovered_file = self.hovered_file, hovered
+                for file in (previous, hovered):
+                    icon = self.icon_of(file) if file else None
+                    if icon:
+                        icon.update_background()
+                if hovered and hovered.file_type == 'dir':
+                    self.originator.prefetch_first(hovered.filename)
 
     def on_touch_down(self, touch):
         self.touch = touch
@@ -145,8 +271,9 @@ class FilesSpace(StackLayout):
         if not self.touched_file:
             self.marked_files.clear()
             self.on_popup_dismiss()
-            for file in self.children:
+            for file in self.data:
                 file.focus = False
+            self.refresh_focus()
             if touch.button == 'right':
                 self.show_menu()
 
@@ -159,11 +286,11 @@ class FilesSpace(StackLayout):
 
             elif 'ctrl' in self.pressed_key:
 
-                self.touched_file.focus = True
+                self.set_focus(self.touched_file, True)
 
             elif 'shift' in self.pressed_key:
 
-                indexes = [self.get_file_index(file) for file in self.marked_files]
+                indexes = [index for index in map(self.get_file_index, self.marked_files) if index is not None]
                 current_index = self.get_file_index(self.touched_file)
                 _min = min(indexes)
                 _max = max(indexes)
@@ -177,11 +304,9 @@ class FilesSpace(StackLayout):
                 else:
                     _range = (_max, current_index)
 
-                for i, file in enumerate(self.children):
-                    if _range[0] <= i <= _range[1]:
-                        file.focus = True
-                    else:
-                        file.focus = False
+                for i, file in enumerate(self.data):
+                    file.focus = _range[0] <= i <= _range[1]
+                self.refresh_focus()
 
             elif not self.pressed_key:
                 if self.touched_file not in self.marked_files:
@@ -189,9 +314,10 @@ class FilesSpace(StackLayout):
                     self.marked_files.add(self.touched_file)
 
                 if len(self.marked_files) == 1:
-                    for file in self.children:
-                        if file != self.touched_file:
+                    for file in self.data:
+                        if file is not self.touched_file:
                             file.focus = False
+                    self.refresh_focus()
 
                 if touch.button == 'right':
                     self.show_menu()
@@ -257,15 +383,17 @@ class FilesSpace(StackLayout):
             self.find_marked_files()
 
             if len(self.marked_files) == 1:
-                buttons = ['Rename', 'Download', 'Open', 'Delete']
+                buttons = ['Rename', 'Download', 'Open', 'Delete', 'Copy', 'Duplicate']
                 if self.thumb:
                     buttons.append('Add Thumbnail')
 
             else:
-                buttons = ['Delete', 'Download']
+                buttons = ['Delete', 'Download', 'Copy', 'Duplicate']
 
         else:
             buttons = ['Make dir', 'Refresh']
+            if self.copied_files:
+                buttons.append('Paste')
 
         menu_popup(originator=self,
                    buttons=buttons,
@@ -275,7 +403,7 @@ class FilesSpace(StackLayout):
 
     def menu(self, option):
         if option == 'Refresh':
-            self.originator.list_dir()
+            self.originator.refresh()
         elif option == 'Delete':
             self.remove_popup()
         elif option == 'Open':
@@ -284,15 +412,21 @@ class FilesSpace(StackLayout):
             self.download(self.touched_file)
         elif option == 'Make dir':
             self.make_dir()
+        elif option == 'Copy':
+            self.copy_files()
+        elif option == 'Duplicate':
+            self.find_marked_files()
+            self.originator.copy_remote(self.remote_paths(self.marked_files))
+        elif option == 'Paste':
+            self.originator.copy_remote(self.copied_files)
         elif option == 'Rename':
-
-            self.touched_file.enable_rename()
+            self.enable_rename(self.touched_file)
         elif option == 'Add Thumbnail':
             self.unbind_external_drop()
             thumbnail_popup(originator=self,
                             destination=self.originator.get_current_path(),
                             filename=self.touched_file.filename,
-                            sftp=self.originator.sftp)
+                            remote_dir=self.originator)
 
 
     def bind_external_drop(self):
@@ -303,10 +437,8 @@ class FilesSpace(StackLayout):
 
     def make_dir(self):
         i = 0
-        for child in self.children:
-            print('NAME', child.filename)
-            if 'New dir' in child.filename:
-                print('     New dir in')
+        for file in self.data:
+            if 'New dir' in file.filename:
                 i += 1
         if i:
             name = f'New dir {i}'
@@ -323,34 +455,51 @@ class FilesSpace(StackLayout):
 
     def find_touched_file(self, pos):
         """Looks for files that was marked on touch down or on touch move"""
+        return self.file_at(self.to_layout(*self.to_window(*pos)))
 
-        for file in self.children:
-            if file.collide_point(*pos):
-                return file
-        else:
+    def to_layout(self, x, y):
+        """Window coordinates to coordinates of icons"""
+        return self.layout_manager.to_widget(x, y)
+
+    def file_at(self, pos, exclude=None):
+        """Returns file which icon is at pos given in coordinates of icons"""
+        index = self.layout_manager.index_at(pos)
+        if index is None or index >= len(self.data):
             return None
+        file = self.data[index]
+        return file if file is not exclude else None
 
     def focus_marked_files(self):
-        """Focusing widgets colliding with drawn rectangle"""
-        for file in self.children:
-            if file.collide_rectangle(*self.mark_rectangle):
-                file.focus = True
-            else:
-                file.focus = False
+        """Focusing files colliding with drawn rectangle"""
+        x, y, right, top = self.mark_rectangle
+        x, y = self.to_layout(*self.to_window(x, y))
+        right, top = self.to_layout(*self.to_window(right, top))
+        _x, _right = min(x, right), max(x, right)
+        _y, _top = min(y, top), max(y, top)
+        data = self.data
+        area = {data[index] for index in self.layout_manager.indexes_in(_x, _y, _right, _top)
+                if index < len(data)}
+        # only files which entered or left the rectangle change
+        for file in self.marked_area - area:
+            self.set_focus(file, False)
+        for file in area - self.marked_area:
+            self.set_focus(file, True)
+        self.marked_area = area
 
     def find_marked_files(self):
         """
         Lokiing for a focused file and adding to marked_files
         """
 
-        for file in self.children:
+        for file in self.data:
             if file.focus:
                 self.marked_files.add(file)
 
     def move_files(self, dx, dy):
         self.moving = True
-        for file in self.marked_files:
-            file.set_pos(dx, dy)
+        for icon in self.visible_icons():
+            if icon.item in self.marked_files:
+                icon.set_pos(dx, dy)
 
     def external_dropfile(self, window, localpath):
         """
@@ -359,7 +508,7 @@ class FilesSpace(StackLayout):
 
         destination = None
         if window:
-            touched = self.find_touched_file(self.to_widget(window._mouse_x, window.height - window._mouse_y))
+            touched = self.file_at(self.to_layout(window._mouse_x, window.height - window._mouse_y))
 
             if touched and touched.file_type == 'dir':
                 destination = touched.filename
@@ -374,15 +523,17 @@ class FilesSpace(StackLayout):
 
     def unfocus_files(self, files=None):
         """
-        Unfocus files from self.children in they are not in files list
+        Unfocus files which are not in files list
         """
         if files:
-            for file in self.children:
+            for file in self.data:
                 if file not in files:
                     file.focus = False
+            self.refresh_focus()
         files.clear()
 
     def mark_area(self, pos):
+        self.marked_area = set()
         with self.canvas:
             Color(0, 0, 0, .2)
             self.rectangle = Rectangle(pos=pos, size=(0, 0))
@@ -399,9 +550,10 @@ class FilesSpace(StackLayout):
         return mark_files
 
     def mark_all_files(self):
-        for file in self.children:
+        for file in self.data:
             file.focus = True
             self.marked_files.add(file)
+        self.refresh_focus()
 
     def remove_mark_area(self):
         self.rectangle.size = (0, 0)
@@ -436,17 +588,24 @@ class FilesSpace(StackLayout):
                 elif self.pressed_key == 'n' and 'ctrl' in modifiers and 'shift' in modifiers:
                     self.make_dir()
 
+                elif self.pressed_key == 'enter':
+                    self.on_enter()
+
             except Exception:
                 pass
 
     # end keyboard management
+    def remote_paths(self, files):
+        wd = self.originator.get_current_path()
+        return [(posix_path(wd, file.filename), file.file_type == 'dir') for file in files]
+
     def copy_files(self):
-        self.copied_files.clear()
-        wd = self.originator.get_cwd()
-        for file in self.marked_files:
-            self.copied_files.append(os.path.join(wd, file.filename))
+        """Remembers marked files to be pasted with remote copy"""
+        self.find_marked_files()
+        self.copied_files = self.remote_paths(self.marked_files)
 
     def paste_files(self):
+        """Uploads files copied in Windows or copies on server files copied in this app"""
         clipboard.OpenClipboard()
         files = ()
         if clipboard.IsClipboardFormatAvailable(clipboard.CF_HDROP):
@@ -459,6 +618,20 @@ class FilesSpace(StackLayout):
             file = bytes(file, 'utf-8')
             self.external_dropfile(None, file)
 
+        if not files and self.copied_files:
+            self.originator.copy_remote(self.copied_files)
+
+    def on_enter(self):
+        """Confirms rename of a file or opens marked file"""
+        for icon in self.visible_icons():
+            if icon.ids.filename.focus:
+                icon.on_enter()
+                return
+
+        self.find_marked_files()
+        if len(self.marked_files) == 1:
+            self.open_file(next(iter(self.marked_files)))
+
     def open_file(self, file):
         self.originator.open_file(file)
 
@@ -483,13 +656,14 @@ class FilesSpace(StackLayout):
         elif icon == 'Details':
             self.icon = FileDetails
 
-        self.sort_files()
+        self.viewclass = self.icon
+        self.set_layout()
+        self.level_changed()
 
     def remove(self, popup, _, answer):
         if answer == 'yes':
             self.find_marked_files()
-            for file in self.marked_files:
-                self.originator.remove(file)
+            self.originator.remove(list(self.marked_files))
 
         self.on_popup_dismiss()
         popup.dismiss()
@@ -1,29 +1,14 @@
 from iconcontroller import IconController
-from kivy.clock import Clock
 
 
 class FileTile(IconController):
+    widths = {'Small': 100, 'Medium': 160, 'Huge': 300}
 
-    def __init__(self, attrs, file_type, space, **kwargs):
-        super().__init__(attrs, file_type, space, **kwargs)
-        space.add_widget(self)
-        self._keyboard.bind(on_enter=self.on_enter)
-        self._keyboard.bind(on_key_down=self.key_press)
-        self.i = 0
-
-    def new_name(self, _):
-        self.filename = str(self.i)
-        self.i += 1
-
-    def resize(self, size):
-        if size == 'Small':
-            width = 100
-        elif size == 'Medium':
-            width = 160
-        else:
-            width = 300
-
-        self.ids.pic.size = width, width
+    @classmethod
+    def layout_size(cls, size):
+        """Size of tile in FilesSpace layout, the name needs up to 3 lines below the picture"""
+        width = cls.widths.get(size, cls.widths['Huge'])
+        return width, int(width * 1.5)
 
     def set_pos(self, dx, dy):
         self.pos = self.pos[0] + dx, self.pos[1] + dy
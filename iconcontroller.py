@@ -1,82 +1,94 @@
-from kivy.properties import StringProperty, BooleanProperty
+from kivy.properties import StringProperty, BooleanProperty, ObjectProperty
 from kivy.uix.boxlayout import BoxLayout
-from kivy.core.window import Window
+from kivy.uix.recycleview.views import RecycleDataViewBehavior
 from pathvalidate import ValidationError, validate_filename
-from common import get_progid, convert_file_size, unix_time, forbidden_names, find_thumb, thumbnails
+from common import forbidden_names, is_file
+from managers.texturecache import texture_cache
 from kivy.clock import Clock
 
 
-class IconController(BoxLayout):
-
+class IconController(RecycleDataViewBehavior, BoxLayout):
+    """
+    Icon of a file in FilesSpace. Icons are reused for different files while scrolling,
+    refresh_view_attrs shows the given FileItem.
+    """
     filename = StringProperty()
     date_added = StringProperty()
     date_modified = StringProperty()
     focus = BooleanProperty()
     image = StringProperty()
+    texture = ObjectProperty(None, allownone=True)
     description = StringProperty()
     filesize = StringProperty()
 
-    def __init__(self, attrs, file_type, space, **kwargs):
+    def __init__(self, **kwargs):
         super().__init__(**kwargs)
-        self._keyboard = Window.request_keyboard(self.key_press, self)
-        self._keyboard.bind(on_key_down=self.key_press)
-        self._keyboard.bind(on_key_up=self.key_up)
-        self.attrs = attrs
-        self.filename = self.attrs.filename
-        self.path = attrs.path
-        self.date_added = unix_time(attrs.st_atime)
-        self.date_modified = unix_time(attrs.st_mtime)
-        self.space = space
-        self.filesize = convert_file_size(attrs.st_size)
+        self.item = None
+        self.attrs = None
+        self.path = None
+        self.space = None
         self.focus = False
-        self.file_type = file_type
-        self.description = self.get_description()
+        self.file_type = None
         self.previous_touch = None
         self.collided = False
-        self.pressed_key = ''
         self.counter = 0
-        self.set_thumbnail()
 
-    @classmethod
-    def from_attrs(cls, attrs, space):
-        if attrs.longname[0] == 'd':
-            file_type = 'dir'
+    def refresh_view_attrs(self, rv, index, data):
+        self.space = rv
+        self.item = data
+        self.attrs = data.attrs
+        self.path = data.path
+        self.file_type = data.file_type
+        self.filename = data.filename
+        self.focus = data.focus
+        self.update_background()
+        self.date_added = data.date_added
+        self.date_modified = data.date_modified
+        self.filesize = data.filesize
+        self.description = data.description
+        self.counter = 0
+        self.ids.filename.disabled = True
+        self.set_thumbnail()
+        if data.rename:
+            data.rename = False
+            self.enable_rename()
+
+    @property
+    def pressed_key(self):
+        return self.space.pressed_key if self.space else ''
+
+    def on_focus(self, *_):
+        if self.item:
+            self.item.focus = self.focus
+        self.update_background()
+
+    def update_background(self):
+        if self.focus:
+            self.background_color = self.focused_color
+        elif self.space and self.item and self.space.hovered_file is self.item \
+                and not (is_file(self.attrs) and self.space.moving):
+            # do not highlight files while moving files, only directories they can be dropped to
+            self.background_color = self.active_color
         else:
-            file_type = 'file'
-        return cls(attrs=attrs, file_type=file_type, space=space)
-
-    @classmethod
-    def unfocus(cls):
-        cls.focus = False
-
-    def set_thumbnail(self):
-        image = None
-        if self.attrs.thumbnail:
-            image = find_thumb(self.path, self.filename)
+            self.background_color = self.unactive_color
 
-        if image:
+    def set_thumbnail(self, reload=False):
+        """
+        Shows texture of thumbnail from texture_cache, or nothing until it is decoded.
+        Reloaded image keeps the old texture until the new one is ready.
+        """
+        image, mtime = self.item.thumbnail(self.space.level)
+        if image != self.image:
             self.image = image
-        elif self.file_type == 'dir':
-            self.image = 'img/dir.png'
-        else:
-            self.image = 'img/unknown.png'
-        self.ids.image.reload()
-
-    def get_description(self):
-        if self.file_type == 'dir':
-            return 'Directory'
-        else:
-            return get_progid(self.filename)
-
-    def key_up(self, *args):
-        self.pressed_key = None
+            self.texture = None
+        texture = texture_cache.request(image, mtime, self.texture_ready, reload=reload)
+        if texture:
+            self.texture = texture
 
-    def key_press(self, *args):
-        if len(args) == 4:
-            self.pressed_key = args[1][1]
-            if self.focus:
-                if self.pressed_key == 'enter':
-                    self.on_enter()
+    def texture_ready(self, image, texture):
+        # icon may show another file already
+        if image == self.image:
+            self.texture = texture
 
     def on_enter(self):
         """
@@ -85,7 +97,7 @@ class IconController(BoxLayout):
         if self.ids.filename.focus:
             self.rename_file(self.ids.filename.text.replace('\n', ''))
         elif self.focus:
-            self.space.open_file(self)
+            self.space.open_file(self.item)
 
     def filename_valid(self, text):
 
@@ -121,7 +133,7 @@ class IconController(BoxLayout):
         if not self.filename_valid(text):
             return
         if text != self.filename:
-            self.space.rename_file(old=self.filename, new=text, file=self)
+            self.space.rename_file(old=self.filename, new=text, file=self.item)
             self.ids.filename.disabled = True
             self.focus = False
 
@@ -164,15 +176,12 @@ class IconController(BoxLayout):
         self.previous_touch = touch
         if self.collide_point(*touch.pos) and self.focus:
             # print('  FOCUSED FILEBOX', self.filename)
-            for file in self.space.children:
-                if file is not self and file.collide_point(*touch.pos):
-                    # print('COLLIDED', file.filename, file.file_type, self.filename, self.file_type)
-                    if file.file_type == 'dir':
-                        self.space.internal_file_drop(file)
-                        break
+            file = self.space.file_at(touch.pos, exclude=self.item)
+            if file and file.file_type == 'dir':
+                self.space.internal_file_drop(file)
             else:
-                # do layout if moved file is not dropped on directory
-                self.space.do_layout()
+                # move icons back if moved file is not dropped on directory
+                self.space.restore_positions()
 
         # Dispatch touch event to the rest of the widget tree
         return super().on_touch_up(touch)
@@ -1,6 +1,15 @@
 from kivy.uix.label import Label
+from kivy.uix.recycleview.views import RecycleDataViewBehavior
 
 
-class InfoLabel(Label):
-    def __init__(self, text):
-        super().__init__(text=text)
+class InfoLabel(RecycleDataViewBehavior, Label):
+    def __init__(self, text='', **kwargs):
+        super().__init__(text=text, **kwargs)
+        self.transfer = None
+
+    def refresh_view_attrs(self, rv, index, data):
+        self.transfer = data
+        self.refresh()
+
+    def refresh(self):
+        self.text = self.transfer.desc
@@ -1,42 +1,53 @@
-from common_funcs import mk_logger
-from kivy.config import Config
-Config.set('graphics', 'multisamples', '0')
-Config.set('graphics', 'width', '1066')
-Config.set('graphics', 'height', '600')
-Config.set('input', 'mouse', 'mouse, multitouch_on_demand')
-
-from colors import colors
-from kivy.app import App
-from kivy.lang.builder import Builder
-from remotedir import RemoteDir
-from kivy.factory import Factory
-from adjustabletextinput import AdjustableTextInput
-from progressbox import ProgressBox
-from filesspace import FilesSpace
-import os
-
-logger = mk_logger(__name__)
-
-
-class Main(App):
-
-    def build(self):
-        logger.info('APP STARTED')
-        for color in colors.items():
-            setattr(self, color[0], color[1])
-        try:
-            for kv in os.listdir('front'):
-                if kv != 'main.kv':
-                    Builder.load_file(f'front/{kv}')
-        except Exception as ex:
-            logger.exception(f'Failed to load .kv {ex}')
-        else:
-            return Builder.load_file('front/main.kv')
+from multiprocessing import freeze_support
 
 
 if __name__ == '__main__':
+    # thumbnails are made in worker processes, frozen app has to run them instead of itself
+    freeze_support()
+    # workers spawned on Windows import this module again as __mp_main__,
+    # so the app, which opens a window, is imported only here
+    from common_funcs import mk_logger
+    from kivy.config import Config
+    Config.set('graphics', 'multisamples', '0')
+    Config.set('graphics', 'width', '1066')
+    Config.set('graphics', 'height', '600')
+    Config.set('input', 'mouse', 'mouse, multitouch_on_demand')
+
+    from colors import colors
+    from kivy.app import App
+    from kivy.lang.builder import Builder
+    from remotedir import RemoteDir
+    from kivy.factory import Factory
+    from adjustabletextinput import AdjustableTextInput
+    from progressbox import ProgressBox
+    from filesspace import FilesSpace
+    from fileslayout import FilesLayout
+    from processes.pool import thumbnail_pool
+    import os
+
+    logger = mk_logger(__name__)
+
+    class Main(App):
+
+        def build(self):
+            logger.info('APP STARTED')
+            for color in colors.items():
+                setattr(self, color[0], color[1])
+            try:
+                for kv in os.listdir('front'):
+                    if kv != 'main.kv':
+                        Builder.load_file(f'front/{kv}')
+            except Exception as ex:
+                logger.exception(f'Failed to load .kv {ex}')
+            else:
+                return Builder.load_file('front/main.kv')
+
+        def on_stop(self):
+            thumbnail_pool.shutdown()
+
     Factory.register('RemoteDir', cls=RemoteDir)
     Factory.register('AdjustableTextInput', cls=AdjustableTextInput)
     Factory.register('FilesSpace', cls=FilesSpace)
+    Factory.register('FilesLayout', cls=FilesLayout)
     Factory.register('ProgressBox', cls=ProgressBox)
     Main().run()
@@ -0,0 +1,170 @@
+"""
+Size and age limits of the local cache, where opened files and thumbnails are kept.
+
+Last access of every cached file is kept in an sqlite index next to the cache. Accesses
+are recorded in memory by touch() and written to the index when the cache is trimmed, so showing
+thumbnails does not write to disk. trim() removes files not accessed for longer than the age limit,
+then the least recently accessed ones until the cache fits the size limit.
+Pinned files, e.g. opened files watched for changes, are never removed.
+"""
+from common import mk_logger, cache_path, data_path, cache_limits
+from collections import Counter
+from threading import Thread, Lock
+from time import time
+from os import path
+import sqlite3
+import os
+
+logger = mk_logger(__name__)
+ex_log = mk_logger(name=f'{__name__}-EX',
+                   level=40,
+                   _format='[%(levelname)-8s] [%(asctime)s] [%(name)s] [%(funcName)s] [%(lineno)d] [%(message)s]')
+ex_log = ex_log.exception
+
+index_path = path.join(data_path, 'cache_index.sqlite')
+# files of the app itself and files being written
+skipped_suffixes = ('.sqlite', '.sqlite-journal', '.sqlite-wal', '.sqlite-shm', '.part', '.tmp')
+
+
+class CacheManager:
+    def __init__(self, root=cache_path, index=index_path):
+        self.root = root
+        self.index = index
+        self.lock = Lock()
+        self.trim_lock = Lock()
+        # path: time of access not written to the index yet
+        self.touched = {}
+        self.pinned = Counter()
+        self.evicted_files = 0
+        self.evicted_bytes = 0
+        self.files = 0
+        self.bytes = 0
+        self.last_trim = None
+
+    def db(self):
+        os.makedirs(path.dirname(self.index), exist_ok=True)
+        db = sqlite3.connect(self.index, timeout=10)
+        db.execute('CREATE TABLE IF NOT EXISTS files (path TEXT PRIMARY KEY, size INTEGER, atime REAL)')
+        return db
+
+    def touch(self, file_path):
+        """file_path was read or shown, it goes to the end of eviction order"""
+        with self.lock:
+            self.touched[file_path] = time()
+
+    def pin(self, file_path):
+        with self.lock:
+            self.pinned[file_path] += 1
+            self.touched[file_path] = time()
+
+    def unpin(self, file_path):
+        with self.lock:
+            self.pinned[file_path] -= 1
+            if self.pinned[file_path] <= 0:
+                del self.pinned[file_path]
+
+    def scan(self):
+        """Returns {path: (size, time of creation or last change)} of cached files"""
+        files = {}
+        for root, _, names in os.walk(self.root):
+            for name in names:
+                if name.endswith(skipped_suffixes):
+                    continue
+                file_path = path.join(root, name)
+                try:
+                    stat = os.stat(file_path)
+                except OSError:
+                    continue
+                # thumbnails have mtime of the remote file, st_ctime is creation time on Windows
+                files[file_path] = (stat.st_size, max(stat.st_mtime, stat.st_ctime))
+        return files
+
+    def trim(self, max_bytes=None, max_age=None):
+        """
+        Removes files over the limits, max_bytes and max_age in seconds, 0 is no limit.
+        By default the limits are taken from settings.
+        """
+        if max_bytes is None or max_age is None:
+            size_mb, age_days = cache_limits()
+            max_bytes = size_mb * 1024 * 1024 if max_bytes is None else max_bytes
+            max_age = age_days * 24 * 3600 if max_age is None else max_age
+
+        with self.trim_lock:
+            with self.lock:
+                touched, self.touched = self.touched, {}
+                pinned = set(self.pinned)
+
+            files = self.scan()
+            with self.db() as db:
+                known = dict(db.execute('SELECT path, atime FROM files'))
+                rows = []
+                for file_path, (size, changed) in files.items():
+                    atime = max(known.get(file_path, 0), touched.get(file_path, 0), changed)
+                    rows.append((file_path, size, atime))
+                rows.sort(key=lambda row: row[2])
+
+                now = time()
+                total = sum(row[1] for row in rows)
+                evicted = []
+                for file_path, size, atime in rows:
+                    if file_path in pinned:
+                        continue
+                    too_old = max_age and now - atime > max_age
+                    if not too_old and (not max_bytes or total <= max_bytes):
+                        # the rest was accessed later and the cache fits
+                        break
+                    try:
+                        os.remove(file_path)
+                    except OSError as oe:
+                        logger.info(f'Could not remove cached {file_path} {oe}')
+                        continue
+                    total -= size
+                    evicted.append((file_path, size))
+
+                removed = {file_path for file_path, _ in evicted}
+                db.execute('DELETE FROM files')
+                db.executemany('INSERT INTO files VALUES (?, ?, ?)',
+                               [row for row in rows if row[0] not in removed])
+
+            self.forget_thumbnails(removed)
+            self.files = len(rows) - len(evicted)
+            self.bytes = total
+            self.evicted_files += len(evicted)
+            self.evicted_bytes += sum(size for _, size in evicted)
+            self.last_trim = now
+        if evicted:
+            logger.info(f'Removed {len(evicted)} cached files, {sum(size for _, size in evicted)} bytes')
+
+    @staticmethod
+    def forget_thumbnails(removed):
+        from managers.thumbindex import thumb_index
+        for file_path in removed:
+            thumb_index.forget(file_path)
+
+    def trim_async(self):
+        if self.trim_lock.locked():
+            return
+        Thread(target=self.safe_trim, daemon=True).start()
+
+    def safe_trim(self):
+        try:
+            self.trim()
+        except Exception as ex:
+            ex_log(f'Failed to trim cache {ex}')
+
+    def stats(self):
+        """Numbers of the last trim, the cache may have grown since"""
+        size_mb, age_days = cache_limits()
+        with self.lock:
+            pinned = len(self.pinned)
+        return {'files': self.files,
+                'bytes': self.bytes,
+                'pinned': pinned,
+                'max_bytes': size_mb * 1024 * 1024,
+                'max_age_days': age_days,
+                'evicted_files': self.evicted_files,
+                'evicted_bytes': self.evicted_bytes,
+                'last_trim': self.last_trim}
+
+
+cache_manager = CacheManager()
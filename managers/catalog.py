@@ -0,0 +1,300 @@
+"""
+Catalog of remote files of a host.
+
+CatalogCrawler walks the remote tree in background and stores every entry in sqlite database
+under catalog_path. A directory is listed again only when its mtime changed since it was listed,
+unchanged ones are descended with subdirectories read from the database and their current mtimes
+asked from the server with pipelined stats, so changes deep under unchanged directories are found.
+Changed size or mtime of a file is not noticed by itself, as writing a file does not change mtime
+of its directory. Such entry is updated when something is added, removed or renamed in its directory.
+
+For searching, names of all entries are kept in memory in one casefolded string, a name per line.
+Substring, glob and regex queries run over that string in C, then only matched rows are read
+from the database.
+"""
+from threading import Thread, Event, Lock
+from paramiko.sftp_attr import SFTPAttributes
+from common import mk_logger, posix_path, catalog_path, thumb_dir
+from sftp.pipeline import RequestPipeline
+from array import array
+from bisect import bisect_right
+from os import path, makedirs
+import sqlite3
+import stat
+import re
+
+logger = mk_logger(__name__)
+ex_log = mk_logger(name=f'{__name__}-EX',
+                   level=40,
+                   _format='[%(levelname)-8s] [%(asctime)s] [%(name)s] [%(funcName)s] [%(lineno)d] [%(message)s]')
+ex_log = ex_log.exception
+
+schema = """
+CREATE TABLE IF NOT EXISTS entries (
+    path TEXT PRIMARY KEY,
+    parent TEXT NOT NULL,
+    name TEXT NOT NULL,
+    size INTEGER,
+    mtime INTEGER,
+    mode INTEGER
+);
+CREATE INDEX IF NOT EXISTS entries_parent ON entries(parent);
+CREATE TABLE IF NOT EXISTS listed (
+    path TEXT PRIMARY KEY,
+    mtime INTEGER
+);
+"""
+
+
+def glob_to_regex(pattern):
+    """Glob pattern matching whole line of names"""
+    out = []
+    i = 0
+    while i < len(pattern):
+        char = pattern[i]
+        if char == '*':
+            out.append('[^\n]*')
+        elif char == '?':
+            out.append('[^\n]')
+        elif char == '[' and pattern.find(']', i + 2) != -1:
+            end = pattern.find(']', i + 2)
+            body = pattern[i + 1:end].replace('\\', '\\\\')
+            if body[0] in '!^':
+                body = '^\n' + body[1:]
+            out.append(f'[{body}]')
+            i = end
+        else:
+            out.append(re.escape(char))
+        i += 1
+    return '^' + ''.join(out) + '$'
+
+
+class SearchIndex:
+    """Names of all entries, a name per line, and rowid of every line"""
+    def __init__(self, rows=()):
+        self.rowids = array('q')
+        self.starts = array('q')
+        names = []
+        offset = 0
+        for rowid, name in rows:
+            name = name.casefold().replace('\n', ' ')
+            self.rowids.append(rowid)
+            self.starts.append(offset)
+            names.append(name)
+            offset += len(name) + 1
+        self.names = '\n'.join(names)
+
+    def __len__(self):
+        return len(self.rowids)
+
+    def line(self, pos):
+        return bisect_right(self.starts, pos) - 1
+
+    def substring(self, text, limit):
+        text = text.casefold()
+        found = []
+        pos = self.names.find(text)
+        while pos != -1 and len(found) < limit:
+            line = self.line(pos)
+            found.append(self.rowids[line])
+            if line + 1 >= len(self.starts):
+                break
+            pos = self.names.find(text, self.starts[line + 1])
+        return found
+
+    def regex(self, pattern, limit):
+        found = []
+        last = -1
+        for match in re.compile(pattern, re.IGNORECASE | re.MULTILINE).finditer(self.names):
+            if '\n' in match.group():
+                continue
+            line = self.line(match.start())
+            if line != last:
+                found.append(self.rowids[line])
+                last = line
+                if len(found) >= limit:
+                    break
+        return found
+
+
+class Catalog:
+    """
+    Catalog of one host. search() can be called on the main thread any time,
+    it uses the last built index while the crawler works.
+    """
+    def __init__(self, host):
+        if not path.exists(catalog_path):
+            makedirs(catalog_path)
+        name = re.sub(r'[^\w.@-]', '_', host)
+        self.db_path = path.join(catalog_path, f'{name}.sqlite')
+        self.index = SearchIndex()
+        self.lock = Lock()
+        self.db = self.open_db()
+        self.crawler = None
+
+    def open_db(self):
+        db = sqlite3.connect(self.db_path, check_same_thread=False)
+        db.execute('PRAGMA journal_mode=WAL')
+        db.executescript(schema)
+        return db
+
+    def load(self):
+        """Builds search index from the database, can take a while for big catalogs"""
+        with self.lock:
+            rows = self.db.execute('SELECT rowid, name FROM entries').fetchall()
+        self.index = SearchIndex(rows)
+        logger.info(f'Catalog index built, {len(self.index)} entries')
+
+    def search(self, query, limit=1000):
+        """
+        Returns list of attrs of matched files, filename of attrs is the full path.
+        query is a substring of a name, a glob pattern when it has any of *?[ or a regex after 're:'.
+        """
+        index = self.index
+        try:
+            if query.startswith('re:'):
+                rowids = index.regex(query[3:], limit)
+            elif any(char in query for char in '*?['):
+                rowids = index.regex(glob_to_regex(query), limit)
+            else:
+                rowids = index.substring(query, limit)
+        except re.error as ree:
+            logger.info(f'Invalid search pattern {query} {ree}')
+            return []
+
+        return self.attrs(rowids)
+
+    def attrs(self, rowids):
+        result = []
+        with self.lock:
+            for i in range(0, len(rowids), 500):
+                part = rowids[i:i + 500]
+                rows = self.db.execute(f'SELECT path, size, mtime, mode FROM entries '
+                                       f'WHERE rowid IN ({",".join("?" * len(part))})', part).fetchall()
+                for _path, size, mtime, mode in rows:
+                    attrs = SFTPAttributes()
+                    attrs.filename = _path
+                    attrs.st_size = size
+                    attrs.st_mtime = mtime
+                    attrs.st_atime = mtime
+                    attrs.st_mode = mode
+                    attrs.longname = str(attrs)
+                    result.append(attrs)
+        return result
+
+    def crawl(self, root, connect):
+        """Starts crawler unless one is running"""
+        if self.crawler and self.crawler.is_alive():
+            return
+        self.crawler = CatalogCrawler(self, root, connect)
+        self.crawler.start()
+
+    def stop(self):
+        if self.crawler:
+            self.crawler.stop()
+
+
+class CatalogCrawler(Thread):
+    """Walks remote tree from root on its own connection and updates the catalog"""
+    commit_every = 200
+
+    def __init__(self, catalog, root, connect):
+        super().__init__(daemon=True)
+        self.catalog = catalog
+        self.root = root
+        self.connect = connect
+        self.stopped = Event()
+        self.listed = 0
+        self.skipped = 0
+
+    def stop(self):
+        self.stopped.set()
+
+    def run(self):
+        if not len(self.catalog.index):
+            self.catalog.load()
+
+        sftp = self.connect()
+        if not sftp:
+            return
+        try:
+            self.crawl(sftp)
+        except Exception as ex:
+            ex_log(f'Catalog crawler failed {ex}')
+        finally:
+            sftp.close()
+            with self.catalog.lock:
+                self.catalog.db.commit()
+
+        logger.info(f'Catalog crawled {self.root}, listed {self.listed}, unchanged {self.skipped} directories')
+        if not self.stopped.is_set():
+            self.catalog.load()
+
+    def crawl(self, sftp):
+        client = sftp.sftp_client
+        db = self.catalog.db
+        lock = self.catalog.lock
+        stack = [(self.root, client.stat(self.root).st_mtime)]
+        while stack and not self.stopped.is_set():
+            dir_path, mtime = stack.pop()
+            with lock:
+                row = db.execute('SELECT mtime FROM listed WHERE path = ?', (dir_path,)).fetchone()
+            if row and row[0] == mtime:
+                self.skipped += 1
+                with lock:
+                    subdirs = db.execute('SELECT path, mode FROM entries WHERE parent = ?', (dir_path,)).fetchall()
+                stack.extend(self.current_mtimes(sftp, [_path for _path, mode in subdirs if stat.S_ISDIR(mode or 0)]))
+                continue
+
+            try:
+                entries = [attrs for attrs in client.listdir_iter(dir_path) if attrs.filename != thumb_dir]
+            except IOError as ie:
+                logger.info(f'Catalog could not list {dir_path} {ie}')
+                continue
+
+            self.store(dir_path, mtime, entries)
+            stack.extend((posix_path(dir_path, attrs.filename), attrs.st_mtime)
+                         for attrs in entries if stat.S_ISDIR(attrs.st_mode or 0))
+
+    @staticmethod
+    def current_mtimes(sftp, paths):
+        """
+        Returns (path, mtime) of paths as they are on the server now. mtimes stored with the parent's
+        listing are of the time it was listed, they do not tell about changes made since.
+        """
+        mtimes = []
+
+        def response(_path, attrs):
+            # removed meanwhile, the parent's listing will be updated when its mtime changes
+            if attrs:
+                mtimes.append((_path, attrs.st_mtime))
+
+        pipeline = RequestPipeline(sftp)
+        for _path in paths:
+            pipeline.lstat(_path, response)
+        pipeline.drain()
+        return mtimes
+
+    def store(self, dir_path, mtime, entries):
+        db = self.catalog.db
+        names = {attrs.filename for attrs in entries}
+        with self.catalog.lock:
+            old = db.execute('SELECT path, name, mode FROM entries WHERE parent = ?', (dir_path,)).fetchall()
+            for _path, name, mode in old:
+                if name in names:
+                    continue
+                if stat.S_ISDIR(mode or 0):
+                    # '0' follows '/', so this range is the whole subtree
+                    db.execute('DELETE FROM entries WHERE path > ? AND path < ?', (f'{_path}/', f'{_path}0'))
+                    db.execute('DELETE FROM listed WHERE path = ? OR (path > ? AND path < ?)',
+                               (_path, f'{_path}/', f'{_path}0'))
+                db.execute('DELETE FROM entries WHERE path = ?', (_path,))
+            # entries listed again keep their rowids, the search index refers to them until it is loaded again
+            db.executemany('INSERT INTO entries VALUES (?, ?, ?, ?, ?, ?) ON CONFLICT(path) DO UPDATE SET '
+                           'size = excluded.size, mtime = excluded.mtime, mode = excluded.mode',
+                           ((posix_path(dir_path, attrs.filename), dir_path, attrs.filename,
+                             attrs.st_size, attrs.st_mtime, attrs.st_mode) for attrs in entries))
+            db.execute('INSERT OR REPLACE INTO listed VALUES (?, ?)', (dir_path, mtime))
+            self.listed += 1
+            if not self.listed % self.commit_every:
+                db.commit()
@@ -0,0 +1,129 @@
+"""
+Listings of remote directories kept for the time of a session.
+
+A listing is trusted for ttl seconds. After that it is revalidated by comparing mtime
+of the directory with the one it was listed with. Changes made by this app (upload, rename,
+remove, mkdir) are applied to cached listings directly, so they do not need to be listed again.
+With such change comes mtime of the directory read right after it, only that mtime is accepted
+on revalidation, so changes of other clients are still noticed.
+"""
+from collections import OrderedDict
+from threading import Lock
+from time import monotonic
+from common import posix_path
+
+
+class Listing:
+    __slots__ = ('path', 'mtime', 'entries', 'checked')
+
+    def __init__(self, path, mtime, attrs_list):
+        self.path = path
+        # expected mtime of the directory, None after a change of unknown mtime
+        self.mtime = mtime
+        self.entries = OrderedDict((attrs.filename, attrs) for attrs in attrs_list)
+        self.checked = monotonic()
+
+    def files(self):
+        return list(self.entries.values())
+
+
+class ListingCache:
+    """
+    LRU cache of listings keyed by remote path. Size is bounded by number of entries of all listings.
+    Methods are thread safe.
+    """
+    def __init__(self, max_entries=500000, ttl=10):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.listings = OrderedDict()
+        self.size = 0
+        self.lock = Lock()
+
+    def __contains__(self, path):
+        return path in self.listings
+
+    def get(self, path):
+        with self.lock:
+            listing = self.listings.get(path)
+            if listing:
+                self.listings.move_to_end(path)
+            return listing
+
+    def put(self, path, mtime, attrs_list):
+        with self.lock:
+            self._drop(path)
+            if len(attrs_list) > self.max_entries:
+                return
+            listing = Listing(path, mtime, attrs_list)
+            self.listings[path] = listing
+            self.size += len(listing.entries)
+            while self.size > self.max_entries:
+                self._drop(next(iter(self.listings)))
+
+    def is_fresh(self, listing):
+        return monotonic() - listing.checked < self.ttl
+
+    def revalidate(self, listing, mtime):
+        """
+        Checks listing against current mtime of its directory.
+        Returns True if the listing can still be used.
+        """
+        with self.lock:
+            if listing.mtime != mtime:
+                self._drop(listing.path)
+                return False
+            listing.checked = monotonic()
+            return True
+
+    def add(self, path, attrs, mtime=None):
+        """File was uploaded, copied or made in path, mtime is the one of path after that"""
+        with self.lock:
+            listing = self.listings.get(path)
+            if not listing:
+                return
+            if attrs.filename not in listing.entries:
+                self.size += 1
+            listing.entries[attrs.filename] = attrs
+            listing.mtime = mtime
+
+    def remove(self, path, name, mtime=None):
+        """File name was removed from directory path"""
+        with self.lock:
+            self._drop_tree(posix_path(path, name))
+            listing = self.listings.get(path)
+            if listing and listing.entries.pop(name, None) is not None:
+                self.size -= 1
+                listing.mtime = mtime
+
+    def rename(self, path, old, new, attrs, mtime=None):
+        with self.lock:
+            self._drop_tree(posix_path(path, old))
+            listing = self.listings.get(path)
+            if not listing:
+                return
+            if listing.entries.pop(old, None) is not None:
+                self.size -= 1
+            if attrs:
+                listing.entries[new] = attrs
+                self.size += 1
+            listing.mtime = mtime
+
+    def invalidate(self, path):
+        with self.lock:
+            self._drop(path)
+
+    def clear(self):
+        with self.lock:
+            self.listings.clear()
+            self.size = 0
+
+    def _drop(self, path):
+        listing = self.listings.pop(path, None)
+        if listing:
+            self.size -= len(listing.entries)
+
+    def _drop_tree(self, path):
+        """Drops listing of path and all its subdirectories"""
+        prefix = path.rstrip('/') + '/'
+        for _path in [_path for _path in self.listings if _path == path or _path.startswith(prefix)]:
+            self._drop(_path)
@@ -0,0 +1,207 @@
+"""
+Progress of transfers reported by worker threads.
+
+Workers never touch widgets. They write the latest state to their TransferProgress
+and put it once on a deque of changed transfers. ProgressAggregator drains the deque
+on the main thread a fixed number of times per second, so any number of paramiko
+callbacks between two frames costs a single widget update.
+"""
+from collections import deque
+from time import monotonic
+from common import convert_file_size
+
+
+class TransferProgress:
+    """
+    Thread side of a progress row.
+    It has the methods workers used to call on ProgressRow widget.
+    It is also the data item of the transfers RecycleView so it is kept small.
+    """
+    __slots__ = ('aggregator', 'index', 'my_thread', 'progress', 'desc', 'actions', 'completed', 'flushed',
+                 'progress_callback', 'is_dirty', 'counted_done', 'counted_total', 'counted_completed')
+    kind = 'transfer'
+    viewclass = 'ProgressRow'
+
+    def __init__(self, aggregator, desc=''):
+        self.aggregator = aggregator
+        self.index = None
+        self.my_thread = None
+        self.progress = ()
+        self.desc = desc
+        self.actions = False
+        self.completed = False
+        self.flushed = False
+        self.progress_callback = None
+        self.is_dirty = False
+        # bytes already counted in aggregator totals
+        self.counted_done = 0
+        self.counted_total = 0
+        self.counted_completed = False
+
+    def changed(self):
+        # the flag is cleared by aggregator before it reads the state, so the last change is never lost
+        if not self.is_dirty:
+            self.is_dirty = True
+            self.aggregator.changes.append(self)
+
+    def set_values(self, desc=''):
+        self.desc = desc
+        self.changed()
+
+    def update(self, *args):
+        self.progress = args
+        self.flushed = False
+        self.changed()
+
+    def file_exists_error(self):
+        self.actions = True
+        self.changed()
+
+    def hide_actions(self):
+        self.actions = False
+        self.changed()
+
+    def done(self):
+        self.desc = f'{self.desc} - Completed'
+        self.completed = True
+        self.actions = False
+        self.changed()
+
+    def flush(self):
+        self.flushed = True
+        self.changed()
+
+    def overwrite(self):
+        self.my_thread.overwrite()
+
+    def skip(self):
+        self.my_thread.skip()
+        self.hide_actions()
+
+    def get(self, key, default=None):
+        # RecycleView reads view class and layout options of data items with get
+        if key == 'viewclass':
+            return self.viewclass
+        return default
+
+    def ratio(self):
+        if self.flushed or not self.progress or not self.progress[1]:
+            return 0
+        return self.progress[0] / self.progress[1]
+
+
+class InfoProgress(TransferProgress):
+    """Row with text only, e.g. summary of removing files"""
+    __slots__ = ()
+    kind = 'info'
+    viewclass = 'InfoLabel'
+
+
+class ProgressAggregator:
+    """
+    Collects changes of all transfers and computes totals.
+    drain() must be called on the main thread, on_changes(transfers) is called with changed transfers.
+    """
+    def __init__(self, on_added=None, on_changes=None, rate_smoothing=.3):
+        self.added = deque()
+        self.changes = deque()
+        self.transfers = []
+        self.on_added = on_added
+        self.on_changes = on_changes
+        self.rate_smoothing = rate_smoothing
+        self.bytes_done = 0
+        self.bytes_total = 0
+        self.files_done = 0
+        self.files_total = 0
+        self.rate = 0
+        self.last_drain = monotonic()
+
+    def mk_transfer(self, desc=''):
+        return TransferProgress(self, desc)
+
+    def mk_info(self, desc=''):
+        return InfoProgress(self, desc)
+
+    def add(self, transfer):
+        self.added.append(transfer)
+
+    def drain(self, *_):
+        now = monotonic()
+        dt = now - self.last_drain
+        self.last_drain = now
+
+        added = []
+        while self.added:
+            transfer = self.added.popleft()
+            transfer.index = len(self.transfers) + len(added)
+            added.append(transfer)
+        if added:
+            self.transfers.extend(added)
+            self.files_total += sum(1 for transfer in added if transfer.kind == 'transfer')
+            if self.on_added:
+                self.on_added(added)
+
+        changed = []
+        done_before = self.bytes_done
+        while self.changes:
+            transfer = self.changes.popleft()
+            transfer.is_dirty = False
+            self.count(transfer)
+            changed.append(transfer)
+
+        if dt > 0:
+            current = max(self.bytes_done - done_before, 0) / dt
+            self.rate = self.rate_smoothing * current + (1 - self.rate_smoothing) * self.rate
+
+        if changed and self.on_changes:
+            self.on_changes(changed)
+            for transfer in changed:
+                if transfer.progress_callback and transfer.progress:
+                    transfer.progress_callback(transfer.progress)
+
+    def count(self, transfer):
+        if transfer.kind != 'transfer':
+            return
+        if transfer.completed and not transfer.counted_completed:
+            transfer.counted_completed = True
+            self.files_done += 1
+        if not transfer.progress:
+            return
+        done, total = transfer.progress[:2]
+        self.bytes_done += done - transfer.counted_done
+        self.bytes_total += total - transfer.counted_total
+        transfer.counted_done = done
+        transfer.counted_total = total
+
+    def clear(self):
+        self.added.clear()
+        self.changes.clear()
+        self.transfers.clear()
+        self.bytes_done = 0
+        self.bytes_total = 0
+        self.files_done = 0
+        self.files_total = 0
+        self.rate = 0
+
+    def waiting(self):
+        """Transfers waiting for user to choose overwrite or skip"""
+        return [transfer for transfer in self.transfers if transfer.actions and transfer.my_thread]
+
+    def undone(self):
+        return [transfer for transfer in self.transfers if transfer.my_thread and not transfer.my_thread.done]
+
+    def eta(self):
+        """Seconds left or None when nothing is being transferred"""
+        if self.rate < 1 or self.bytes_done >= self.bytes_total:
+            return None
+        return (self.bytes_total - self.bytes_done) / self.rate
+
+    def summary(self):
+        text = f'{self.files_done}/{self.files_total} files, ' \
+               f'{convert_file_size(self.bytes_done)} of {convert_file_size(self.bytes_total)}'
+        eta = self.eta()
+        if eta is not None:
+            minutes, seconds = divmod(int(eta), 60)
+            hours, minutes = divmod(minutes, 60)
+            text += f', {convert_file_size(int(self.rate))}/s, ETA {hours}:{minutes:02}:{seconds:02}'
+        return text
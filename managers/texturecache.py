@@ -0,0 +1,149 @@
+"""
+Textures of thumbnails and icons shared by all icons of FilesSpace.
+
+Images are decoded by PIL in a background thread, the UI thread only uploads the decoded pixels
+to textures, a few of them per frame. Textures are kept in LRU order up to max_bytes and keyed by
+path and mtime of the image given by the caller, so the same image is decoded once however many times
+icons show it, while a changed thumbnail is decoded again. An image which can't be decoded is shown
+as fallback_image and remembered under its key, so it is not decoded again on every bind.
+"""
+from kivy.graphics.texture import Texture
+from kivy.clock import Clock
+from collections import OrderedDict, deque
+from threading import Thread, Lock, Condition
+from common import mk_logger
+from time import perf_counter
+from PIL import Image
+
+logger = mk_logger(__name__)
+ex_log = mk_logger(name=f'{__name__}-EX',
+                   level=40,
+                   _format='[%(levelname)-8s] [%(asctime)s] [%(name)s] [%(funcName)s] [%(lineno)d] [%(message)s]')
+ex_log = ex_log.exception
+
+
+fallback_image = 'img/unknown.png'
+
+
+def decode(path):
+    """Returns (size, colorfmt, pixels) of image at path"""
+    with Image.open(path) as image:
+        image.draft('RGB', (300, 300))
+        fmt = 'rgba' if image.mode in ('RGBA', 'LA', 'P') else 'rgb'
+        image = image.convert(fmt.upper())
+        # textures are filled from the bottom row
+        image = image.transpose(Image.FLIP_TOP_BOTTOM)
+        return image.size, fmt, image.tobytes()
+
+
+class TextureCache:
+    """
+    request(path, mtime, callback) returns cached texture of path or None and calls
+    callback(path, texture) in UI thread when the image is decoded and uploaded.
+    Methods are meant to be called from UI thread.
+    """
+    def __init__(self, max_bytes=96 * 1024 * 1024, frame_budget=.004):
+        self.max_bytes = max_bytes
+        self.frame_budget = frame_budget
+        self.textures = OrderedDict()
+        # path: its cached key, texture of older version of the image is dropped
+        self.keys = {}
+        self.bytes = 0
+        # key: callbacks waiting for the texture
+        self.waiting = {}
+        self.lock = Lock()
+        self.ready = Condition(self.lock)
+        # the latest requests are decoded first, they are the icons just scrolled into view
+        self.to_decode = deque()
+        self.decoded = deque()
+        self.upload_trigger = Clock.create_trigger(self.upload)
+        self.worker = None
+        # shared by all images which failed to decode, not counted in bytes
+        self.fallback = None
+
+    def request(self, path, mtime, callback, reload=False):
+        key = path, mtime
+        if reload:
+            self.discard(key)
+        texture = self.textures.get(key)
+        if texture:
+            self.textures.move_to_end(key)
+            return texture
+
+        callbacks = self.waiting.get(key)
+        if callbacks is not None:
+            callbacks.append(callback)
+            return None
+        self.waiting[key] = [callback]
+        with self.lock:
+            self.to_decode.append(key)
+            self.ready.notify()
+        if not self.worker:
+            self.worker = Thread(target=self.decode_loop, daemon=True)
+            self.worker.start()
+        return None
+
+    def discard(self, key):
+        texture = self.textures.pop(key, None)
+        if texture:
+            self.bytes -= self.texture_bytes(texture)
+
+    def texture_bytes(self, texture):
+        return 0 if texture is self.fallback else texture.width * texture.height * 4
+
+    def decode_loop(self):
+        while True:
+            with self.lock:
+                while not self.to_decode:
+                    self.ready.wait()
+                key = self.to_decode.pop()
+            try:
+                result = decode(key[0])
+            except Exception as ex:
+                logger.info(f'Failed to decode {key[0]} {ex}')
+                result = None
+            self.decoded.append((key, result))
+            self.upload_trigger()
+
+    def upload(self, _):
+        """Uploads decoded images to textures until the frame budget is spent"""
+        start = perf_counter()
+        while self.decoded and perf_counter() - start < self.frame_budget:
+            key, result = self.decoded.popleft()
+            callbacks = self.waiting.pop(key, [])
+            texture = self.mk_texture(result) if result else self.fallback_texture()
+            if not texture:
+                continue
+            self.add(key, texture)
+            for callback in callbacks:
+                callback(key[0], texture)
+        if self.decoded:
+            self.upload_trigger()
+
+    @staticmethod
+    def mk_texture(result):
+        size, fmt, pixels = result
+        texture = Texture.create(size=size, colorfmt=fmt)
+        texture.blit_buffer(pixels, colorfmt=fmt, bufferfmt='ubyte')
+        return texture
+
+    def fallback_texture(self):
+        if self.fallback is None:
+            try:
+                self.fallback = self.mk_texture(decode(fallback_image))
+            except Exception as ex:
+                ex_log(f'Failed to decode {fallback_image} {ex}')
+        return self.fallback
+
+    def add(self, key, texture):
+        self.discard(self.keys.get(key[0]))
+        self.keys[key[0]] = key
+        self.textures[key] = texture
+        self.bytes += self.texture_bytes(texture)
+        while self.bytes > self.max_bytes and len(self.textures) > 1:
+            old_key, old = self.textures.popitem(last=False)
+            self.keys.pop(old_key[0], None)
+            self.bytes -= self.texture_bytes(old)
+
+
+texture_cache = TextureCache()
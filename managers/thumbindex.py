@@ -0,0 +1,131 @@
+"""
+Index of cached thumbnails of remote directories.
+
+Thumbnails of a remote directory are cached in one local directory. It is scanned once,
+when a thumbnail of the directory is looked up for the first time, and then kept in sync by
+the code which downloads, makes, renames and removes thumbnails, so looking up a thumbnail
+of a file does not touch the disk. Each level of thumbnails (see common.thumb_levels) has its own directory.
+"""
+from collections import OrderedDict
+from threading import Lock
+from common import pure_windows_path, cache_path, thumb_dir, thumb_levels, base_level
+import os
+
+
+def thumbnail_of(thumbnail):
+    """Name of the file the thumbnail belongs to, thumbnail is name of the file with image extension"""
+    return '.'.join(thumbnail.split('.')[0: -1])
+
+
+class ThumbIndex:
+    """
+    Thumbnails keyed by remote directory and name of file, as (thumbnail name, mtime).
+    Indexes of at most max_dirs directories are kept. Methods are thread safe.
+    """
+    def __init__(self, max_dirs=1000):
+        self.max_dirs = max_dirs
+        self.dirs = OrderedDict()
+        self.lock = Lock()
+
+    @staticmethod
+    def local_dir(path, level=base_level):
+        return pure_windows_path(cache_path, path.strip('/'), thumb_dir, thumb_levels[level])
+
+    def _entries(self, path, level=base_level):
+        local_dir = self.local_dir(path, level)
+        entries = self.dirs.get(local_dir)
+        if entries is not None:
+            self.dirs.move_to_end(local_dir)
+            return local_dir, entries
+
+        entries = {}
+        try:
+            for entry in os.scandir(local_dir):
+                # files being written and directories of other levels
+                if not entry.name.endswith('.part') and entry.is_file():
+                    entries[thumbnail_of(entry.name)] = (entry.name, entry.stat().st_mtime)
+        except FileNotFoundError:
+            pass
+        self.dirs[local_dir] = entries
+        while len(self.dirs) > self.max_dirs:
+            self.dirs.popitem(last=False)
+        return local_dir, entries
+
+    def get(self, path, filename, level=base_level):
+        """Returns local path of thumbnail of filename in remote path or None"""
+        found = self.find(path, filename, level)
+        return found[0] if found else None
+
+    def find(self, path, filename, level=base_level):
+        """Returns (local path, mtime) of thumbnail of filename in remote path or None"""
+        with self.lock:
+            local_dir, entries = self._entries(path, level)
+            entry = entries.get(filename)
+        return (pure_windows_path(local_dir, entry[0]), entry[1]) if entry else None
+
+    def get_many(self, path, filenames, level=base_level):
+        """Returns {filename: local path of its thumbnail} for filenames which have one"""
+        with self.lock:
+            local_dir, entries = self._entries(path, level)
+            found = [(filename, entries[filename][0]) for filename in filenames if filename in entries]
+        return {filename: pure_windows_path(local_dir, thumbnail) for filename, thumbnail in found}
+
+    def mtimes(self, path, level=base_level):
+        """Returns {thumbnail name: mtime} of all cached thumbnails of remote path"""
+        with self.lock:
+            _, entries = self._entries(path, level)
+            return dict(entries.values())
+
+    def add(self, path, thumbnail, level=base_level):
+        """Thumbnail was written to the cache of remote path"""
+        local_dir = self.local_dir(path, level)
+        try:
+            mtime = os.stat(pure_windows_path(local_dir, thumbnail)).st_mtime
+        except FileNotFoundError:
+            return
+        with self.lock:
+            entries = self.dirs.get(local_dir)
+            if entries is not None:
+                entries[thumbnail_of(thumbnail)] = (thumbnail, mtime)
+
+    def rename(self, path, old, new):
+        """File old was renamed to new, its thumbnails of all levels were renamed with it"""
+        for level in thumb_levels:
+            with self.lock:
+                entries = self.dirs.get(self.local_dir(path, level))
+                if entries is not None:
+                    entries.pop(old, None)
+            self.add(path, f'{new}.jpg', level)
+        self.invalidate(f'{path.rstrip("/")}/{old}')
+
+    def remove(self, path, filename):
+        """File was removed from remote path, its cached thumbnails are deleted"""
+        for level in thumb_levels:
+            with self.lock:
+                local_dir, entries = self._entries(path, level)
+                entry = entries.pop(filename, None)
+            if entry:
+                try:
+                    os.remove(pure_windows_path(local_dir, entry[0]))
+                except OSError:
+                    pass
+        self.invalidate(f'{path.rstrip("/")}/{filename}')
+
+    def forget(self, local_path):
+        """Cached file local_path was deleted, if it is a thumbnail its entry goes"""
+        local_dir, name = os.path.split(local_path)
+        with self.lock:
+            entries = self.dirs.get(local_dir)
+            if entries is not None:
+                entries.pop(thumbnail_of(name), None)
+
+    def invalidate(self, path):
+        """Forgets index of remote path and its subdirectories"""
+        local_dir = self.local_dir(path)
+        prefix = pure_windows_path(cache_path, path.strip('/'))
+        with self.lock:
+            for key in [key for key in self.dirs if key == local_dir or key.startswith(prefix + '\\')]:
+                del self.dirs[key]
+
+
+thumb_index = ThumbIndex()
@@ -1,7 +1,10 @@
 from kivy.uix.relativelayout import RelativeLayout
-from common import config_file, default_remote, download_path, local_path_exists, thumbnails
+from common import config_file, default_remote, download_path, local_path_exists, thumbnails, fast_remove
+from common import thumbnail_bundles, publish_thumbnails, cache_limits, convert_file_size
+from managers.cachemanager import cache_manager
 from configparser import ConfigParser
 from kivy.app import App
+from functools import partial
 
 
 class SettingsPopup(RelativeLayout):
@@ -15,34 +18,67 @@ class SettingsPopup(RelativeLayout):
         self.ids.download_path.text = download_path()
         self.ids.default_remote.text = default_remote()
         self.ids.enable_thumbnails.active = thumbnails()
+        self.ids.fast_remove.active = fast_remove()
+        self.ids.thumbnail_bundles.active = thumbnail_bundles()
+        self.ids.publish_thumbnails.active = publish_thumbnails()
+        cache_size, cache_days = cache_limits()
+        self.ids.cache_size.text = str(cache_size)
+        self.ids.cache_days.text = str(cache_days)
+        self.ids.cache_stats.text = self.cache_stats()
 
-    def save_config(self):
+    @staticmethod
+    def cache_stats():
+        stats = cache_manager.stats()
+        text = f"Cache: {convert_file_size(stats['bytes'])} in {stats['files']} files"
+        if stats['pinned']:
+            text += f", {stats['pinned']} open"
+        if stats['evicted_files']:
+            text += f", {stats['evicted_files']} removed ({convert_file_size(stats['evicted_bytes'])})"
+        return text
 
-        config = ConfigParser()
-        download_path = self.ids.download_path.text
-        default_remote = self.ids.default_remote.text
-        enable_thumbnails = str(self.ids.enable_thumbnails.active)
+    def save_config(self):
+        settings = {'download_path': self.ids.download_path.text,
+                    'default_remote': self.ids.default_remote.text,
+                    'enable_thumbnails': str(self.ids.enable_thumbnails.active),
+                    'fast_remove': str(self.ids.fast_remove.active),
+                    'thumbnail_bundles': str(self.ids.thumbnail_bundles.active),
+                    'publish_thumbnails': str(self.ids.publish_thumbnails.active),
+                    'cache_size': self.ids.cache_size.text.strip(),
+                    'cache_days': self.ids.cache_days.text.strip()}
         err = False
-        if not local_path_exists(download_path):
+        if not settings['cache_size'].isdigit():
+            self.ids.cache_size_err.text = 'Number of MB expected'
+            err = True
+        if not settings['cache_days'].isdigit():
+            self.ids.cache_days_err.text = 'Number of days expected'
+            err = True
+        if not local_path_exists(settings['download_path']):
             self.ids.download_path_err.text = f"Path doesn't exists"
             err = True
-        if not App.get_running_app().root.remote_path_exists(default_remote):
+        # the server is asked in background, settings are saved when it answers
+        App.get_running_app().root.remote_path_exists(settings['default_remote'],
+                                                      on_done=partial(self.remote_checked, settings, err))
+
+    def remote_checked(self, settings, err, exists):
+        if not exists:
             self.ids.default_remote_err.text = f"Path doesn't exists"
             err = True
         if err:
             return
 
+        config = ConfigParser()
         config.read(config_file)
         try:
             config.add_section('SETTINGS')
         except:
             pass
 
-        config.set('SETTINGS', 'download_path', download_path)
-        config.set('SETTINGS', 'default_remote', default_remote)
-        config.set('SETTINGS', 'enable_thumbnails', enable_thumbnails)
+        for option, value in settings.items():
+            config.set('SETTINGS', option, value)
         with open(config_file, 'w') as f:
             config.write(f)
+        # new limits apply at once
+        cache_manager.trim_async()
 
         self.originator.dismiss()
 
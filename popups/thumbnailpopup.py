@@ -4,7 +4,8 @@ from kivy.core.window import Window
 from processes.thumbnail import ThumbnailGenerator
 from common import mk_logger, posix_path, pure_windows_path, thumb_dir, cache_path
 from shutil import copyfile
-from os import path, remove, rename
+from managers.thumbindex import thumb_index
+from os import path, remove, rename, makedirs
 
 logger = mk_logger(__name__)
 ex_log = mk_logger(name=f'{__name__}-EX',
@@ -14,12 +15,13 @@ ex_log = ex_log.exception
 
 
 class ThumbnailPopup(BoxLayout):
-    def __init__(self, originator, destination, filename, sftp):
+    def __init__(self, originator, destination, filename, remote_dir):
         super().__init__()
         self.originator = originator
         self.destination = destination
         self.filename = filename
-        self.sftp = sftp
+        # uploads on its connection, which is used by its browser thread only
+        self.remote_dir = remote_dir
         self.pic_name = None
         Window.bind(on_dropfile=self.thumbnail_drop)
 
@@ -55,19 +57,34 @@ class ThumbnailPopup(BoxLayout):
                 if path.exists(cache_pic):
                     remove(cache_pic)
                 copyfile(th.thumb_path, cache_pic)
+                # smaller levels replace the ones of the previous thumbnail
+                for level, level_path in th.level_paths.items():
+                    cache_level = pure_windows_path(thumb_index.local_dir(self.destination, level), self.pic_name)
+                    if level_path != th.thumb_path:
+                        makedirs(path.dirname(cache_level), exist_ok=True)
+                        copyfile(level_path, cache_level)
+                    thumb_index.add(self.destination, self.pic_name, level)
 
                 print('     SRC_PATH', cache_pic)
                 print('     DST_PATH', posix_path(self.destination, thumb_dir, self.pic_name))
-                self.sftp.put(cache_pic, posix_path(self.destination, thumb_dir, self.pic_name), preserve_mtime=True)
             except Exception as ex:
                 ex_log(f'Failed to upload thumbnail for {self.filename} {ex}')
             else:
-                self.popup.title = 'Thumbnail uploaded succesfully'
-                self.originator.bind_external_drop()
-                def dismiss_popup(_):
-                    self.popup.dismiss()
-                    self.originator.refresh_thumbnail(self.filename)
-                Clock.schedule_once(dismiss_popup, .8)
-                Window.unbind(on_dropfile=self.thumbnail_drop)
+                self.remote_dir.upload_thumbnail(self.destination, self.pic_name,
+                                                 on_done=self.uploaded, on_error=self.upload_failed)
         else:
             self.popup.title = 'Failed to upload thumbnail'
+
+    def uploaded(self, _):
+        self.popup.title = 'Thumbnail uploaded succesfully'
+        self.originator.bind_external_drop()
+
+        def dismiss_popup(_):
+            self.popup.dismiss()
+            self.originator.refresh_thumbnail(self.filename)
+        Clock.schedule_once(dismiss_popup, .8)
+        Window.unbind(on_dropfile=self.thumbnail_drop)
+
+    def upload_failed(self, ex):
+        ex_log(f'Failed to upload thumbnail for {self.filename} {ex}')
+        self.popup.title = 'Failed to upload thumbnail'
@@ -0,0 +1,75 @@
+"""
+Embedded JPEG previews found in TIFF directories, of EXIF of JPEG files and of TIFF based RAW files.
+Offsets and lengths of previews are read from the tags, the data is never searched for JPEG markers.
+The data is read through a reader with read(offset, length), offsets are relative to the TIFF header.
+"""
+import struct
+
+# TIFF tags
+ORIENTATION = 0x0112
+COMPRESSION = 0x0103
+STRIP_OFFSETS = 0x0111
+STRIP_BYTE_COUNTS = 0x0117
+SUB_IFDS = 0x014a
+JPEG_OFFSET = 0x0201
+JPEG_LENGTH = 0x0202
+EXIF_IFD = 0x8769
+# sizes of TIFF field types
+type_sizes = {1: 1, 2: 1, 3: 2, 4: 4, 5: 8, 6: 1, 7: 1, 8: 2, 9: 4, 10: 8, 11: 4, 12: 8, 13: 4}
+
+
+class BytesReader:
+    """Reader of TIFF data in memory"""
+    def __init__(self, data):
+        self.data = data
+
+    def read(self, offset, length):
+        return self.data[offset:offset + length]
+
+
+def tiff_previews(reader, header):
+    """
+    Returns orientation and list of (offset, length) of JPEG previews found in TIFF directories.
+    header is the first 8 bytes of TIFF data.
+    """
+    order = '<' if header[:2] == b'II' else '>'
+    pending = [struct.unpack(order + 'I', header[4:8])[0]]
+    visited = set()
+    previews = []
+    orientation = 1
+
+    while pending and len(visited) < 16:
+        ifd = pending.pop(0)
+        if not ifd or ifd in visited:
+            continue
+        visited.add(ifd)
+        count = struct.unpack(order + 'H', reader.read(ifd, 2))[0]
+        data = reader.read(ifd + 2, count * 12 + 4)
+        if len(data) < count * 12 + 4:
+            break
+        tags = {}
+        for i in range(count):
+            tag, _type, n, value = struct.unpack(order + 'HHI4s', data[i * 12:i * 12 + 12])
+            size = type_sizes.get(_type, 1)
+            if _type not in (3, 4, 13) or tag not in (ORIENTATION, COMPRESSION, STRIP_OFFSETS, STRIP_BYTE_COUNTS,
+                                                      SUB_IFDS, JPEG_OFFSET, JPEG_LENGTH, EXIF_IFD):
+                continue
+            raw = value if size * n <= 4 else reader.read(struct.unpack(order + 'I', value)[0], size * min(n, 64))
+            fmt = 'H' if _type == 3 else 'I'
+            tags[tag] = struct.unpack(f'{order}{len(raw) // size}{fmt}', raw[:len(raw) // size * size])
+
+        # orientation of the photo is in IFD0
+        if len(visited) == 1 and ORIENTATION in tags:
+            orientation = tags[ORIENTATION][0]
+        if JPEG_OFFSET in tags and JPEG_LENGTH in tags:
+            previews.append((tags[JPEG_OFFSET][0], tags[JPEG_LENGTH][0]))
+        # JPEG compressed image in one strip, e.g. IFD0 of CR2
+        if tags.get(COMPRESSION, (0,))[0] in (6, 7) and len(tags.get(STRIP_OFFSETS, ())) == 1 \
+                and STRIP_BYTE_COUNTS in tags:
+            previews.append((tags[STRIP_OFFSETS][0], tags[STRIP_BYTE_COUNTS][0]))
+        pending.extend(tags.get(SUB_IFDS, ()))
+        pending.extend(tags.get(EXIF_IFD, ()))
+        pending.append(struct.unpack(order + 'I', data[count * 12:count * 12 + 4])[0])
+
+    return orientation, previews
+
@@ -0,0 +1,45 @@
+from concurrent.futures import ProcessPoolExecutor
+from processes.thumbnail import make_thumbnail
+from common import mk_logger
+import os
+
+logger = mk_logger(__name__)
+ex_log = mk_logger(name=f'{__name__}-EX',
+                   level=40,
+                   _format='[%(levelname)-8s] [%(asctime)s] [%(name)s] [%(funcName)s] [%(lineno)d] [%(message)s]')
+ex_log = ex_log.exception
+
+
+class ThumbnailPool:
+    """
+    Makes thumbnails in worker processes, one per CPU, so decoding of images and videos
+    does not hold the GIL of the app nor a transfer's connection.
+    callback(src_path, dst_path, thumb_path) is called in a thread of the pool,
+    thumb_path is None if no thumbnail could be made.
+    The pool is shared by all transfer managers and shut down when the app stops.
+    """
+    def __init__(self, workers=None):
+        self.workers = workers or os.cpu_count() or 1
+        self.executor = None
+
+    def submit(self, src_path, dst_path, callback):
+        if not self.executor:
+            self.executor = ProcessPoolExecutor(max_workers=self.workers)
+
+        def done(future):
+            try:
+                thumb_path = future.result()
+            except Exception as ex:
+                ex_log(f'Failed to make thumbnail of {src_path} {ex}')
+                thumb_path = None
+            callback(src_path, dst_path, thumb_path)
+
+        self.executor.submit(make_thumbnail, src_path, dst_path).add_done_callback(done)
+
+    def shutdown(self):
+        if self.executor:
+            self.executor.shutdown(wait=False, cancel_futures=True)
+            self.executor = None
+
+
+thumbnail_pool = ThumbnailPool()
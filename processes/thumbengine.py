@@ -0,0 +1,191 @@
+"""
+Decoding of files for thumbnails, the cheapest way for each format.
+
+Format is told by the first bytes of the file, not by its extension, so each file is
+opened by one decoder only. JPEGs are decoded at reduced scale (draft mode), other images
+are reduced before resampling. For RAW files and JPEGs with big enough EXIF thumbnail
+the embedded preview is used instead of the image itself.
+Thumbnail is encoded in memory and written to disk at once.
+"""
+from PIL import Image, ImageOps
+from processes.exif import tiff_previews, BytesReader
+from io import BytesIO
+import struct
+import os
+
+JPEG = 'jpeg'
+IMAGE = 'image'
+RAW = 'raw'
+VIDEO = 'video'
+
+# magic bytes at the start of file
+signatures = (
+    (b'\xff\xd8\xff', JPEG),
+    (b'\x89PNG\r\n\x1a\n', IMAGE),
+    (b'GIF87a', IMAGE),
+    (b'GIF89a', IMAGE),
+    (b'BM', IMAGE),
+    (b'FUJIFILMCCD-RAW', RAW),
+    (b'IIRO', RAW),
+    (b'IIRS', RAW),
+    (b'IIU\x00', RAW),
+    (b'\x1aE\xdf\xa3', VIDEO),
+    (b'FLV', VIDEO),
+    (b'\x00\x00\x01\xba', VIDEO),
+    (b'\x00\x00\x01\xb3', VIDEO),
+)
+tiff_signatures = (b'II*\x00', b'MM\x00*')
+# TIFF based RAW formats, plain TIFF images are decoded by PIL
+raw_extensions = {'.cr2', '.nef', '.nrw', '.arw', '.srf', '.sr2', '.dng', '.pef', '.raw', '.rwl', '.3fr',
+                  '.erf', '.kdc', '.mef', '.mos', '.iiq', '.srw', '.x3f'}
+video_brands = {b'isom', b'iso2', b'mp41', b'mp42', b'avc1', b'qt  ', b'M4V ', b'3gp4', b'3gp5', b'3g2a',
+                b'dash', b'MSNV'}
+# EXIF thumbnail of JPEG is used if it is at least this part of the requested size
+exif_thumb_ratio = .9
+
+
+def signature(src_path):
+    """Returns kind of file decoder or None if the file can not have a thumbnail"""
+    with open(src_path, 'rb') as file:
+        head = file.read(32)
+    return kind_of(head, src_path)
+
+
+def kind_of(head, name):
+    """Kind of file from its first 32 bytes, name is needed only for TIFF based RAW files"""
+    for magic, kind in signatures:
+        if head.startswith(magic):
+            return kind
+
+    if head[:4] in tiff_signatures:
+        return RAW if os.path.splitext(name)[1].lower() in raw_extensions else IMAGE
+
+    if head[4:8] == b'ftyp':
+        brand = head[8:12]
+        if brand == b'crx ':
+            return RAW
+        if brand in video_brands:
+            return VIDEO
+        return None
+
+    if head[:4] == b'RIFF':
+        if head[8:12] == b'WEBP':
+            return IMAGE
+        if head[8:12] == b'AVI ':
+            return VIDEO
+
+    return None
+
+
+def open_jpeg(source, size):
+    image = Image.open(source)
+    # DCT scaling decodes only as many pixels as needed, at least the requested size
+    image.draft('RGB', size)
+    return image
+
+
+def exif_thumbnail(image, size, ratio=exif_thumb_ratio):
+    """Returns EXIF thumbnail of JPEG if it is at least ratio of size"""
+    data = image.info.get('exif')
+    if not data:
+        return None
+    # EXIF segment starts with Exif header, offsets of its TIFF directories are relative to the TIFF data
+    tiff = data[6:] if data.startswith(b'Exif\x00\x00') else data
+    try:
+        _, previews = tiff_previews(BytesReader(tiff), tiff[:8])
+    except struct.error:
+        # directories cut short
+        return None
+    # EXIF thumbnail is the JPEG given by offset and length in IFD1
+    for offset, length in previews:
+        preview = tiff[offset:offset + length]
+        if not preview.startswith(b'\xff\xd8'):
+            continue
+        try:
+            thumb = Image.open(BytesIO(preview))
+        except Exception:
+            continue
+        if thumb.width >= size[0] * ratio or thumb.height >= size[1] * ratio:
+            return thumb
+    return None
+
+
+def decode_jpeg(src_path, size):
+    image = open_jpeg(src_path, size)
+    thumb = exif_thumbnail(image, size)
+    if not thumb:
+        return image
+    # EXIF thumbnail has no EXIF of its own, orientation of the photo applies to it
+    thumb.getexif()[0x0112] = image.getexif().get(0x0112, 1)
+    return thumb
+
+
+def decode_image(src_path, size):
+    return Image.open(src_path)
+
+
+def decode_raw(src_path, size):
+    """Embedded preview of RAW file, the sensor data is never decoded"""
+    import rawpy
+    import numpy
+
+    with rawpy.imread(src_path) as raw:
+        thumb = raw.extract_thumb()
+    if thumb.format == rawpy.ThumbFormat.JPEG:
+        return open_jpeg(BytesIO(thumb.data), size)
+    return Image.fromarray(numpy.asarray(thumb.data))
+
+
+decoders = {
+    JPEG: decode_jpeg,
+    IMAGE: decode_image,
+    RAW: decode_raw,
+}
+
+
+def make(src_path, size, kind=None):
+    """Returns thumbnail image of src_path or None if its format has no image decoder"""
+    kind = kind or signature(src_path)
+    decoder = decoders.get(kind)
+    if not decoder:
+        return None
+    image = decoder(src_path, size)
+    image = ImageOps.exif_transpose(image)
+    # reducing_gap shrinks by whole factors first, which is much cheaper than resampling all pixels
+    image.thumbnail(size, reducing_gap=2.0)
+    return image
+
+
+def pyramid(image, sizes):
+    """
+    Returns {level: JPEG data} of image scaled to fit each of sizes {level: size}.
+    Each level is scaled from the previous, bigger one.
+    """
+    levels = {}
+    for level, size in sorted(sizes.items(), key=lambda item: item[1][0] * item[1][1], reverse=True):
+        image = image.copy()
+        image.thumbnail(size, reducing_gap=2.0)
+        levels[level] = encode(image)
+    return levels
+
+
+def scale(data, sizes):
+    """Levels of sizes made of JPEG data of bigger thumbnail"""
+    image = open_jpeg(BytesIO(data), max(sizes.values()))
+    return pyramid(image, sizes)
+
+
+def encode(image, quality=85):
+    if image.mode not in ('RGB', 'L'):
+        image = image.convert('RGB')
+    buffer = BytesIO()
+    image.save(buffer, 'JPEG', quality=quality)
+    return buffer.getvalue()
+
+
+def write(path, data):
+    """Written under temporary name and renamed, so nobody reads half written thumbnail"""
+    tmp_path = f'{path}.part'
+    with open(tmp_path, 'wb') as file:
+        file.write(data)
+    os.replace(tmp_path, path)
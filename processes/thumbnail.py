@@ -1,10 +1,8 @@
-from multiprocessing import Process
 from threading import Thread
-from PIL import Image, UnidentifiedImageError
 from common import mk_logger, pure_windows_path, file_ext, thumb_name, cache_path, thumb_dir
-from os import path, makedirs
-import rawpy
-import imageio
+from common import thumb_levels, thumb_sizes, base_level
+from processes import thumbengine, videothumb
+from os import makedirs, path
 
 
 logger = mk_logger(__name__)
@@ -14,16 +12,27 @@ ex_log = mk_logger(name=f'{__name__}-EX',
 ex_log = ex_log.exception
 
 
+def make_thumbnail(src_path, dst_path):
+    """Runs in a worker process of ThumbnailPool. Returns path of the thumbnail in cache or None."""
+    generator = ThumbnailGenerator(src_path, dst_path)
+    generator.run()
+    return generator.thumb_path if generator.ok else None
+
+
 class ThumbnailGenerator(Thread):
 
-    def __init__(self, src_path, dst_path, filename=None, size=(300, 200)):
+    def __init__(self, src_path, dst_path, filename=None, sizes=None):
         super().__init__()
         self.thumb_name = None
         self.thumb_name = thumb_name(src_path)
         self.src_path = src_path
-        self.size = size
+        # every level is made at once, the base level is the biggest one
+        self.sizes = sizes or thumb_sizes
+        self.size = self.sizes[base_level]
         self.cache_path = pure_windows_path(cache_path, dst_path.strip('/'), thumb_dir)
         self.thumb_path = pure_windows_path(self.cache_path, self.thumb_name)
+        self.level_paths = {level: pure_windows_path(self.cache_path, thumb_levels[level], self.thumb_name)
+                            for level in self.sizes}
         self.ok = False
 
     def run(self):
@@ -34,74 +43,36 @@ class ThumbnailGenerator(Thread):
 
         ext = file_ext(self.src_path)
 
-        if ext in ('.pdf', '.svg'):
-            return
-        logger.info(f'Creating thumbnail for {ext} file')
-
-        if not self.thumb_name:
+        if ext in ('.pdf', '.svg') or not self.thumb_name:
             return
 
-        if not path.exists(self.cache_path):
-            makedirs(self.cache_path)
-
         try:
-            im = Image.open(self.src_path)
-            im.thumbnail(self.size)
-            im.save(self.thumb_path)
-        except UnidentifiedImageError:
-            pass
-        except OSError:
-            pass
-        except Exception as ex:
-            ex_log(f'Failed to make a thumbnail {ex}')
-        else:
-            logger.info(f'Thumbnail for {ext} created with Image')
-            self.ok = True
+            kind = thumbengine.signature(self.src_path)
+        except OSError as oe:
+            logger.info(f'Could not read {self.src_path} {oe}')
             return
-
-        try:
-            from moviepy.editor import VideoFileClip
-            clip = VideoFileClip(self.src_path)
-            clip.save_frame(self.thumb_path, t=1.00)
-        except OSError:
-            pass
-        except Exception as ex:
-            ex_log(f'Failed to make a thumbnail {type(ex)}, {ex}')
-        else:
-            logger.info(f'Thumbnail for {ext} created with VideoFileClip')
-            self.ok = True
+        if not kind:
+            logger.info(f'No thumbnail decoder for {ext} file')
             return
 
-        from rawpy._rawpy import LibRawNoThumbnailError
-        from rawpy._rawpy import LibRawUnsupportedThumbnailError
-        from rawpy._rawpy import LibRawIOError
+        logger.info(f'Creating thumbnail for {ext} file')
 
         try:
-            with rawpy.imread(self.src_path) as raw:
-                # raises LibRawNoThumbnailError if thumbnail missing
-                # raises LibRawUnsupportedThumbnailError if unsupported format
-                thumb = raw.extract_thumb()
-            if thumb.format == rawpy.ThumbFormat.JPEG:
-                # thumb.data is already in JPEG format, save as-is
-                with open(self.thumb_path, 'wb') as f:
-                    f.write(thumb.data)
-            elif thumb.format == rawpy.ThumbFormat.BITMAP:
-                # thumb.data is an RGB numpy array, convert with imageio
-                imageio.imsave(self.thumb_path, thumb.data)
-        except LibRawNoThumbnailError:
-            pass
-        except LibRawUnsupportedThumbnailError:
-            pass
-        except LibRawIOError:
-            pass
+            if kind == thumbengine.VIDEO:
+                # ffmpeg gives the frame scaled and encoded already
+                data = videothumb.extract(self.src_path, self.size)
+                if not data:
+                    return
+                levels = thumbengine.scale(data, {level: size for level, size in self.sizes.items()
+                                                  if level != base_level})
+                levels[base_level] = data
+            else:
+                levels = thumbengine.pyramid(thumbengine.make(self.src_path, self.size, kind), self.sizes)
+            for level, data in levels.items():
+                makedirs(path.dirname(self.level_paths[level]), exist_ok=True)
+                thumbengine.write(self.level_paths[level], data)
         except Exception as ex:
-            ex_log(f'Failed to make a thumbnail {ex}')
+            ex_log(f'Failed to make a thumbnail of {kind} {type(ex)}, {ex}')
         else:
-            im = Image.open(self.thumb_path)
-            im.thumbnail(self.size)
-            im.save(self.thumb_path)
-            logger.info(f'Thumbnail {self.thumb_name} created with rawpy')
+            logger.info(f'Thumbnail {self.thumb_name} of {kind} created')
             self.ok = True
-            return
-
-
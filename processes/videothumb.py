@@ -0,0 +1,102 @@
+"""
+Thumbnails of videos made by ffmpeg.
+
+ffmpeg seeks to the nearest keyframe before the frame time (-ss before -i), so only a few
+frames are decoded whatever the length of the video, and it returns the frame already scaled
+and encoded as JPEG. ffmpeg is a separate process killed after timeout, so a broken file
+can not hang a worker. Files ffmpeg failed on are remembered and not tried again until they change.
+"""
+from common import mk_logger, cache_path
+from functools import lru_cache
+from contextlib import closing
+from os import path, makedirs
+import subprocess
+import sqlite3
+import shutil
+import os
+
+logger = mk_logger(__name__)
+ex_log = mk_logger(name=f'{__name__}-EX',
+                   level=40,
+                   _format='[%(levelname)-8s] [%(asctime)s] [%(name)s] [%(funcName)s] [%(lineno)d] [%(message)s]')
+ex_log = ex_log.exception
+
+failures_db = path.join(cache_path, 'video_failures.sqlite')
+timeout = 20
+# time of the frame, short videos use the first one
+frame_time = 1.0
+
+
+@lru_cache(maxsize=None)
+def ffmpeg_path():
+    """Path of ffmpeg or None, looked up once per process"""
+    found = shutil.which('ffmpeg')
+    if found:
+        return found
+    # noinspection PyBroadException
+    try:
+        import imageio_ffmpeg
+        return imageio_ffmpeg.get_ffmpeg_exe()
+    except Exception:
+        logger.info('ffmpeg not found, videos will have no thumbnails')
+        return None
+
+
+def failures():
+    makedirs(cache_path, exist_ok=True)
+    db = sqlite3.connect(failures_db, timeout=10)
+    db.execute('CREATE TABLE IF NOT EXISTS failures (path TEXT PRIMARY KEY, size INTEGER, mtime INTEGER)')
+    return db
+
+
+def failed_before(src_path, stat):
+    # with db commits only, closing closes the connection
+    with closing(failures()) as db, db:
+        row = db.execute('SELECT size, mtime FROM failures WHERE path = ?', (src_path,)).fetchone()
+    return row == (stat.st_size, int(stat.st_mtime))
+
+
+def remember_failure(src_path, stat):
+    with closing(failures()) as db, db:
+        db.execute('INSERT OR REPLACE INTO failures VALUES (?, ?, ?)', (src_path, stat.st_size, int(stat.st_mtime)))
+
+
+def run_ffmpeg(ffmpeg, src_path, size, seek):
+    command = [ffmpeg, '-nostdin', '-v', 'error',
+               '-ss', str(seek), '-i', src_path,
+               '-frames:v', '1',
+               '-vf', f'scale={size[0]}:{size[1]}:force_original_aspect_ratio=decrease',
+               '-f', 'image2pipe', '-vcodec', 'mjpeg', '-']
+    # no console window pops up for every video on Windows
+    flags = subprocess.CREATE_NO_WINDOW if os.name == 'nt' else 0
+    result = subprocess.run(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                            timeout=timeout, creationflags=flags)
+    return result.stdout
+
+
+def extract(src_path, size):
+    """Returns JPEG data of a frame of the video scaled to fit size, or None"""
+    ffmpeg = ffmpeg_path()
+    if not ffmpeg:
+        return None
+
+    stat = os.stat(src_path)
+    if failed_before(src_path, stat):
+        logger.info(f'Skipping video ffmpeg failed on before {src_path}')
+        return None
+
+    try:
+        data = run_ffmpeg(ffmpeg, src_path, size, frame_time)
+        if not data:
+            data = run_ffmpeg(ffmpeg, src_path, size, 0)
+    except subprocess.TimeoutExpired:
+        logger.info(f'ffmpeg timed out on {src_path}')
+        data = None
+    except OSError as oe:
+        ex_log(f'Failed to run ffmpeg {oe}')
+        return None
+
+    if not data:
+        remember_failure(src_path, stat)
+        return None
+    return data
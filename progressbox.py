@@ -3,17 +3,22 @@ from kivy.clock import Clock
 from kivy.properties import BooleanProperty, ObjectProperty
 from kivy.core.window import Window
 import queue
-from progressrow import ProgressRow
+from managers.progress import ProgressAggregator
 
 
 class ProgressBox(BoxLayout):
     autoflush = BooleanProperty(True)
     originator = ObjectProperty()
+    # how many times per second progress of transfers is shown
+    refresh_rate = 15
 
     def __init__(self, **kwargs):
         super().__init__(**kwargs)
         self.autoflush = True
         self.queue = queue.Queue()
+        self.transferring = False
+        self.aggregator = ProgressAggregator(on_added=self.add_rows, on_changes=self.refresh_rows)
+        Clock.schedule_interval(self.aggregator.drain, 1 / self.refresh_rate)
 
     def set_values(self, desc=''):
         self.ids.desc.text = desc
@@ -25,15 +30,30 @@ class ProgressBox(BoxLayout):
         if progress == 1 and self.autoflush:
             self.flush()
 
-    @staticmethod
-    def mk_bar():
-        return ProgressRow()
+    def mk_bar(self):
+        """Returns progress which can be updated from any thread"""
+        return self.aggregator.mk_transfer()
+
+    def mk_info(self, desc=''):
+        return self.aggregator.mk_info(desc)
 
     def add_bar(self, bar):
+        """Can be called from any thread. Row is added on next refresh"""
+        self.aggregator.add(bar)
+
+    def add_rows(self, transfers):
+        # only rows scrolled into view get widgets, the rest is just data
+        self.ids.scroll.data.extend(transfers)
 
-        def add(_):
-            self.ids.bars_space.add_widget(bar, index=len(self.ids.bars_space.children))
-        Clock.schedule_once(add, 0)
+    def refresh_rows(self, transfers):
+        views = self.ids.scroll.view_adapter.views
+        for transfer in transfers:
+            view = views.get(transfer.index)
+            if view is not None and view.transfer is transfer:
+                view.refresh()
+
+        if self.transferring:
+            self.ids.short_info.text = f'Transferring {self.aggregator.summary()}'
 
     def show_bars(self, hide=False):
         if hide:
@@ -47,14 +67,13 @@ class ProgressBox(BoxLayout):
             self.originator.on_popup()
 
     def transfer_start(self):
+        self.transferring = True
         self.ids.short_info.text = 'Transferring files'
 
     def transfer_stop(self):
-        for bar in self.ids.bars_space.children:
-            if not bar.my_thread.done:
-                break
-        else:
-            self.ids.short_info.text = 'Files transferred'
+        if not self.aggregator.undone():
+            self.transferring = False
+            self.ids.short_info.text = f'Files transferred {self.aggregator.summary()}'
 
     def show_actions(self):
         self.ids.actions.height = 26
@@ -64,21 +83,22 @@ class ProgressBox(BoxLayout):
 
     def overwrite_all(self):
         self.hide_actions()
-        for bar in self.ids.bars_space.children:
-            bar.hide_actions()
-            bar.my_thread.overwrite()
+        for transfer in self.aggregator.waiting():
+            transfer.hide_actions()
+            transfer.my_thread.overwrite()
 
     def skip_all(self):
         self.hide_actions()
-        for bar in self.ids.bars_space.children:
-            bar.hide_actions()
-            bar.my_thread.skip()
+        for transfer in self.aggregator.undone():
+            transfer.hide_actions()
+            transfer.my_thread.skip()
 
     def clear(self):
         self.skip_all()
         self.manager.threads.clear()
         self.show_bars(hide=True)
-        self.ids.bars_space.clear_widgets()
+        self.aggregator.clear()
+        self.ids.scroll.data = []
         self.height = 0
 
     def stop(self):
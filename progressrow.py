@@ -1,31 +1,66 @@
 from kivy.uix.boxlayout import BoxLayout
+from kivy.uix.recycleview.views import RecycleDataViewBehavior
 from kivy.properties import ListProperty
 from kivy.clock import Clock
 
 
-class ProgressRow(BoxLayout):
+class ProgressRow(RecycleDataViewBehavior, BoxLayout):
+    """
+    Shows TransferProgress given as transfer. Must be used only on the main thread,
+    workers report through the transfer. Without transfer it can be updated directly.
+    In ProgressBox rows are recycled, so a row shows different transfers while scrolling.
+    """
     progress=ListProperty()
 
-    def __init__(self, my_thread=None, **kwargs):
+    def __init__(self, my_thread=None, transfer=None, **kwargs):
         super().__init__(**kwargs)
         self.my_thread = my_thread
+        self.transfer = transfer
         self.progress_callback = None
+        if transfer:
+            self.refresh()
+
+    def refresh_view_attrs(self, rv, index, data):
+        self.transfer = data
+        self.refresh()
+
+    def on_size(self, *_):
+        # progress width depends on row width which is set after recycled row got its transfer
+        if self.transfer:
+            self.refresh()
+
+    def refresh(self):
+        transfer = self.transfer
+        self.ids.desc.text = transfer.desc
+        if transfer.actions:
+            self.file_exists_error()
+        else:
+            self.hide_actions()
+        if transfer.flushed or not transfer.progress:
+            self.flush()
+        else:
+            self.show_progress(transfer.ratio())
 
     def set_values(self, desc=''):
         self.ids.desc.text = desc
 
     def file_exists_error(self):
-        self.ids.actions.height = 20
+        self.ids.actions.width = 200
 
     def hide_actions(self):
-        self.ids.actions.height = 0
+        self.ids.actions.width = 0
 
     def overwrite(self):
-        self.my_thread.overwrite()
+        if self.transfer:
+            self.transfer.overwrite()
+        else:
+            self.my_thread.overwrite()
 
     def update(self, *args):
         self.progress = args
-        progress = float(args[0]/args[1])
+        self.show_progress(float(args[0]/args[1]))
+
+    def show_progress(self, progress):
         self.ids.progress.width = progress * (self.size[0] - self.ids.percent.size[0])
         self.ids.percent.text = '{}%'.format(int(progress * 100))
 
@@ -34,7 +69,10 @@ class ProgressRow(BoxLayout):
         self.hide_actions()
 
     def skip(self):
-        self.my_thread.skip()
+        if self.transfer:
+            self.transfer.skip()
+        else:
+            self.my_thread.skip()
         self.hide_actions()
 
     def clear(self, *args):
@@ -1,18 +1,29 @@
 from kivy.uix.boxlayout import BoxLayout
-from kivy.properties import StringProperty, ListProperty
+from kivy.properties import StringProperty, ListProperty, BooleanProperty
 from kivy.core.window import Window
 from kivy.clock import Clock
 from colors import colors
-from common import credential_popup, menu_popup, settings_popup, confirm_popup, posix_path, find_thumb, thumbnails
-from common import remote_path_exists, get_dir_attrs, mk_logger, download_path, default_remote, thumb_dir
+from common import credential_popup, menu_popup, settings_popup, confirm_popup, posix_path, thumbnails
+from common import remote_path_exists, get_dir_attrs, mk_logger, download_path, default_remote, thumb_level_dir
+from common import fast_remove, hidden_files, thumb_levels, remote_mtime, thumbnail_bundles
 from sftp.connection import Connection
 from exceptions import *
 from threads import TransferManager
-from threads.thumbdownload import ThumbDownload
+from threads.thumbfetch import ThumbFetcher
+from threads.thumbupload import upload_levels
+from sftp.thumbbundle import ThumbBundle, index_name
+from threads.listdir import DirLister
+from threads.prefetch import Prefetcher
+from threads.browser import Browser
+from threads.contentsearch import ContentSearch
+from managers.listingcache import ListingCache
+from managers.catalog import Catalog
+from managers.thumbindex import thumb_index
+from managers.cachemanager import cache_manager
 import queue
 import os
+import posixpath
 from paramiko.ssh_exception import SSHException
-import copy
 from functools import partial
 
 logger = mk_logger(__name__)
@@ -25,6 +36,11 @@ ex_log = ex_log.exception
 class RemoteDir(BoxLayout):
     bcolor = ListProperty()
     current_path = StringProperty()
+    loading = BooleanProperty(False)
+    # search box searches content of files of current directory instead of names in the whole tree
+    search_content = BooleanProperty(False)
+    crawl_interval = 600
+    cache_trim_interval = 3600
 
     def __init__(self, **kwargs):
         super().__init__(**kwargs)
@@ -33,7 +49,22 @@ class RemoteDir(BoxLayout):
         self.mouse_locked = False
         self.password = None
         self.sftp = None
-        self.connect()
+        self.cwd = None
+        self.lister = None
+        self.prefetcher = None
+        self.thumb_fetcher = None
+        self.listing_cache = ListingCache()
+        # path: whether it has thumbnails bundle, looked up once per listing of path
+        self.bundled_dirs = {}
+        self.catalog = None
+        self.searching = False
+        self.content_search = None
+        self.listed_files = []
+        self.streaming = False
+        self.browser_busy = False
+        # all operations on self.sftp run in browser's thread
+        self.browser = Browser(on_busy=self.set_loading)
+        self.browser.start()
         self.current_path = default_remote()
         self.marked_files = set()
         self.files_queue = queue.LifoQueue()
@@ -48,6 +79,8 @@ class RemoteDir(BoxLayout):
         self.thumbnails = thumbnails()
         self.reconnection_tries = 0
         self.callback = None
+        self.trim_cache()
+        self.connect()
 
     def on_kv_post(self, base_widget):
         self.childs_to_light = [self.ids.current_path, self.ids.search, self.ids.settings,
@@ -78,61 +111,158 @@ class RemoteDir(BoxLayout):
 
     def on_touch_move(self, touch):
         # moves file_space up or down depends to touch_move position
-        self._y = self.ids.space_scroller.vbar[0] * self.ids.files_space.height + touch.y
-        if touch.y / self.ids.space_scroller.height > 0.9 and self.ids.space_scroller.scroll_y < 1:
-            self.ids.space_scroller.scroll_y += 0.1
+        files_space = self.ids.files_space
+        self._y = files_space.vbar[0] * files_space.layout_manager.height + touch.y
+        if touch.y / files_space.height > 0.9 and files_space.scroll_y < 1:
+            files_space.scroll_y += 0.1
 
-        elif touch.y / self.ids.space_scroller.height < 0.1 and self.ids.space_scroller.scroll_y > 0:
-            self.ids.space_scroller.scroll_y -= 0.1
+        elif touch.y / files_space.height < 0.1 and files_space.scroll_y > 0:
+            files_space.scroll_y -= 0.1
 
         return super().on_touch_move(touch)
 
-    def compare_thumbs(self):
-        """
-        Checks if thumbnails are up to date with the one on remote disk.
-        If thumb is not up to date or does not exist download thumbnail from remote.
-        """
-        if not self.thumbnails:
-            return
-        remote_thumbs_path = posix_path(self.get_current_path(), thumb_dir)
-        # noinspection PyBroadException
-        try:
-            remote_attrs = self.sftp.listdir_attr(remote_thumbs_path)
-        except Exception:
-            return
+    def set_loading(self, busy):
+        self.browser_busy = busy
+        self.update_loading()
 
-        downloads = []
-        for file in remote_attrs:
-            thumb_path = find_thumb(self.get_current_path(), file.filename)
-            if thumb_path:
-                local_attrs = os.lstat(find_thumb(self.get_current_path(), file.filename))
-                if file.st_mtime != local_attrs.st_mtime:
-                    downloads.append(file.filename)
+    def update_loading(self):
+        self.loading = self.browser_busy or self.streaming or bool(self.content_search)
 
-            else:
-                downloads.append(file.filename)
+    def fetch_thumbnails(self, path):
+        """Downloads thumbnails of path which are not cached or outdated, while the files are shown"""
+        if not self.thumb_fetcher:
+            self.thumb_fetcher = ThumbFetcher(self.connection.connect, self.thumbnail_downloaded)
+        self.thumb_fetcher.fetch(path, self.files_space.level)
+
+    def thumb_level_changed(self):
+        """Icons changed size, thumbnails of the new level are fetched"""
+        if self.thumbnails:
+            self.fetch_thumbnails(self.get_current_path())
+            self.files_space.report_visible()
+
+    def visible_files(self, names):
+        """Files space shows files of names, their thumbnails are fetched first"""
+        if self.thumb_fetcher:
+            self.thumb_fetcher.prioritize(self.get_current_path(), names)
+
+    def thumbnail_downloaded(self, path, thumbnail):
+        """thumbnail is name of the thumbnail, it is name of its file with .jpg"""
+        name = os.path.splitext(thumbnail)[0]
 
-        if downloads:
-            src = posix_path(self.get_current_path(), thumb_dir)
-            td = ThumbDownload(src, downloads, self.get_current_path(), self.sftp, self.files_space.refresh_thumbnail)
-            td.start()
-            td.join()
+        def refresh(_):
+            if self.is_current_path(path):
+                self.files_space.refresh_thumbnail(name)
+        Clock.schedule_once(refresh)
 
     def list_dir(self):
-        # print('DIRS', self.sftp.listdir_attr())
-        self.compare_thumbs()
+        """
+        Shows files of current directory from listing cache if it is still valid.
+        Otherwise shows them while they are listed by DirLister.
+        """
+        if self.prefetcher:
+            self.prefetcher.cancel()
+        self.streaming = False
+        self.update_loading()
+        path = self.get_current_path()
+        self.bundled_dirs.pop(path, None)
+        if self.thumbnails:
+            self.fetch_thumbnails(path)
 
-        try:
-            attrs_list = self.sftp.listdir_attr()
-        except OSError as ose:
-            if ose == 'Socket is closed':
-                self.callback = self.list_dir
-                self.connect()
-        except Exception as ex:
-            ex_log(f'List dir exception {ex}')
-        else:
+        listing = self.listing_cache.get(path)
+        if listing:
+            # show cached files at once, list again only if the listing turns out to be outdated
+            attrs_list = listing.files()
             self.add_attrs(attrs_list)
             self.files_space.fill(attrs_list)
+            self.prefetch(path, attrs_list)
+            if not self.listing_cache.is_fresh(listing):
+                self.browser.submit(self.dir_mtime, path,
+                                    on_done=partial(self.revalidated, listing),
+                                    on_error=partial(self.revalidated, listing, None),
+                                    key='revalidate')
+            return
+
+        self.stream_listing(path)
+
+    def stream_listing(self, path):
+        if not self.lister:
+            self.lister = DirLister(self.connection.connect)
+            self.prefetcher = Prefetcher(self.lister, self.listing_cache)
+
+        self.listed_files = []
+        self.files_space.fill([])
+        self.lister.list(path, on_batch=self.listed, on_done=self.listing_done)
+        self.streaming = True
+        self.update_loading()
+
+    def dir_mtime(self, path):
+        return self.sftp.stat(path).st_mtime
+
+    def revalidated(self, listing, mtime, error=None):
+        if error:
+            ex_log(f'Failed to revalidate listing of {listing.path} {error}')
+        valid = mtime is not None and self.listing_cache.revalidate(listing, mtime)
+        if not valid and self.is_current_path(listing.path):
+            self.listing_cache.invalidate(listing.path)
+            self.stream_listing(listing.path)
+
+    def listed(self, path, attrs_list):
+        if self.is_current_path(path):
+            self.listed_files.extend(attrs_list)
+            self.add_attrs(attrs_list)
+            self.files_space.extend(attrs_list)
+
+    def listing_done(self, path, error, mtime):
+        if not self.is_current_path(path):
+            return
+        self.streaming = False
+        self.update_loading()
+        if not error:
+            self.listing_cache.put(path, mtime, self.listed_files)
+            self.prefetch(path, self.listed_files)
+        elif not isinstance(error, IOError):
+            # listing connection failed, list on the main one
+            self.list_dir_sync()
+
+    def prefetch(self, path, attrs_list):
+        """Lists subdirectories in background so opening them is instant"""
+        if not self.prefetcher:
+            return
+        dirs = [attrs.filename for attrs in attrs_list
+                if attrs.longname[0] == 'd' and attrs.filename not in hidden_files]
+        self.prefetcher.start(path, dirs)
+
+    def prefetch_first(self, name):
+        """Directory name is under the cursor, it is likely to be opened next"""
+        if self.prefetcher:
+            self.prefetcher.first(posix_path(self.get_current_path(), name))
+
+    def refresh(self):
+        """Lists current directory again even if its listing is cached"""
+        self.listing_cache.invalidate(self.get_current_path())
+        self.list_dir()
+
+    def list_dir_sync(self):
+        """Lists current directory on the main connection"""
+        path = self.get_current_path()
+        self.browser.submit(self.sftp_listdir, path,
+                            on_done=partial(self.listed_sync, path),
+                            on_error=self.list_dir_failed,
+                            key='list_dir')
+
+    def sftp_listdir(self, path):
+        return self.sftp.listdir_attr(path)
+
+    def listed_sync(self, path, attrs_list):
+        if self.is_current_path(path):
+            self.add_attrs(attrs_list)
+            self.files_space.fill(attrs_list)
+
+    def list_dir_failed(self, error):
+        ex_log(f'List dir exception {error}')
+        if str(error) == 'Socket is closed':
+            self.callback = self.list_dir_sync
+            self.connect()
 
     def add_attrs(self, attrs):
         _path = self.get_current_path()
@@ -140,13 +270,14 @@ class RemoteDir(BoxLayout):
             attr.path = _path
             attr.thumbnail = self.thumbnails
 
-    def add_file(self, path, attrs, _):
+    def add_file(self, path, attrs, mtime, _):
+        self.listing_cache.add(path, attrs, mtime)
         if path == self.get_current_path():
             self.add_attrs([attrs])
             self.files_space.add_file(attrs)
 
     def sort_menu(self):
-        buttons = ['Name', 'Date added', 'Date modified', 'Size']
+        buttons = ['Name', 'Date added', 'Date modified', 'Size', 'Type']
         menu_popup(originator=self,
                    buttons=buttons,
                    callback=self.files_space.sort_files,
@@ -166,15 +297,21 @@ class RemoteDir(BoxLayout):
         self.on_popup()
 
     def make_dir(self, name):
-
-        try:
-            self.sftp.mkdir(name)
-            attrs = get_dir_attrs(_path=posix_path(self.get_current_path(), name), sftp=self.sftp)
-        except Exception as ex:
-            ex_log(f'Make dir exception {ex}')
-            return False
-        else:
-            attrs.path = self.get_current_path()
+        path = self.get_current_path()
+        self.browser.submit(self.mkdir, posix_path(path, name),
+                            on_done=partial(self.dir_made, path),
+                            on_error=lambda ex: ex_log(f'Make dir exception {ex}'))
+
+    def mkdir(self, path):
+        """Returns attrs of the new directory and mtime of its parent"""
+        self.sftp.mkdir(path)
+        return get_dir_attrs(_path=path, sftp=self.sftp), remote_mtime(posixpath.dirname(path), self.sftp)
+
+    def dir_made(self, path, result):
+        attrs, mtime = result
+        self.listing_cache.add(path, attrs, mtime)
+        if self.is_current_path(path):
+            self.add_attrs([attrs])
             self.files_space.add_icon(attrs, new_dir=True)
 
     def file_size(self):
@@ -224,7 +361,6 @@ class RemoteDir(BoxLayout):
             self.reconnection_tries = 0
             logger.info('Succesfully connected to server')
             self.chdir(self.current_path)
-            self.get_base_path()
             self.do_callback()
             return True
 
@@ -233,8 +369,18 @@ class RemoteDir(BoxLayout):
             self.callback()
             self.callback = None
 
-    def remote_path_exists(self, path):
-        return remote_path_exists(path, self.sftp)
+    def remote_path_exists(self, path, on_done):
+        """on_done(exists) is called on the main thread"""
+        def failed(ex):
+            ex_log(f'Failed to check if {path} exists {ex}')
+            on_done(False)
+        self.browser.submit(remote_path_exists, path, self.sftp, on_done=on_done, on_error=failed,
+                            key='remote_path_exists')
+
+    def upload_thumbnail(self, path, name, on_done, on_error):
+        """Uploads all cached levels of thumbnail added by user on the main connection, in browser's thread"""
+        self.browser.submit(upload_levels, self.sftp, path, name, thumbnail_bundles(),
+                            on_done=on_done, on_error=on_error)
 
     def reconnect(self):
         logger.info('Reconnecting to remote server')
@@ -275,6 +421,26 @@ class RemoteDir(BoxLayout):
         task = {'type': 'download', 'src_path': src_path, 'dst_path': download_path(), 'attrs': file.attrs}
         self.execute_sftp_task(task)
 
+    def copy_remote(self, paths, destination=None):
+        """
+        Copies remote files on the server. paths is list of (path, is_dir).
+        Without destination files are copied to current directory, which duplicates them.
+        """
+        destination = destination if destination else self.get_current_path()
+        for src_path, is_dir in paths:
+            # walking the copy would find the copy in it again
+            src = src_path.rstrip('/')
+            if is_dir and (destination.rstrip('/') == src or destination.startswith(f'{src}/')):
+                info = self.progress_box.mk_info(f'Cannot copy {posixpath.split(src)[1]} into itself')
+                self.progress_box.add_bar(info)
+                continue
+            task = {'type': 'copy_remote',
+                    'src_path': src_path,
+                    'dst_path': destination,
+                    'dir': is_dir,
+                    'thumbnails': self.thumbnails}
+            self.execute_sftp_task(task)
+
     def external_dropfile(self, local_path, destination):
         """
         When file is dropped from Windows.
@@ -297,8 +463,7 @@ class RemoteDir(BoxLayout):
             self.chdir(self.paths_history[index+1])
 
     def get_cwd(self):
-        cwd = self.sftp.getcwd()
-        return cwd if cwd else ""
+        return self.cwd if self.cwd else ""
 
     def settings(self):
         self.on_popup()
@@ -320,24 +485,25 @@ class RemoteDir(BoxLayout):
     def remove_from_view(self, file):
         self.files_space.remove_file(file)
 
-    def remove(self, file):
-        cwd = self.sftp.getcwd()
-        path = posix_path(cwd if cwd else '.', file.filename)
-        if file.file_type == 'dir':
-            self.rmdir(path, file)
-        else:
-            # noinspection PyBroadException
-            try:
-                self.sftp.remove(path)
-            except IOError as ie:
-                ex_log(f'Failed to remove file {ie}')
-                if ie.errno == 2:
-                    if not self.sftp.exists(path):
-                        self.remove_from_view(file)
-            except Exception as ex:
-                ex_log(f'Failed to remove file {ex}')
-            else:
-                self.remove_from_view(file)
+    def remove(self, files):
+        """Removes given files and directories in one background task"""
+        cwd = self.get_current_path()
+        paths = [(posix_path(cwd, file.filename), file.file_type == 'dir') for file in files]
+        task = {'type': 'remove_remote',
+                'paths': paths,
+                'on_removed': self.removed,
+                'fast_remove': fast_remove(),
+                'progress_box': self.progress_box}
+        self.execute_sftp_task(task)
+
+    def removed(self, paths, mtimes, _=None):
+        """mtimes is {directory: mtime} of directories of paths after removing"""
+        for _path in paths:
+            directory, name = posixpath.split(_path)
+            self.listing_cache.remove(directory, name, mtimes.get(directory))
+            thumb_index.remove(directory, name)
+            if self.is_current_path(directory):
+                self.remove_from_view(name)
 
     def get_file_attrs(self, path):
         # noinspection PyBroadException
@@ -351,58 +517,105 @@ class RemoteDir(BoxLayout):
         else:
             return attrs
 
-    def rename_thumbnail(self, old_name, new_name):
+    def rename_thumbnail(self, path, old_name, new_name):
+        """Renames thumbnails of levels cached here, thumbnails of the other levels are not known to exist"""
         if self.thumbnails:
-            from common_vars import find_thumb
-            old_local_thumbnail = find_thumb(self.get_current_path(), old_name)
-            new_name = f'{new_name}.jpg'
-            old_name = f'{old_name}.jpg'
-            if old_local_thumbnail:
-                new_local_thumbnail = os.path.join(os.path.split(old_local_thumbnail)[0], new_name)
-                try:
-                    if os.path.exists(new_local_thumbnail):
-                        os.remove(new_local_thumbnail)
-                    os.rename(old_local_thumbnail, new_local_thumbnail)
-                except Exception as ex:
-                    ex_log('Failed to rename local thumbnail', ex)
-
-                old_remote_thumbnail = posix_path(self.get_current_path(), thumb_dir, old_name)
-                new_remote_thumbnail = posix_path(self.get_current_path(), thumb_dir, new_name)
-                try:
-                    self.sftp.rename(old_remote_thumbnail, new_remote_thumbnail)
-                except Exception as ex:
-                    ex_log('Failed to rename remote thumbnail', ex)
+            old_thumbnail = f'{old_name}.jpg'
+            new_thumbnail = f'{new_name}.jpg'
+            levels = {level: thumb_index.get(path, old_name, level) for level in thumb_levels}
+            levels = {level: local for level, local in levels.items() if local}
+            bundled = bool(levels) and self.has_bundle(path)
+            for level, old_local_thumbnail in levels.items():
+                self.rename_level(path, level, old_local_thumbnail, old_thumbnail, new_thumbnail, bundled)
+            thumb_index.rename(path, old_name, new_name)
+
+    def has_bundle(self, path):
+        bundled = self.bundled_dirs.get(path)
+        if bundled is None:
+            bundled = self.bundled_dirs[path] = self.sftp.exists(posix_path(thumb_level_dir(path), index_name))
+        return bundled
+
+    def rename_level(self, path, level, old_local_thumbnail, old_thumbnail, new_thumbnail, bundled):
+        """Renames local and remote thumbnails of one level, bundle is tried only if path has one"""
+        new_local_thumbnail = os.path.join(os.path.split(old_local_thumbnail)[0], new_thumbnail)
+        try:
+            os.replace(old_local_thumbnail, new_local_thumbnail)
+        except Exception as ex:
+            ex_log(f'Failed to rename local thumbnail {ex}')
 
-    def rename_file(self, old, new, file, drop=False):
+        old_remote_thumbnail = posix_path(thumb_level_dir(path, level), old_thumbnail)
+        new_remote_thumbnail = posix_path(thumb_level_dir(path, level), new_thumbnail)
+        try:
+            self.sftp.rename(old_remote_thumbnail, new_remote_thumbnail)
+        except Exception as ex:
+            ex_log(f'Failed to rename remote thumbnail {ex}')
 
-        old_path = posix_path(self.get_current_path(), old)
-        new_path = posix_path(self.get_current_path(), new)
-        if not self.sftp.exists(new_path):
-            try:
-                self.sftp.rename(old_path, new_path)
-            except IOError as ie:
-                ex_log(f'Failed to rename file {ie}')
-                file.filename = old
+        if not bundled:
+            return
+        bundle = ThumbBundle(self.sftp.sftp_client, path, level)
+        try:
+            # thumbnail of a file moved to another directory is dropped from the bundle
+            if '/' in new_thumbnail:
+                bundle.remove(old_thumbnail)
             else:
-                logger.info(f'File renamed from {file.filename} to {os.path.split(new)[1]}')
-                if drop:
-                    self.files_space.remove_file(file)
-                else:
-                    attrs = self.get_file_attrs(new_path)
-                    if attrs:
-                        file.attrs = copy.deepcopy(attrs)
-                        file.filename = attrs.filename
-            finally:
-                self.rename_thumbnail(old, new)
-                self.files_space.refresh_thumbnail(new)
+                bundle.rename(old_thumbnail, new_thumbnail)
+        except IOError:
+            # directory has no bundle
+            pass
+        except Exception as ex:
+            ex_log(f'Failed to rename thumbnail in bundle {ex}')
+
+    def rename_file(self, old, new, file, drop=False):
+        path = self.get_current_path()
+        self.browser.submit(self.rename_remote, path, old, new, drop,
+                            on_done=partial(self.renamed, path, old, new, file, drop),
+                            on_error=partial(self.rename_failed, path, old, new, file, drop))
+
+    def rename_remote(self, path, old, new, drop):
+        """
+        Renames file in browser's thread. Returns attrs of renamed file unless it was moved
+        to a directory and mtime of path after renaming.
+        """
+        new_path = posix_path(path, new)
+        if self.sftp.exists(new_path):
+            raise FileExistsError(new_path)
+        self.sftp.rename(posix_path(path, old), new_path)
+        mtime = remote_mtime(path, self.sftp)
+        self.rename_thumbnail(path, old, new)
+        return None if drop else self.get_file_attrs(new_path), mtime
+
+    def renamed(self, path, old, new, file, drop, result):
+        attrs, mtime = result
+        logger.info(f'File renamed from {old} to {os.path.split(new)[1]}')
+        if drop:
+            self.listing_cache.rename(path, old, new, None, mtime)
+            self.listing_cache.invalidate(posixpath.split(posix_path(path, new))[0])
+            if self.is_current_path(path):
+                self.files_space.remove_file(file)
+            return
 
+        if attrs:
+            self.listing_cache.rename(path, old, new, attrs, mtime)
+            if self.is_current_path(path):
+                self.add_attrs([attrs])
+                file.set_attrs(attrs)
+                self.files_space.file_renamed(file, old)
+                return
         else:
+            self.listing_cache.invalidate(path)
+        self.files_space.refresh_item(file)
+
+    def rename_failed(self, path, old, new, file, drop, error):
+        if isinstance(error, FileExistsError):
             confirm_popup(callback=self.remove_and_rename,
                           movable=True,
-                          _args=[new_path, old, new, file, drop],
+                          _args=[posix_path(path, new), old, new, file, drop],
                           text='File already exists in destination directory.\n\n'
                                'Click "Yes" if you wish to remove existing file and move'
                           )
+        else:
+            ex_log(f'Failed to rename file {error}')
+            self.files_space.refresh_item(file)
 
     def remove_and_rename(self, popup, content, answer):
         """
@@ -415,45 +628,21 @@ class RemoteDir(BoxLayout):
         :return:
         """
         if answer == 'yes':
-            try:
-                self.sftp.remove(content._args[0])
-            except Exception as ex:
-                content.text = 'Could not remove file. Try again later'
-                ex_log(f'Failed to remove and rename file {ex}')
-            else:
+            def removed(_):
                 popup.dismiss()
                 self.rename_file(content._args[1], content._args[2], content._args[3], content._args[4])
 
+            def failed(ex):
+                content.text = 'Could not remove file. Try again later'
+                ex_log(f'Failed to remove and rename file {ex}')
+
+            self.browser.submit(self.sftp_remove, content._args[0], on_done=removed, on_error=failed)
+
         else:
             popup.dismiss()
 
-    def rmdir(self, remote_path, file):
-        task = {'type': 'remove_remote',
-                'remote_path': remote_path,
-                'on_remove': partial(self.files_space.remove_file, file),
-                'progress_box': self.progress_box}
-        self.execute_sftp_task(task)
-
-        # try:
-        #     for f in self.sftp.listdir_attr(path):
-        #         rpath = posix_path(path, f.filename)
-        #         if stat.S_ISDIR(f.st_mode):
-        #             self.rmdir(rpath)
-        #         else:
-        #             rpath = posix_path(path, f.filename)
-        #             self.sftp.remove(rpath)
-        # except OSError as ose:
-        #     if ose == 'Socket is closed':
-        #         self.callback = partial(self.rmdir, path)
-        #         self.connect()
-        #
-        # except Exception as ex:
-        #     ex_log(f'Failed to remove directory {ex}')
-        #     return False
-        # else:
-        #     logger.info(f'Succesfully removed file {os.path.split(path)[1]}')
-        #     self.sftp.rmdir(path)
-        #     return True
+    def sftp_remove(self, path):
+        self.sftp.remove(path)
 
     def transfer_start(self):
         self.progress_box.transfer_start()
@@ -465,31 +654,124 @@ class RemoteDir(BoxLayout):
         self.mouse_locked = False
 
     def chdir(self, path):
-        # noinspection PyBroadException
-        try:
-            self.sftp.chdir(path)
-        except IOError as ie:
-            ex_log(f'Failed to change dir {ie}')
-            if ie.errno == 2:
+        """Changes directory in background, opening another directory meanwhile cancels this one"""
+        if self.lister:
+            self.lister.cancel()
+        self.browser.submit(self.change_dir, path,
+                            on_done=self.dir_changed,
+                            on_error=partial(self.chdir_failed, path),
+                            key='chdir')
+
+    def change_dir(self, path):
+        self.sftp.chdir(path)
+        return self.sftp.getcwd() or posix_path()
+
+    def dir_changed(self, cwd):
+        self.cwd = cwd
+        self.cancel_search()
+        self.get_base_path()
+        self.start_catalog()
+        self.list_dir()
+        self.current_path = cwd
+        self.paths_history.append(cwd)
+
+    def chdir_failed(self, path, error):
+        ex_log(f'Failed to change dir {error}')
+        if isinstance(error, IOError):
+            if error.errno == 2 and path != self.current_path:
                 self.chdir(self.current_path)
-            elif str(ie) == 'Socket is closed':
+            elif str(error) == 'Socket is closed':
                 self.reconnect()
-        except Exception as ex:
-            ex_log(f'Failed to change dir {ex}')
-            self.reconnect()
-            return False
         else:
-            self.list_dir()
-            self.current_path = path
-            self.paths_history.append(self.get_current_path())
-            return True
+            self.reconnect()
 
     def is_current_path(self, path):
-        return path == self.get_current_path()
+        return not self.searching and path == self.get_current_path()
+
+    def trim_cache(self):
+        """Keeps local cache within limits of settings, now and every cache_trim_interval"""
+        cache_manager.trim_async()
+        Clock.schedule_interval(lambda _: cache_manager.trim_async(), self.cache_trim_interval)
+
+    def start_catalog(self):
+        """Crawls the remote tree from base path into the catalog, then again every crawl_interval"""
+        if self.catalog:
+            return
+        host = f'{self.connection.user}@{self.connection.server}_{self.connection.port}'
+        try:
+            self.catalog = Catalog(host)
+        except Exception as ex:
+            ex_log(f'Failed to open catalog {ex}')
+            return
+
+        def crawl(_=None):
+            self.catalog.crawl(self.base_path, self.connection.connect)
+        crawl()
+        Clock.schedule_interval(crawl, self.crawl_interval)
+
+    def search(self, text):
+        """
+        Shows files from the whole remote tree matching text, see Catalog.search.
+        With search_content on, or text starting with 'grep:', searches content of files
+        in current directory, see ContentSearch. Empty text shows current directory again.
+        """
+        text = text.strip()
+        self.cancel_search()
+        if not text:
+            self.list_dir()
+            return
+        content = self.search_content or text.startswith('grep:')
+        if text.startswith('grep:'):
+            text = text[5:].strip()
+        if not self.catalog and not content:
+            return
+
+        if self.prefetcher:
+            self.prefetcher.cancel()
+        if self.lister:
+            self.lister.cancel()
+        self.streaming = False
+        self.searching = True
+        self.files_space.fill([])
+        if content:
+            self.content_search = ContentSearch(self.get_current_path(), text, self.connection.connect,
+                                                on_results=self.search_results,
+                                                on_done=self.content_search_done)
+            self.content_search.start()
+        else:
+            attrs_list = self.catalog.search(text)
+            logger.info(f'Found {len(attrs_list)} files matching {text}')
+            self.search_results(attrs_list)
+        self.update_loading()
+
+    def search_results(self, attrs_list):
+        # filenames of results are full paths
+        self.add_attrs(attrs_list)
+        for attrs in attrs_list:
+            attrs.thumbnail = False
+        self.files_space.extend(attrs_list)
+
+    def content_search_done(self, count, error, stopped):
+        if error:
+            ex_log(f'Content search failed {error}')
+            info = self.progress_box.mk_info(f'Search in files failed: {error}')
+            self.progress_box.add_bar(info)
+        elif stopped:
+            # user has to know not all matching files are shown
+            info = self.progress_box.mk_info(f'Search in files {stopped}, results are partial')
+            self.progress_box.add_bar(info)
+        self.content_search = None
+        self.update_loading()
+
+    def cancel_search(self):
+        self.searching = False
+        if self.content_search:
+            self.content_search.cancel()
+            self.content_search = None
+            self.update_loading()
 
     def get_current_path(self):
-        current = self.sftp.getcwd()
-        return current if current else posix_path()
+        return self.cwd if self.cwd else posix_path()
 
     def uploaded(self, path, attrs):
         pass
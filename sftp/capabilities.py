@@ -0,0 +1,23 @@
+"""
+Remembers which optional features (sftp extensions, exec channel, commands)
+a server supports so the unsupported ones are not tried again on every call.
+"""
+
+_capabilities = {}
+
+
+def server_key(sftp):
+    # noinspection PyBroadException
+    try:
+        return sftp._transport.getpeername()
+    except Exception:
+        return None
+
+
+def supports(sftp, feature):
+    """Returns True or False if the feature was already tested on this server, otherwise None"""
+    return _capabilities.get((server_key(sftp), feature))
+
+
+def set_support(sftp, feature, supported):
+    _capabilities[(server_key(sftp), feature)] = supported
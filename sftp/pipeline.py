@@ -0,0 +1,135 @@
+"""
+Pipelining of sftp requests.
+
+paramiko sends one request and waits for its response in every call (remove, rmdir, stat...).
+RequestPipeline keeps many requests in flight on a single sftp channel and dispatches
+responses to callbacks as they arrive, so the round trip time is paid once per window
+instead of once per request.
+"""
+from paramiko.sftp import CMD_REMOVE, CMD_RMDIR, CMD_STATUS, CMD_LSTAT, CMD_ATTRS, CMD_EXTENDED, int64
+from paramiko.sftp import CMD_OPENDIR, CMD_READDIR, CMD_CLOSE, CMD_HANDLE, SFTPError
+from paramiko.sftp_attr import SFTPAttributes
+from paramiko.common import DEBUG
+
+SFTP_OK = 0
+SFTP_EOF = 1
+SFTP_NO_SUCH_FILE = 2
+SFTP_OP_UNSUPPORTED = 8
+
+
+class RequestPipeline:
+    """
+    One pipeline per sftp connection. Not thread safe, the connection
+    must not be used by anything else until drain() returns.
+    """
+    def __init__(self, sftp, max_in_flight=64):
+        self.client = sftp.sftp_client
+        self.max_in_flight = max_in_flight
+        self.callbacks = {}
+
+    def submit(self, t, args, callback):
+        """
+        Sends request of type t. callback(t, msg) is called when response arrives.
+        Blocks while there are max_in_flight requests waiting for response.
+        """
+        while len(self.callbacks) >= self.max_in_flight:
+            self.read_one()
+        num = self.client._async_request(self, t, *args)
+        self.callbacks[num] = callback
+
+    def read_one(self):
+        # reads exactly one packet and dispatches it to _async_response
+        self.client._read_response()
+
+    def drain(self):
+        while self.callbacks:
+            self.read_one()
+
+    def _async_response(self, t, msg, num):
+        callback = self.callbacks.pop(num, None)
+        if callback:
+            callback(t, msg)
+        else:
+            self.client._log(DEBUG, f'Pipeline got unexpected response #{num}')
+
+    def adjust(self, path):
+        # relative paths are resolved against the cwd of the connection as paramiko does
+        return self.client._adjust_cwd(path)
+
+    @staticmethod
+    def status(t, msg):
+        """Returns (code, text) of status response"""
+        if t != CMD_STATUS:
+            return None, None
+        code = msg.get_int()
+        try:
+            text = msg.get_text()
+        except Exception:
+            text = ''
+        return code, text
+
+    def remove(self, path, callback):
+        """callback(path, code, text), code 0 means success"""
+        self.submit(CMD_REMOVE, [self.adjust(path)], lambda t, msg: callback(path, *self.status(t, msg)))
+
+    def rmdir(self, path, callback):
+        """callback(path, code, text), code 0 means success"""
+        self.submit(CMD_RMDIR, [self.adjust(path)], lambda t, msg: callback(path, *self.status(t, msg)))
+
+    def lstat(self, path, callback):
+        """callback(path, attrs) attrs is None when path does not exist"""
+        def response(t, msg):
+            if t == CMD_ATTRS:
+                callback(path, SFTPAttributes._from_msg(msg))
+            else:
+                callback(path, None)
+        self.submit(CMD_LSTAT, [self.adjust(path)], response)
+
+    def listdir_batches(self, path, batch=8):
+        """
+        Yields lists of SFTPAttributes of entries of directory path, each list read with
+        batch readdir requests in flight. Between the lists no request is in flight, so the reading
+        can be stopped there by closing the generator, which also closes the directory handle.
+        """
+        t, msg = self.client._request(CMD_OPENDIR, self.adjust(path))
+        if t != CMD_HANDLE:
+            raise SFTPError('Expected handle')
+        handle = msg.get_binary()
+        eof = False
+        error = None
+
+        def response(_t, _msg):
+            nonlocal eof, error
+            if _t == CMD_STATUS:
+                code, text = self.status(_t, _msg)
+                if code != SFTP_EOF:
+                    error = IOError(text)
+                eof = True
+                return
+            for _ in range(_msg.get_int()):
+                filename = _msg.get_text()
+                longname = _msg.get_text()
+                attrs = SFTPAttributes._from_msg(_msg, filename, longname)
+                if filename not in ('.', '..'):
+                    entries.append(attrs)
+
+        try:
+            while not eof:
+                entries = []
+                for _ in range(batch):
+                    self.submit(CMD_READDIR, [handle], response)
+                self.drain()
+                if error:
+                    raise error
+                yield entries
+        finally:
+            self.drain()
+            self.client._request(CMD_CLOSE, handle)
+
+    def copy_data(self, src_handle, dst_handle, callback):
+        """
+        Copies whole content of src_handle to dst_handle on the server ("copy-data" extension).
+        callback(code, text), SFTP_OP_UNSUPPORTED means the server does not know the extension.
+        """
+        args = ['copy-data', src_handle, int64(0), int64(0), dst_handle, int64(0)]
+        self.submit(CMD_EXTENDED, args, lambda t, msg: callback(*self.status(t, msg)))
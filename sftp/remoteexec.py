@@ -0,0 +1,63 @@
+"""
+Running shell commands on the server over an SSH exec channel
+opened on the transport of an existing sftp connection.
+"""
+from common import mk_logger
+from shlex import quote
+from time import monotonic, sleep
+
+logger = mk_logger(__name__)
+ex_log = mk_logger(name=f'{__name__}-EX',
+                   level=40,
+                   _format='[%(levelname)-8s] [%(asctime)s] [%(name)s] [%(funcName)s] [%(lineno)d] [%(message)s]')
+ex_log = ex_log.exception
+
+
+class ExecUnavailable(Exception):
+    """Raised when server does not allow to open exec channel"""
+
+
+def quote_paths(paths):
+    return ' '.join(quote(_path) for _path in paths)
+
+
+def open_channel(sftp, command, timeout=None):
+    try:
+        channel = sftp._transport.open_session()
+        channel.settimeout(timeout)
+        channel.exec_command(command)
+    except Exception as ex:
+        raise ExecUnavailable(ex)
+    return channel
+
+
+def exec_command(sftp, command, timeout=None):
+    """
+    Runs command and waits for it to finish, at most timeout seconds when given.
+    Stdout and stderr are read as they come, so a command writing much to one of them
+    does not stall on the full channel window while the other one is read.
+
+    :return: exit status (-1 on timeout), stdout and stderr as bytes
+    """
+    channel = open_channel(sftp, command)
+    deadline = None if timeout is None else monotonic() + timeout
+    stdout = []
+    stderr = []
+    try:
+        while True:
+            if channel.recv_ready():
+                stdout.append(channel.recv(32768))
+            elif channel.recv_stderr_ready():
+                stderr.append(channel.recv_stderr(32768))
+            elif channel.exit_status_ready() and (channel.eof_received or channel.closed):
+                break
+            elif deadline and monotonic() > deadline:
+                logger.info(f'Command timed out: {command}')
+                return -1, b''.join(stdout), b''.join(stderr)
+            else:
+                sleep(.01)
+        status = channel.recv_exit_status()
+    finally:
+        channel.close()
+
+    return status, b''.join(stdout), b''.join(stderr)
@@ -0,0 +1,164 @@
+"""
+Thumbnails of remote files which have none stored on the server.
+
+The file is not downloaded. Its first bytes tell the format and for JPEG, TIFF and TIFF based
+RAW files the embedded preview is found by walking EXIF/TIFF directories with small ranged reads,
+so usually only a few tens of KB are read. Files with no usable preview are made into thumbnails
+on the server by ImageMagick convert or ffmpeg over an exec channel, if the server has them.
+"""
+from common import mk_logger
+from processes import thumbengine
+from processes.exif import tiff_previews, ORIENTATION
+from sftp.remoteexec import exec_command, ExecUnavailable
+from sftp.capabilities import supports, set_support
+from PIL import ImageOps
+from shlex import quote
+from io import BytesIO
+import os
+import struct
+
+logger = mk_logger(__name__)
+ex_log = mk_logger(name=f'{__name__}-EX',
+                   level=40,
+                   _format='[%(levelname)-8s] [%(asctime)s] [%(name)s] [%(funcName)s] [%(lineno)d] [%(message)s]')
+ex_log = ex_log.exception
+
+head_size = 64 * 1024
+# previews bigger than this are not read, e.g. full size JPEG in IFD0 of CR2
+max_preview = 4 * 1024 * 1024
+exec_timeout = 30
+# files worth trying, others are not even opened
+extensions = {'.jpg', '.jpeg', '.jpe', '.jfif', '.tif', '.tiff', '.png', '.gif', '.bmp', '.webp', '.heic',
+              '.mp4', '.m4v', '.mov', '.mkv', '.webm', '.avi', '.flv', '.mpg', '.mpeg', '.3gp', '.cr3',
+              } | thumbengine.raw_extensions
+
+
+def can_have_thumbnail(name):
+    return os.path.splitext(name)[1].lower() in extensions
+
+
+class RangedReader:
+    """Reads byte ranges of remote file, the ones inside of the head are served from memory"""
+    def __init__(self, file, head, base=0):
+        self.file = file
+        self.head = head
+        # offset of TIFF header in the file, offsets in TIFF directories are relative to it
+        self.base = base
+
+    def read(self, offset, length):
+        offset += self.base
+        if offset + length <= len(self.head):
+            return self.head[offset:offset + length]
+        return b''.join(self.file.readv([(offset, length)]))
+
+
+def exif_segment(reader):
+    """Returns (offset, length) of TIFF data in APP1 Exif segment of JPEG or None"""
+    offset = 2
+    while True:
+        marker = reader.read(offset, 4)
+        if len(marker) < 4 or marker[0] != 0xff:
+            return None
+        code = marker[1]
+        length = struct.unpack('>H', marker[2:4])[0]
+        # start of scan, no EXIF before image data
+        if code == 0xda:
+            return None
+        if code == 0xe1 and reader.read(offset + 4, 6) == b'Exif\x00\x00':
+            return offset + 10, length - 8
+        offset += 2 + length
+
+
+def decode_preview(data, size, orientation):
+    image = thumbengine.open_jpeg(BytesIO(data), size)
+    image.getexif()[ORIENTATION] = orientation
+    return image
+
+
+def embedded_preview(file, head, size):
+    """Returns thumbnail image made of preview embedded in JPEG, TIFF or RAW file, or None"""
+    reader = RangedReader(file, head)
+    if head.startswith(b'\xff\xd8'):
+        segment = exif_segment(reader)
+        if not segment:
+            return None
+        reader = RangedReader(file, head, base=segment[0])
+    elif head[:4] not in thumbengine.tiff_signatures:
+        return None
+
+    orientation, previews = tiff_previews(reader, reader.read(0, 8))
+    fallback = None
+    # the smallest preview big enough for size is read, EXIF thumbnails are only ~10KB
+    for offset, length in sorted(previews, key=lambda preview: preview[1]):
+        if length > max_preview:
+            break
+        data = reader.read(offset, length)
+        if not data.startswith(b'\xff\xd8'):
+            continue
+        try:
+            image = decode_preview(data, size, orientation)
+        except Exception:
+            # e.g. lossless JPEG of RAW sensor data
+            continue
+        if image.width >= size[0] * thumbengine.exif_thumb_ratio \
+                or image.height >= size[1] * thumbengine.exif_thumb_ratio:
+            return image
+        fallback = image
+    return fallback
+
+
+def exec_thumbnail(sftp, path, kind, size):
+    """JPEG data of thumbnail made by convert or ffmpeg on the server, or None"""
+    if kind == thumbengine.VIDEO:
+        program = 'ffmpeg'
+        command = (f'ffmpeg -nostdin -v error -ss 1 -i {quote(path)} -frames:v 1 '
+                   f'-vf scale={size[0]}:{size[1]}:force_original_aspect_ratio=decrease '
+                   f'-f image2pipe -vcodec mjpeg -')
+    else:
+        program = 'convert'
+        command = f'convert {quote(path + "[0]")} -auto-orient -thumbnail {size[0]}x{size[1]} jpg:-'
+
+    if supports(sftp, 'exec') is False or supports(sftp, program) is False:
+        return None
+    try:
+        status, out, err = exec_command(sftp, command, timeout=exec_timeout)
+    except ExecUnavailable as eu:
+        logger.info(f'Exec not available, no thumbnail made on server {eu}')
+        set_support(sftp, 'exec', False)
+        return None
+
+    set_support(sftp, 'exec', True)
+    # command not found
+    if status == 127:
+        logger.info(f'{program} not found on server')
+        set_support(sftp, program, False)
+        return None
+    set_support(sftp, program, True)
+    if status != 0 or not out.startswith(b'\xff\xd8'):
+        logger.info(f'{program} failed on {path} {status} {err[:200]}')
+        return None
+    return out
+
+
+def remote_thumbnail(sftp, path, size=(300, 200)):
+    """
+    Returns JPEG data of thumbnail of remote file path or None.
+    sftp is pysftp connection, it is used for exec when the file has no embedded preview.
+    """
+    with sftp.sftp_client.open(path, 'rb') as file:
+        head = file.read(head_size)
+        kind = thumbengine.kind_of(head[:32], path)
+        if not kind:
+            return None
+        image = None
+        if kind != thumbengine.VIDEO:
+            try:
+                image = embedded_preview(file, head, size)
+            except (struct.error, IOError) as ex:
+                logger.info(f'No embedded preview in {path} {ex}')
+
+    if image:
+        image = ImageOps.exif_transpose(image)
+        image.thumbnail(size, reducing_gap=2.0)
+        return thumbengine.encode(image)
+    return exec_thumbnail(sftp, path, kind, size)
@@ -0,0 +1,252 @@
+"""
+Thumbnails of a remote directory packed into one file.
+
+.rdthumbnails/thumbnails.pack holds JPEG data of thumbnails one after another and
+.rdthumbnails/thumbnails.index has a JSON line [name, offset, length, mtime] for each of them.
+Both are only appended to. A later line of a name replaces the earlier ones and length -1
+marks a removed thumbnail. Reading all thumbnails of a directory costs reading the index
+and a few ranged reads of the pack, instead of opening every thumbnail file.
+Compaction writes the live thumbnails to a new pack when the dead data is the bigger part.
+The new pack has a numbered name, e.g. thumbnails.1.pack, given by the first line {"pack": name}
+of the new index, so renaming the index over the old one switches both at once. The old pack
+is removed after that.
+Writers of a bundle, threads of this app and other clients, wait for each other on a lock
+directory in the bundle's directory, see bundle_lock. Readers take no lock.
+Thumbnails stored as separate files are still read by clients, bundles are written only
+when enabled in settings.
+Each level of thumbnails (see common.thumb_levels) has a bundle of its own in its directory.
+"""
+from common import mk_logger, posix_path, thumb_level_dir, base_level
+from collections import OrderedDict
+from contextlib import contextmanager
+from threading import Lock
+from time import monotonic, sleep
+import posixpath
+import json
+
+logger = mk_logger(__name__)
+ex_log = mk_logger(name=f'{__name__}-EX',
+                   level=40,
+                   _format='[%(levelname)-8s] [%(asctime)s] [%(name)s] [%(funcName)s] [%(lineno)d] [%(message)s]')
+ex_log = ex_log.exception
+
+pack_name = 'thumbnails.pack'
+index_name = 'thumbnails.index'
+lock_name = 'thumbnails.lock'
+# lock left by a client which died is taken over after this
+lock_timeout = 30
+# entries closer than this are read with one request
+max_gap = 64 * 1024
+max_range = 4 * 1024 * 1024
+
+# threads of this app writing the same bundle wait for each other
+_locks = {}
+_locks_lock = Lock()
+
+
+def local_lock(path):
+    with _locks_lock:
+        return _locks.setdefault(path, Lock())
+
+
+@contextmanager
+def bundle_lock(client, directory):
+    """
+    Lock of bundle in directory held by one writer of any client. mkdir of the lock directory
+    fails while another writer holds it. Raises IOError if directory does not exist.
+    """
+    lock_path = posix_path(directory, lock_name)
+    with local_lock(directory):
+        deadline = monotonic() + lock_timeout
+        while True:
+            try:
+                client.mkdir(lock_path)
+                break
+            except FileNotFoundError:
+                raise
+            except IOError:
+                if monotonic() > deadline:
+                    logger.info(f'Taking over lock of thumbnails bundle {directory}')
+                    break
+                sleep(.1)
+        try:
+            yield
+        finally:
+            try:
+                client.rmdir(lock_path)
+            except IOError as ie:
+                logger.info(f'Lock of thumbnails bundle {directory} not removed {ie}')
+
+
+def is_bundle_file(name):
+    """Files of bundle which are not thumbnails, packs of all versions included"""
+    return name in (index_name, lock_name) or name.startswith('thumbnails.') and name.endswith('.pack')
+
+
+def next_pack_name(name):
+    """thumbnails.pack -> thumbnails.1.pack -> thumbnails.2.pack"""
+    parts = name.split('.')
+    version = int(parts[1]) if len(parts) == 3 else 0
+    return f'thumbnails.{version + 1}.pack'
+
+
+class BundleIndex(OrderedDict):
+    """{name: (offset, length, mtime)} of live thumbnails of a bundle, pack is name of their pack file"""
+    def __init__(self, pack=pack_name):
+        super().__init__()
+        self.pack = pack
+
+
+class ThumbBundle:
+    """Bundle of a level of thumbnails of remote directory path, client is paramiko SFTPClient"""
+    def __init__(self, client, path, level=base_level):
+        self.client = client
+        self.path = path
+        self.dir = thumb_level_dir(path, level)
+        self.index_path = posix_path(self.dir, index_name)
+
+    def pack_path(self, pack):
+        return posix_path(self.dir, pack)
+
+    def read_index(self):
+        """
+        Returns BundleIndex of live thumbnails.
+        Raises IOError if the directory has no bundle.
+        """
+        entries = BundleIndex()
+        with self.client.open(self.index_path, 'r') as file:
+            data = file.read()
+        for line in data.decode('utf-8', errors='surrogateescape').splitlines():
+            try:
+                value = json.loads(line)
+                if isinstance(value, dict):
+                    entries.pack = value['pack']
+                    continue
+                name, offset, length, mtime = value
+            except (ValueError, KeyError):
+                # line cut by interrupted write
+                continue
+            entries.pop(name, None)
+            if length >= 0:
+                entries[name] = (offset, length, mtime)
+        return entries
+
+    def current_pack(self):
+        """Name of the pack appended to, only the first line of the index is read"""
+        try:
+            with self.client.open(self.index_path, 'r') as file:
+                line = file.readline()
+            return json.loads(line)['pack']
+        except (IOError, ValueError, KeyError, TypeError):
+            return pack_name
+
+    def read(self, entries, names):
+        """
+        Yields (name, data) of names, their entries from read_index.
+        Neighbouring thumbnails are read with one ranged read.
+        """
+        wanted = sorted((entries[name][0], entries[name][1], name) for name in names if name in entries)
+        ranges = []
+        for offset, length, name in wanted:
+            if ranges:
+                start, end, members = ranges[-1]
+                if offset - end <= max_gap and offset + length - start <= max_range:
+                    ranges[-1] = (start, max(end, offset + length), members + [(name, offset, length)])
+                    continue
+            ranges.append((offset, offset + length, [(name, offset, length)]))
+
+        with self.client.open(self.pack_path(entries.pack), 'rb') as file:
+            chunks = file.readv([(start, end - start) for start, end, _ in ranges])
+            for (start, _, members), chunk in zip(ranges, chunks):
+                for name, offset, length in members:
+                    yield name, chunk[offset - start:offset - start + length]
+
+    def append(self, name, data, mtime):
+        """Adds or replaces thumbnail name"""
+        self.makedirs()
+        with bundle_lock(self.client, self.dir):
+            pack_path = self.pack_path(self.current_pack())
+            try:
+                offset = self.client.stat(pack_path).st_size
+                mode = 'r+b'
+            except IOError:
+                offset = 0
+                mode = 'wb'
+            with self.client.open(pack_path, mode) as file:
+                file.seek(offset)
+                file.write(data)
+            self.write_index([[name, offset, len(data), int(mtime)]])
+
+    def makedirs(self):
+        """Thumbnails directory and the directory of the level in it"""
+        for directory in (posixpath.dirname(self.dir), self.dir):
+            try:
+                self.client.mkdir(directory)
+            except IOError:
+                pass
+
+    def write_index(self, lines, mode='ab'):
+        text = ''.join(json.dumps(line) + '\n' for line in lines)
+        with self.client.open(self.index_path, mode) as file:
+            file.write(text.encode('utf-8', errors='surrogateescape'))
+
+    def rename(self, old, new, compact=True):
+        """Raises IOError if the directory has no bundle"""
+        with bundle_lock(self.client, self.dir):
+            entries = self.read_index()
+            entry = entries.get(old)
+            if not entry:
+                return False
+            offset, length, mtime = entry
+            self.write_index([[new, offset, length, mtime], [old, 0, -1, 0]])
+        if compact:
+            self.compact()
+        return True
+
+    def remove(self, name, compact=True):
+        """Raises IOError if the directory has no bundle"""
+        return bool(self.remove_many([name], compact))
+
+    def remove_many(self, names, compact=True):
+        """
+        Removes thumbnails names with one read and one write of the index.
+        Returns number of removed ones. Raises IOError if the directory has no bundle.
+        """
+        with bundle_lock(self.client, self.dir):
+            entries = self.read_index()
+            removed = [name for name in names if name in entries]
+            if not removed:
+                return 0
+            self.write_index([[name, 0, -1, 0] for name in removed])
+        if compact:
+            self.compact()
+        return len(removed)
+
+    def compact(self, force=False):
+        """Rewrites pack without dead thumbnails when they are more than live ones"""
+        with bundle_lock(self.client, self.dir):
+            entries = self.read_index()
+            # renamed thumbnails share their data
+            live = sum(length for _, length in {(offset, length) for offset, length, _ in entries.values()})
+            old_pack = self.pack_path(entries.pack)
+            dead = self.client.stat(old_pack).st_size - live
+            if not force and dead <= live:
+                return
+            logger.info(f'Compacting thumbnails bundle of {self.path}, {dead} dead bytes')
+            pack = next_pack_name(entries.pack)
+            tmp_index = f'{self.index_path}.tmp'
+            lines = [{'pack': pack}]
+            offset = 0
+            # readers of the old index still read the old pack, the new one is seen only with the new index
+            with self.client.open(self.pack_path(pack), 'wb') as file:
+                for name, data in self.read(entries, list(entries)):
+                    file.write(data)
+                    lines.append([name, offset, len(data), entries[name][2]])
+                    offset += len(data)
+            with self.client.open(tmp_index, 'wb') as file:
+                file.write(''.join(json.dumps(line) + '\n' for line in lines).encode('utf-8', errors='surrogateescape'))
+            self.client.posix_rename(tmp_index, self.index_path)
+            try:
+                self.client.remove(old_pack)
+            except IOError as ie:
+                logger.info(f'Old thumbnails pack {old_pack} not removed {ie}')
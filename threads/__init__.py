@@ -5,19 +5,26 @@ This package contains threads for:
 - remote walk
 - opening files
 - making dirs on remote destination
+- removing remote files and directories
+- copying remote files and directories
+- uploading thumbnails
 """
-from threading import Thread
+from threading import Thread, Lock
 from threads.open import Open
 from threads.download import Download
 from threads.upload import Upload
 from threads.remotewalk import RemoteWalk
 from threads.mkremotedirs import MkRemoteDirs
-from threads.removeremote import RemoveRemoteDirectory
+from threads.removeremote import RemoveRemote
+from threads.remotecopy import RemoteCopy
+from threads.thumbupload import ThumbUpload
+from processes.pool import thumbnail_pool
+from managers.thumbindex import thumb_index
 from weakref import WeakValueDictionary
 import os
 import stat
 import queue
-from common import posix_path, pure_windows_path, mk_logger
+from common import posix_path, pure_windows_path, mk_logger, thumb_name, thumbnail_bundles, thumb_levels
 from kivy.clock import Clock
 from functools import partial
 from datetime import datetime
@@ -72,6 +79,13 @@ class TransferManager(Thread, metaclass=SingletonMeta):
         self.progress_box_shown = False
         self.progress_box.manager = self
         self.transfers_event = None
+        # thumbnails are made in processes while files are uploaded and uploaded after them
+        self.thumbnail_pool = thumbnail_pool
+        self.thumb_uploads = queue.Queue()
+        self.thumbs_lock = Lock()
+        self.thumbs_made = {}
+        # remote path: False if upload failed or was skipped, of uploads which ended before their thumbnail was made
+        self.files_uploaded = {}
         for _ in range(self.max_connections):
             self.thread_queue.put('.')
 
@@ -84,6 +98,7 @@ class TransferManager(Thread, metaclass=SingletonMeta):
                     self.local_walk(task)
                 else:
                     self.transfers.put({**task, 'dir': False})
+                    self.make_thumbnail(task)
 
             elif task['type'] == 'download':
                 if stat.S_ISDIR(task['attrs'].st_mode):
@@ -99,6 +114,9 @@ class TransferManager(Thread, metaclass=SingletonMeta):
             elif task['type'] == 'remove_remote':
                 self.transfers.put({**task})
 
+            elif task['type'] == 'copy_remote':
+                self.transfers.put({**task})
+
     def start_transfers(self):
         if not self.transfers_event:
             self.transfers_event = Clock.schedule_interval(self.next_transfer, self.delay)
@@ -153,6 +171,23 @@ class TransferManager(Thread, metaclass=SingletonMeta):
                 return None
             return sftp
 
+    def idle_sftp(self):
+        """
+        Returns alive connection from the queue or None if there is no idle one.
+        Unlike get_sftp it never opens a new connection.
+        """
+        while True:
+            try:
+                sftp = self.sftp_queue.get_nowait()
+            except queue.Empty:
+                return None
+            try:
+                sftp._transport.send_ignore()
+            except Exception:
+                sftp.close()
+            else:
+                return sftp
+
     def locked_path(self, dst_path):
         if dst_path in self.locked_paths:
             return True
@@ -169,47 +204,42 @@ class TransferManager(Thread, metaclass=SingletonMeta):
         :param _:
         :return:
         """
-        if not self.thread_queue.empty() and not self.transfers.empty():
+        if not self.thread_queue.empty() and not (self.transfers.empty() and self.thumb_uploads.empty()):
             self.time = datetime.now()
             self.thread_queue.get()
-            transfer = self.transfers.get()
+            # thumbnails wait for all other transfers
+            transfer = self.transfers.get() if not self.transfers.empty() else self.thumb_uploads.get()
             sftp = self.get_sftp()
             thread = None
             if not sftp:
                 # put back on the stack to no omit this transfer
-                self.transfers.put(transfer)
+                if transfer['type'] == 'thumbnail':
+                    self.thumb_uploads.put(transfer)
+                else:
+                    self.transfers.put(transfer)
+                self.thread_queue.put('.')
                 return
             if transfer['type'] == 'upload':
                 if transfer['dir']:
                     thread = MkRemoteDirs(transfer, manager=self, sftp=sftp)
                 else:
-                    if not transfer.get('bar'):
-                        bar = self.progress_box.mk_bar()
-                        self.progress_box.add_bar(bar)
-                        if not self.progress_box_shown:
-                            self.progress_box.show_bars()
-                            self.progress_box_shown = True
-                    else:
-                        bar = transfer['bar']
-                    thread = Upload(transfer, manager=self, bar=bar, sftp=sftp)
+                    thread = Upload(transfer, manager=self, bar=self.get_bar(transfer), sftp=sftp)
             elif transfer['type'] == 'download':
                 if transfer['dir']:
                     thread = RemoteWalk(data=transfer, manager=self, sftp=sftp)
                 else:
-                    if not transfer.get('bar'):
-                        bar = self.progress_box.mk_bar()
-                        self.progress_box.add_bar(bar)
-                        if not self.progress_box_shown:
-                            self.progress_box.show_bars()
-                            self.progress_box_shown = True
-                    else:
-                        bar = transfer['bar']
-                    thread = Download(data=transfer, manager=self, bar=bar, sftp=sftp)
+                    thread = Download(data=transfer, manager=self, bar=self.get_bar(transfer), sftp=sftp)
             elif transfer['type'] == 'open':
                 thread = Open(data=transfer, manager=self, sftp=sftp)
 
             elif transfer['type'] == 'remove_remote':
-                thread = RemoveRemoteDirectory(manager=self, sftp=sftp, data=transfer)
+                thread = RemoveRemote(manager=self, sftp=sftp, data=transfer)
+
+            elif transfer['type'] == 'copy_remote':
+                thread = RemoteCopy(transfer, manager=self, bar=self.get_bar(transfer), sftp=sftp)
+
+            elif transfer['type'] == 'thumbnail':
+                thread = ThumbUpload(transfer, manager=self, sftp=sftp)
 
             if thread:
                 self.threads.append(thread)
@@ -221,7 +251,7 @@ class TransferManager(Thread, metaclass=SingletonMeta):
             self.stop_transfers('All threads finished')
             undone = 0
             for thread in self.threads:
-                if isinstance(thread, Upload) or isinstance(thread, Download):
+                if isinstance(thread, (Upload, Download, RemoteCopy)):
                     if not thread.done:
                         undone += 1
                     if undone > 1:
@@ -229,8 +259,21 @@ class TransferManager(Thread, metaclass=SingletonMeta):
                         break
             self.progress_box.transfer_stop()
 
+    def get_bar(self, transfer):
+        """Returns bar of transfer which is retried or makes a new one"""
+        if transfer.get('bar'):
+            return transfer['bar']
+
+        bar = self.progress_box.mk_bar()
+        self.progress_box.add_bar(bar)
+        if not self.progress_box_shown:
+            self.progress_box.show_bars()
+            self.progress_box_shown = True
+        return bar
+
     def all_threads_finished(self):
-        return self.transfers.empty() and self.thread_queue.qsize() == self.max_connections
+        return self.transfers.empty() and self.thumb_uploads.empty() \
+            and self.thread_queue.qsize() == self.max_connections
 
     def end(self):
         if self.transfers.empty() and self.thread_queue.empty():
@@ -263,10 +306,13 @@ class TransferManager(Thread, metaclass=SingletonMeta):
             relative_path = posix_path(dst_path, *relative_path.split('\\'))
 
             for file in files:
-                self.put_transfer({'type': 'upload',
-                                   'dir': False,
-                                   'src_path': pure_windows_path(root, file),
-                                   'dst_path': relative_path})
+                transfer = {'type': 'upload',
+                            'dir': False,
+                            'src_path': pure_windows_path(root, file),
+                            'dst_path': relative_path,
+                            'thumbnails': task.get('thumbnails')}
+                self.put_transfer(transfer)
+                self.make_thumbnail(transfer)
             if dirs:
                 self.put_transfer({'type': 'upload',
                                    'dir': True,
@@ -274,8 +320,49 @@ class TransferManager(Thread, metaclass=SingletonMeta):
                                    'name': dirs})
         self.put_transfer({'type': 'upload', 'dir': True, 'dst_path': dst_path, 'name': [dir_to_walk]})
 
-    def uploaded(self, path, attrs):
-        Clock.schedule_once(partial(self.originator.add_file, path, attrs), 0.01)
+    def make_thumbnail(self, task):
+        if task.get('thumbnails'):
+            self.thumbnail_pool.submit(task['src_path'], task['dst_path'], self.thumbnail_made)
+
+    def thumbnail_made(self, src_path, dst_path, thumb_path):
+        """Called in a thread of thumbnail pool, thumb_path is None if thumbnail could not be made"""
+        file_name = os.path.split(src_path)[1]
+        if thumb_path:
+            for level in thumb_levels:
+                thumb_index.add(dst_path, thumb_name(src_path), level)
+            Clock.schedule_once(lambda _: self.originator.thumbnail_downloaded(dst_path, thumb_name(src_path)))
+        self.thumbnail_ready(dst_path, file_name, thumb_path=thumb_path)
+
+    def thumbnail_ready(self, dst_path, file_name, thumb_path=None, uploaded=False, failed=False):
+        """
+        Thumbnail is uploaded when both its file is uploaded and the thumbnail is made,
+        whichever comes last queues the upload. Thumbnail of a file whose upload failed
+        or was skipped is not uploaded.
+        """
+        remote_path = posix_path(dst_path, file_name)
+        with self.thumbs_lock:
+            if uploaded or failed:
+                if remote_path not in self.thumbs_made:
+                    self.files_uploaded[remote_path] = uploaded
+                    return
+                thumb_path = self.thumbs_made.pop(remote_path)
+            else:
+                if remote_path not in self.files_uploaded:
+                    self.thumbs_made[remote_path] = thumb_path
+                    return
+                uploaded = self.files_uploaded.pop(remote_path)
+
+        if thumb_path and uploaded:
+            self.thumb_uploads.put({'type': 'thumbnail',
+                                    'src_path': thumb_path,
+                                    'dst_path': dst_path,
+                                    'name': thumb_name(file_name),
+                                    'bundle': thumbnail_bundles()})
+            self.start_transfers()
+
+    def uploaded(self, path, attrs, mtime=None):
+        """File attrs was added to directory path, mtime is the one of path after that"""
+        Clock.schedule_once(partial(self.originator.add_file, path, attrs, mtime), 0.01)
 
     def is_current_path(self, path):
         return self.originator.is_current_path(path)
@@ -0,0 +1,88 @@
+from threading import Thread
+from common import mk_logger
+from kivy.clock import Clock
+import queue
+
+logger = mk_logger(__name__)
+ex_log = mk_logger(name=f'{__name__}-EX',
+                   level=40,
+                   _format='[%(levelname)-8s] [%(asctime)s] [%(name)s] [%(funcName)s] [%(lineno)d] [%(message)s]')
+ex_log = ex_log.exception
+
+
+class BrowseRequest:
+    """Operation submitted to Browser. cancel() drops it if it did not start yet and stops its callbacks."""
+    __slots__ = ('fn', 'args', 'on_done', 'on_error', 'key', 'cancelled', 'result', 'error')
+
+    def __init__(self, fn, args, on_done, on_error, key):
+        self.fn = fn
+        self.args = args
+        self.on_done = on_done
+        self.on_error = on_error
+        self.key = key
+        self.cancelled = False
+        self.result = None
+        self.error = None
+
+    def cancel(self):
+        self.cancelled = True
+
+
+class Browser(Thread):
+    """
+    Runs blocking sftp operations of RemoteDir one after another in a worker thread,
+    so the connection is used by one thread only and the window never waits for the server.
+    on_done(result) or on_error(exception) is called on the main thread unless the request
+    was cancelled. Submitting a request with the key of a pending one cancels the pending one.
+    on_busy(busy) is called on the main thread when the first request is submitted and
+    when the last one is finished.
+    """
+    def __init__(self, on_busy=None):
+        super().__init__(daemon=True)
+        self.requests = queue.Queue()
+        self.pending = {}
+        self.on_busy = on_busy
+        self.busy = 0
+
+    def submit(self, fn, *args, on_done=None, on_error=None, key=None):
+        """Must be called on the main thread"""
+        if key:
+            previous = self.pending.get(key)
+            if previous:
+                previous.cancel()
+        request = BrowseRequest(fn, args, on_done, on_error, key)
+        if key:
+            self.pending[key] = request
+
+        self.busy += 1
+        if self.busy == 1 and self.on_busy:
+            self.on_busy(True)
+        self.requests.put(request)
+        return request
+
+    def run(self):
+        while True:
+            request = self.requests.get()
+            if not request.cancelled:
+                try:
+                    request.result = request.fn(*request.args)
+                except Exception as ex:
+                    request.error = ex
+            Clock.schedule_once(lambda _, r=request: self.finish(r))
+
+    def finish(self, request):
+        if request.key and self.pending.get(request.key) is request:
+            del self.pending[request.key]
+
+        if not request.cancelled:
+            if request.error:
+                if request.on_error:
+                    request.on_error(request.error)
+                else:
+                    ex_log(f'{request.fn.__name__} failed {request.error}')
+            elif request.on_done:
+                request.on_done(request.result)
+
+        self.busy -= 1
+        if not self.busy and self.on_busy:
+            self.on_busy(False)
@@ -0,0 +1,214 @@
+from threading import Thread, Event
+from common import mk_logger, posix_path, thumb_dir
+from sftp.remoteexec import open_channel, quote_paths, ExecUnavailable
+from sftp.capabilities import supports, set_support
+from kivy.clock import Clock
+from time import monotonic
+import socket
+import stat
+import re
+
+logger = mk_logger(__name__)
+ex_log = mk_logger(name=f'{__name__}-EX',
+                   level=40,
+                   _format='[%(levelname)-8s] [%(asctime)s] [%(name)s] [%(funcName)s] [%(lineno)d] [%(message)s]')
+ex_log = ex_log.exception
+
+
+class ContentSearch(Thread):
+    """
+    Finds files under path whose content matches pattern, on a connection of its own.
+    Pattern is a plain text searched case insensitive, or a regex after 're:'.
+    grep runs on the server over an exec channel and matched files are passed in batches
+    to on_results(attrs_list) on the main thread while grep prints them. If the server gives no shell
+    or has no grep, files are read over sftp in ranges and searched here. The regex is POSIX ERE for grep
+    and Python re for that fallback, so a pattern using syntax of only one of them (e.g. lookarounds or
+    [[:alpha:]]) can find different files depending on the server.
+    Search stops after max_results files, after timeout seconds or when cancelled.
+    on_done(count, error, stopped) is called at the end unless cancelled, stopped tells why
+    the search ended before searching all files or is None.
+    Filename of found attrs is the full path.
+    """
+    max_results = 1000
+    timeout = 120
+    batch_interval = .2
+    # fallback reads only files up to this size
+    max_file_size = 10 * 1024 * 1024
+    chunk_size = 256 * 1024
+
+    def __init__(self, path, pattern, connect, on_results, on_done=None):
+        super().__init__(daemon=True)
+        self.path = path
+        self.regex = pattern.startswith('re:')
+        self.pattern = pattern[3:] if self.regex else pattern
+        self.connect = connect
+        self.on_results = on_results
+        self.on_done = on_done
+        self.cancelled = Event()
+        self.deadline = None
+        self.count = 0
+        self.batch = []
+        self.flushed = monotonic()
+
+    def cancel(self):
+        self.cancelled.set()
+
+    def stopped(self):
+        return self.cancelled.is_set() or self.count >= self.max_results or monotonic() > self.deadline
+
+    def run(self):
+        self.deadline = monotonic() + self.timeout
+        error = None
+        sftp = self.connect()
+        if not sftp:
+            self.deliver(self.on_done, 0, ConnectionError('Could not connect to server'), None)
+            return
+
+        try:
+            if supports(sftp, 'grep') is False:
+                self.search_sftp(sftp.sftp_client)
+            else:
+                try:
+                    self.search_exec(sftp)
+                except ExecUnavailable as eu:
+                    logger.info(f'Content search falls back to sftp reads, no exec channel or grep {eu}')
+                    set_support(sftp, 'grep', False)
+                    self.search_sftp(sftp.sftp_client)
+        except Exception as ex:
+            ex_log(f'Content search failed {ex}')
+            error = ex
+        finally:
+            self.flush()
+            sftp.close()
+
+        logger.info(f'Content search for {self.pattern} in {self.path} found {self.count} files')
+        self.deliver(self.on_done, self.count, error, self.stop_reason())
+
+    def stop_reason(self):
+        if self.count >= self.max_results:
+            return f'stopped at {self.max_results} files'
+        if monotonic() > self.deadline:
+            return f'stopped after {self.timeout} seconds'
+        return None
+
+    def search_exec(self, sftp):
+        option = '-E' if self.regex else '-F'
+        command = f'grep -rlIis --exclude-dir={thumb_dir} {option} -e {quote_paths([self.pattern])} ' \
+                  f'-- {quote_paths([self.path])}'
+        channel = open_channel(sftp, command, timeout=self.batch_interval)
+        client = sftp.sftp_client
+        rest = b''
+        try:
+            while not self.stopped():
+                try:
+                    data = channel.recv(32768)
+                except socket.timeout:
+                    self.flush_due()
+                    continue
+                if not data:
+                    break
+                lines = (rest + data).split(b'\n')
+                rest = lines.pop()
+                for line in lines:
+                    self.found(client, line.decode('utf-8', errors='surrogateescape'))
+                    if self.stopped():
+                        break
+                self.flush_due()
+            else:
+                return
+            if rest:
+                self.found(client, rest.decode('utf-8', errors='surrogateescape'))
+            status = channel.recv_exit_status()
+            err = channel.recv_stderr(4096).decode(errors='replace').strip()
+            if status in (126, 127) or 'not found' in err:
+                # no grep or it can't be run, e.g. restricted shell
+                raise ExecUnavailable(err)
+            set_support(sftp, 'grep', True)
+            # 1 is no match. 2 is also returned for unreadable files, -s keeps them out of stderr,
+            # so only 2 with a message and no match is an error, e.g. invalid pattern
+            if status > 1 and err and not self.count:
+                raise IOError(f'grep failed: {err}')
+        finally:
+            channel.close()
+
+    def search_sftp(self, client):
+        flags = re.IGNORECASE
+        if self.regex:
+            matcher = re.compile(self.pattern.encode(), flags)
+        else:
+            matcher = re.compile(re.escape(self.pattern.encode()), flags)
+        # matches crossing chunk border are found thanks to overlap of chunks
+        overlap = 1024 if self.regex else len(self.pattern.encode())
+
+        stack = [self.path]
+        while stack and not self.stopped():
+            dir_path = stack.pop()
+            try:
+                entries = client.listdir_attr(dir_path)
+            except IOError:
+                continue
+            for attrs in entries:
+                if self.stopped():
+                    return
+                _path = posix_path(dir_path, attrs.filename)
+                if stat.S_ISDIR(attrs.st_mode or 0):
+                    if attrs.filename != thumb_dir:
+                        stack.append(_path)
+                elif stat.S_ISREG(attrs.st_mode or 0) and attrs.st_size <= self.max_file_size:
+                    if self.file_matches(client, _path, matcher, overlap):
+                        self.add(_path, attrs)
+                self.flush_due()
+
+    def file_matches(self, client, _path, matcher, overlap):
+        try:
+            with client.open(_path, 'rb') as file:
+                tail = b''
+                while not self.stopped():
+                    chunk = file.read(self.chunk_size)
+                    if not chunk:
+                        return False
+                    data = tail + chunk
+                    if b'\0' in chunk:
+                        # binary file, grep -I skips them too
+                        return False
+                    if matcher.search(data):
+                        return True
+                    tail = data[-overlap:]
+        except IOError:
+            return False
+        return False
+
+    def found(self, client, _path):
+        if not _path:
+            return
+        try:
+            attrs = client.lstat(_path)
+        except IOError:
+            return
+        self.add(_path, attrs)
+
+    def add(self, _path, attrs):
+        attrs.filename = _path
+        attrs.longname = str(attrs)
+        self.batch.append(attrs)
+        self.count += 1
+
+    def flush_due(self):
+        if monotonic() - self.flushed > self.batch_interval:
+            self.flush()
+
+    def flush(self):
+        self.flushed = monotonic()
+        if self.batch:
+            self.deliver(self.on_results, self.batch)
+            self.batch = []
+
+    def deliver(self, callback, *values):
+        if not callback:
+            return
+
+        def call(_):
+            if not self.cancelled.is_set():
+                callback(*values)
+
+        Clock.schedule_once(call)
@@ -0,0 +1,179 @@
+from threading import Thread, Event, Lock, Condition
+from common import mk_logger
+from kivy.clock import Clock
+from time import monotonic
+
+logger = mk_logger(__name__)
+ex_log = mk_logger(name=f'{__name__}-EX',
+                   level=40,
+                   _format='[%(levelname)-8s] [%(asctime)s] [%(name)s] [%(funcName)s] [%(lineno)d] [%(message)s]')
+ex_log = ex_log.exception
+
+
+class NoConnection(Exception):
+    """Passed to on_done when no listing connection could be had"""
+
+
+class ListDir(Thread):
+    """
+    Lists remote directory with listdir_iter and passes entries in batches to on_batch(path, attrs_list)
+    on the main thread while they arrive. The first batch is small so the view shows something at once.
+    on_done(path, error, mtime) is called when the listing is complete, error is None on success
+    and mtime is modification time of the directory before it was listed.
+    The connection is taken from lister in this thread, as it may have to be opened.
+    After cancel() callbacks are not called anymore.
+    """
+    first_batch = 100
+    batch_size = 2000
+    batch_interval = .1
+    # cancelled listing is read to the end to keep the connection usable, unless it takes too long
+    drain_timeout = 2
+
+    def __init__(self, path, lister, on_batch, on_done=None):
+        super().__init__(daemon=True)
+        self.path = path
+        self.sftp = None
+        self.lister = lister
+        self.on_batch = on_batch
+        self.on_done = on_done
+        self.cancelled = Event()
+        self.cancel_time = None
+        self.count = 0
+
+    def cancel(self):
+        self.cancel_time = monotonic()
+        self.cancelled.set()
+
+    def run(self):
+        if self.cancelled.is_set():
+            return
+        self.sftp = self.lister.get_sftp()
+        if not self.sftp:
+            if self.on_done:
+                self.deliver(self.on_done, NoConnection(f'No connection to list {self.path}'), None)
+            return
+
+        batch = []
+        size = self.first_batch
+        flushed = monotonic()
+        error = None
+        mtime = None
+        reusable = True
+        try:
+            mtime = self.sftp.sftp_client.stat(self.path).st_mtime
+            for attrs in self.sftp.sftp_client.listdir_iter(self.path):
+                if self.cancelled.is_set():
+                    if monotonic() - self.cancel_time > self.drain_timeout:
+                        reusable = False
+                        break
+                    continue
+
+                batch.append(attrs)
+                if len(batch) >= size or monotonic() - flushed > self.batch_interval:
+                    self.deliver(self.on_batch, batch)
+                    batch = []
+                    size = self.batch_size
+                    flushed = monotonic()
+        except Exception as ex:
+            ex_log(f'Failed to list {self.path} {ex}')
+            error = ex
+            reusable = isinstance(ex, IOError) and self.sftp._transport.is_active()
+        finally:
+            self.lister.release(self.sftp, reusable)
+
+        if batch:
+            self.deliver(self.on_batch, batch)
+        if self.on_done:
+            self.deliver(self.on_done, error, mtime)
+        logger.info(f'Listed {self.count} files in {self.path}')
+
+    def deliver(self, callback, *values):
+        if callback is self.on_batch:
+            self.count += len(values[0])
+
+        def call(_):
+            if not self.cancelled.is_set():
+                callback(self.path, *values)
+
+        Clock.schedule_once(call)
+
+
+class DirLister:
+    """
+    Streams listings of remote directories on connections of its own,
+    so the connection used by the main thread is never shared with listing threads.
+    Starting a new listing cancels the previous one.
+    Idle connections can be borrowed for background work. When a listing needs a connection
+    and all are borrowed, it waits up to yield_timeout for one before opening a new one.
+    """
+    yield_timeout = .3
+
+    def __init__(self, connect):
+        self.connect = connect
+        self.idle = []
+        self.borrowed = set()
+        self.lock = Lock()
+        self.released = Condition(self.lock)
+        self.current = None
+
+    def get_sftp(self):
+        while True:
+            with self.lock:
+                if not self.idle and self.borrowed:
+                    self.released.wait(self.yield_timeout)
+                if not self.idle:
+                    break
+                sftp = self.idle.pop()
+            if sftp._transport.is_active():
+                return sftp
+            self.release(sftp, reusable=False)
+        return self.connect()
+
+    def borrow(self):
+        """Returns idle connection or None, it never opens a new one"""
+        with self.lock:
+            while self.idle:
+                sftp = self.idle.pop()
+                if sftp._transport.is_active():
+                    self.borrowed.add(sftp)
+                    return sftp
+                self.close_sftp(sftp)
+        return None
+
+    def release(self, sftp, reusable=True):
+        with self.lock:
+            self.borrowed.discard(sftp)
+            if reusable:
+                self.idle.append(sftp)
+            self.released.notify_all()
+        if not reusable:
+            self.close_sftp(sftp)
+
+    @staticmethod
+    def close_sftp(sftp):
+        # noinspection PyBroadException
+        try:
+            sftp.close()
+        except Exception:
+            pass
+
+    def list(self, path, on_batch, on_done=None):
+        """
+        Starts streaming listing of path. When no connection could be made
+        on_done gets NoConnection error, the caller should list the directory itself then.
+        """
+        self.cancel()
+        self.current = ListDir(path, self, on_batch, on_done)
+        self.current.start()
+
+    def cancel(self):
+        if self.current:
+            self.current.cancel()
+            self.current = None
+
+    def close(self):
+        self.cancel()
+        with self.lock:
+            idle, self.idle = self.idle, []
+        for sftp in idle:
+            self.close_sftp(sftp)
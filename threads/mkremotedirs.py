@@ -1,5 +1,5 @@
 from threading import Thread
-from common import posix_path, confirm_popup,  mk_logger,  get_dir_attrs
+from common import posix_path, confirm_popup,  mk_logger,  get_dir_attrs, remote_mtime
 from threads.upload import Upload
 
 
@@ -40,8 +40,9 @@ class MkRemoteDirs(Thread):
                     ex_log(f'Failed to delete file {ex}')
                 else:
                     logger.info(f'File deleted - {path}')
+                    mtime = remote_mtime(self.dst_path, self.sftp)
                     self.manager.sftp_queue.put(self.sftp)
-                    self.manager.uploaded(self.dst_path, attrs)
+                    self.manager.uploaded(self.dst_path, attrs, mtime)
                     self.manager.directory_created(path, Upload)
 
         popup.dismiss()
@@ -67,7 +68,7 @@ class MkRemoteDirs(Thread):
                 logger.info(f'Created directory - {_dir}')
                 self.done = True
                 if self.manager.is_current_path(self.dst_path):
-                    self.manager.uploaded(self.dst_path, attrs)
+                    self.manager.uploaded(self.dst_path, attrs, remote_mtime(self.dst_path, self.sftp))
 
         else:
             self.manager.sftp_queue.put(self.sftp)
@@ -3,6 +3,7 @@ import os
 from threads.download import Download
 from kivy.clock import Clock
 from common import mk_logger, thumbnails, progress_popup
+from managers.cachemanager import cache_manager
 
 logger = mk_logger(__name__)
 ex_log = mk_logger(name=f'{__name__}-EX',
@@ -64,6 +65,8 @@ class Open(Thread):
         self.manager.sftp_queue.put(self.sftp)
         self.manager.thread_queue.put('.')
         self.get_mtime()
+        # file is watched for changes as long as the app runs, the cache keeps it until then
+        cache_manager.pin(self.dst_path)
         self.check_event = Clock.schedule_interval(self.is_modified, 1)
         self.file = os.system('"{}"'.format(self.dst_path))
 
@@ -100,6 +103,8 @@ class Open(Thread):
         self.popup, self.bar_popup = progress_popup()
         self.bar_popup.set_values(f'Uploading {self.file_name} to {os.path.split(self.dst_path)[1]}')
         self.manager.put_transfer(transfer, bar=self.bar)
+        # edited file gets a new thumbnail like any uploaded one
+        self.manager.make_thumbnail(transfer)
         self.manager.run()
 
     def on_upload_progress(self, progress):
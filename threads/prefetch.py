@@ -0,0 +1,126 @@
+from threading import Thread, Event, Lock
+from collections import deque
+from common import mk_logger, posix_path
+from sftp.pipeline import RequestPipeline
+from contextlib import closing
+
+logger = mk_logger(__name__)
+ex_log = mk_logger(name=f'{__name__}-EX',
+                   level=40,
+                   _format='[%(levelname)-8s] [%(asctime)s] [%(name)s] [%(funcName)s] [%(lineno)d] [%(message)s]')
+ex_log = ex_log.exception
+
+
+class Prefetch(Thread):
+    """
+    Lists directories of prefetcher's queue into listing cache on a connection borrowed from DirLister.
+    It stops when cancelled, when the budget is spent or when there is no idle connection.
+    """
+    def __init__(self, prefetcher, sftp):
+        super().__init__(daemon=True)
+        self.prefetcher = prefetcher
+        self.sftp = sftp
+        self.cancelled = Event()
+        self.requests = 0
+        self.entries = 0
+
+    def cancel(self):
+        self.cancelled.set()
+
+    def run(self):
+        prefetcher = self.prefetcher
+        reusable = True
+        try:
+            while not self.cancelled.is_set() \
+                    and self.requests < prefetcher.max_requests \
+                    and self.entries < prefetcher.max_entries:
+                path = prefetcher.next_path()
+                if not path:
+                    break
+                self.prefetch(path)
+        except Exception as ex:
+            ex_log(f'Prefetch failed {ex}')
+            reusable = isinstance(ex, IOError) and self.sftp._transport.is_active()
+        finally:
+            prefetcher.lister.release(self.sftp, reusable)
+            logger.info(f'Prefetched {self.requests} directories, {self.entries} files')
+
+    def prefetch(self, path):
+        client = self.sftp.sftp_client
+        self.requests += 1
+        try:
+            mtime = client.stat(path).st_mtime
+        except IOError:
+            return
+
+        attrs_list = []
+        # reading stops between batches when cancelled, so a foreground listing gets the connection soon
+        with closing(RequestPipeline(self.sftp).listdir_batches(path)) as batches:
+            for entries in batches:
+                if self.cancelled.is_set():
+                    return
+                attrs_list.extend(entries)
+
+        self.entries += len(attrs_list)
+        if len(attrs_list) <= self.prefetcher.max_listing:
+            self.prefetcher.cache.put(path, mtime, attrs_list)
+
+
+class Prefetcher:
+    """
+    Speculatively lists subdirectories of current directory so opening them is instant.
+    The directory under the cursor is listed first. It runs only on idle connections of DirLister
+    and must be cancelled before any foreground listing, so it never delays the user.
+    max_requests and max_entries limit work done for one directory, bigger listings than max_listing
+    are not kept.
+    """
+    def __init__(self, lister, cache, max_requests=64, max_entries=100000, max_listing=20000):
+        self.lister = lister
+        self.cache = cache
+        self.max_requests = max_requests
+        self.max_entries = max_entries
+        self.max_listing = max_listing
+        self.paths = deque()
+        self.lock = Lock()
+        self.current = None
+
+    def start(self, path, dirs):
+        """Prefetches listings of dirs, names of subdirectories of path"""
+        self.cancel()
+        with self.lock:
+            self.paths = deque(_path for _path in (posix_path(path, name) for name in dirs)
+                               if _path not in self.cache)
+        self.resume()
+
+    def resume(self):
+        if not self.paths or (self.current and self.current.is_alive() and not self.current.cancelled.is_set()):
+            return
+        sftp = self.lister.borrow()
+        if not sftp:
+            return
+        self.current = Prefetch(self, sftp)
+        self.current.start()
+
+    def first(self, path):
+        """Moves path to the front of the queue, e.g. when cursor points its directory"""
+        with self.lock:
+            try:
+                self.paths.remove(path)
+            except ValueError:
+                return
+            self.paths.appendleft(path)
+
+    def next_path(self):
+        with self.lock:
+            while self.paths:
+                path = self.paths.popleft()
+                if path not in self.cache:
+                    return path
+        return None
+
+    def cancel(self):
+        with self.lock:
+            self.paths.clear()
+        if self.current:
+            self.current.cancel()
+            self.current = None
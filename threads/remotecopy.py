@@ -0,0 +1,271 @@
+from threading import Thread
+from common import posix_path, mk_logger, get_dir_attrs, remote_mtime, thumb_levels, thumb_level_dir
+from sftp.pipeline import RequestPipeline, SFTP_OK, SFTP_OP_UNSUPPORTED
+from sftp.remoteexec import exec_command, quote_paths, ExecUnavailable
+from sftp.capabilities import supports, set_support
+from sftp.thumbbundle import ThumbBundle
+import posixpath
+import stat
+
+logger = mk_logger(__name__)
+ex_log = mk_logger(name=f'{__name__}-EX',
+                   level=40,
+                   _format='[%(levelname)-8s] [%(asctime)s] [%(name)s] [%(funcName)s] [%(lineno)d] [%(message)s]')
+ex_log = ex_log.exception
+
+# cp gets this long plus a second for each cp_speed bytes, then the copy fails
+cp_timeout = 300
+cp_speed = 10 * 1024 * 1024
+
+
+class RemoteCopy(Thread):
+    """
+    Copies remote file or directory to another remote directory without downloading it.
+
+    Each file is copied with the "copy-data" sftp extension when the server supports it.
+    Otherwise 'cp --reflink=auto' is run over exec channel. Only when both are not available
+    the data is streamed through this client.
+    """
+    chunk_size = 262144
+
+    def __init__(self, data, manager, bar, sftp):
+        super().__init__()
+        self.data = data
+        self.src_path = data['src_path']
+        self.dst_dir = data['dst_path']
+        self.is_dir = data['dir']
+        self.file_name = posixpath.split(self.src_path)[1]
+        self.dst_path = None
+        self.manager = manager
+        self.bar = bar
+        self.sftp = sftp
+        self.done = False
+        self.copied = 0
+        self.total = 0
+        # thumbnail is copied after the file, its bytes are not shown on the bar
+        self.copying_thumbnail = False
+        self.thumb_copied = 0
+        # (path, attrs) of walked directories
+        self.dirs = []
+
+    def run(self):
+        self.bar.my_thread = self
+        try:
+            self.dst_path = posix_path(self.dst_dir, self.free_name())
+            self.bar.set_values(f'Copying {self.src_path} to {self.dst_path}')
+            if self.is_dir:
+                self.copy_dir()
+            else:
+                self.copy_file(self.src_path, self.dst_path)
+                self.copy_thumbnail()
+            attrs = get_dir_attrs(self.dst_path, self.sftp)
+        except Exception as ex:
+            ex_log(f'Failed to copy {self.src_path} {ex}')
+            self.bar.set_values(f'Failed to copy {self.file_name}: {ex}')
+        else:
+            logger.info(f'Copied {self.src_path} to {self.dst_path}')
+            self.done = True
+            self.bar.update(1, 1)
+            self.manager.uploaded(self.dst_dir, attrs, remote_mtime(self.dst_dir, self.sftp))
+            self.bar.done()
+        finally:
+            self.manager.sftp_queue.put(self.sftp)
+            self.manager.thread_queue.put('.')
+
+    def free_name(self):
+        """Name in destination directory. Adds ' - Copy' if the name is taken, e.g. when duplicating."""
+        if not self.sftp.exists(posix_path(self.dst_dir, self.file_name)):
+            return self.file_name
+
+        base, ext = (self.file_name, '') if self.is_dir else posixpath.splitext(self.file_name)
+        name = f'{base} - Copy{ext}'
+        i = 2
+        while self.sftp.exists(posix_path(self.dst_dir, name)):
+            name = f'{base} - Copy ({i}){ext}'
+            i += 1
+        return name
+
+    def copy_dir(self):
+        files = None
+        if supports(self.sftp, 'copy-data') is not False:
+            files = self.walk()
+            self.total = sum(attrs.st_size for _, attrs in files)
+            for i, (_path, attrs) in enumerate(files):
+                if not self.copy_file_data(_path, attrs):
+                    files = files[i:]
+                    break
+            else:
+                self.keep_dir_attrs()
+                return
+
+        # 'src/.' copies the content so it works also when walk already made the destination directory
+        if self.cp(f'{self.src_path}/.', self.dst_path, self.total - self.copied):
+            return
+
+        if files is None:
+            files = self.walk()
+            self.total = sum(attrs.st_size for _, attrs in files)
+        for _path, attrs in files:
+            self.stream(_path, self.destination(_path), attrs)
+        self.keep_dir_attrs()
+
+    def walk(self):
+        """Makes directories in destination and returns list of (path, attrs) of files to copy"""
+        files = []
+        self.dirs = []
+        dirs = [(self.src_path, self.sftp.stat(self.src_path))]
+        while dirs:
+            src_dir, attrs = dirs.pop()
+            self.dirs.append((src_dir, attrs))
+            self.sftp.mkdir(self.destination(src_dir))
+            for f in self.sftp.sftp_client.listdir_iter(src_dir):
+                _path = posix_path(src_dir, f.filename)
+                if stat.S_ISDIR(f.st_mode):
+                    dirs.append((_path, f))
+                else:
+                    files.append((_path, f))
+        return files
+
+    def keep_dir_attrs(self):
+        """
+        Gives copied directories modes and times of their sources, as 'cp -a' does.
+        It is done after files are copied so read-only directories can be filled and their times stay.
+        """
+        for src_dir, attrs in reversed(self.dirs):
+            dst_dir = self.destination(src_dir)
+            self.sftp.chmod(dst_dir, stat.S_IMODE(attrs.st_mode))
+            self.sftp.sftp_client.utime(dst_dir, (attrs.st_atime, attrs.st_mtime))
+
+    def destination(self, src):
+        return posix_path(self.dst_path, posixpath.relpath(src, self.src_path))
+
+    def copy_file(self, src, dst):
+        attrs = self.sftp.stat(src)
+        if not self.copying_thumbnail:
+            self.total = attrs.st_size
+        if self.copy_data(src, dst, attrs):
+            return
+        if self.cp(src, dst, attrs.st_size):
+            return
+        self.stream(src, dst, attrs)
+
+    def copy_file_data(self, src, attrs):
+        """copy_data for a file of a walked tree"""
+        if self.copy_data(src, self.destination(src), attrs):
+            self.progress(attrs.st_size)
+            return True
+        return False
+
+    def copy_data(self, src, dst, attrs):
+        if supports(self.sftp, 'copy-data') is False:
+            return False
+
+        result = []
+        with self.sftp.open(src, 'rb') as fsrc, self.sftp.open(dst, 'wb') as fdst:
+            pipeline = RequestPipeline(self.sftp, max_in_flight=1)
+            pipeline.copy_data(fsrc.handle, fdst.handle, lambda code, text: result.extend([code, text]))
+            pipeline.drain()
+
+        code, text = result
+        if code == SFTP_OP_UNSUPPORTED:
+            logger.info('Server does not support copy-data extension')
+            set_support(self.sftp, 'copy-data', False)
+            self.sftp.remove(dst)
+            return False
+        if code != SFTP_OK:
+            raise IOError(text)
+
+        set_support(self.sftp, 'copy-data', True)
+        self.sftp.chmod(dst, stat.S_IMODE(attrs.st_mode))
+        self.sftp.sftp_client.utime(dst, (attrs.st_atime, attrs.st_mtime))
+        return True
+
+    def cp(self, src, dst, size):
+        if supports(self.sftp, 'exec') is False:
+            return False
+
+        paths = quote_paths([src, dst])
+        for command in (f'cp -a --reflink=auto -- {paths}', f'cp -pR -- {paths}'):
+            try:
+                status, _, err = exec_command(self.sftp, command, timeout=cp_timeout + size / cp_speed)
+            except ExecUnavailable as eu:
+                logger.info(f'Exec not available, copying through client. {eu}')
+                set_support(self.sftp, 'exec', False)
+                return False
+
+            set_support(self.sftp, 'exec', True)
+            if status == -1:
+                # cp may still be writing, copying again would write the same files
+                raise IOError(f'Copying timed out: {command}')
+            if status == 0:
+                self.progress(size)
+                return True
+            logger.info(f'{command} exited with {status} {err}')
+        return False
+
+    def stream(self, src, dst, attrs):
+        logger.info(f'Streaming {src} through client')
+        with self.sftp.open(src, 'rb') as fsrc, self.sftp.open(dst, 'wb') as fdst:
+            fsrc.prefetch(attrs.st_size)
+            fdst.set_pipelined(True)
+            while True:
+                data = fsrc.read(self.chunk_size)
+                if not data:
+                    break
+                fdst.write(data)
+                self.progress(len(data))
+        self.sftp.chmod(dst, stat.S_IMODE(attrs.st_mode))
+
+    def progress(self, size):
+        if self.copying_thumbnail:
+            self.thumb_copied += size
+            return
+        self.copied += size
+        if self.total:
+            self.bar.update(min(self.copied, self.total), self.total)
+
+    def copy_thumbnail(self):
+        """
+        Copies thumbnails of all levels of a copied file, files or bundle entries.
+        Failing here does not fail the copy.
+        """
+        if not self.data.get('thumbnails'):
+            return
+        src_dir, name = posixpath.split(self.src_path)
+        thumbnail = f'{name}.jpg'
+        new_thumbnail = f'{posixpath.split(self.dst_path)[1]}.jpg'
+        for level in thumb_levels:
+            # noinspection PyBroadException
+            try:
+                self.copying_thumbnail = True
+                self.copy_level(src_dir, level, thumbnail, new_thumbnail)
+            except Exception as ex:
+                ex_log(f'Failed to copy {level} thumbnail of {self.file_name} {ex}')
+            finally:
+                self.copying_thumbnail = False
+
+    def copy_level(self, src_dir, level, thumbnail, new_thumbnail):
+        src = posix_path(thumb_level_dir(src_dir, level), thumbnail)
+        if self.sftp.exists(src):
+            dst_dir = thumb_level_dir(self.dst_dir, level)
+            if not self.sftp.exists(dst_dir):
+                self.sftp.makedirs(dst_dir)
+            self.copy_file(src, posix_path(dst_dir, new_thumbnail))
+            return
+
+        client = self.sftp.sftp_client
+        try:
+            entries = ThumbBundle(client, src_dir, level).read_index()
+        except IOError:
+            # directory has no bundle
+            return
+        if thumbnail not in entries:
+            return
+        for _, data in ThumbBundle(client, src_dir, level).read(entries, [thumbnail]):
+            ThumbBundle(client, self.dst_dir, level).append(new_thumbnail, data, entries[thumbnail][2])
+
+    def overwrite(self):
+        pass
+
+    def skip(self):
+        self.done = True
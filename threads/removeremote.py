@@ -1,7 +1,13 @@
-from threading import Thread
-from common import posix_path, mk_logger, forbidden_names
-from infolabel import InfoLabel
+from threading import Thread, Lock
+from common import posix_path, mk_logger, thumb_levels, remote_mtime
+from sftp.pipeline import RequestPipeline, SFTP_OK, SFTP_NO_SUCH_FILE
+from sftp.remoteexec import exec_command, quote_paths, ExecUnavailable
+from sftp.thumbbundle import ThumbBundle
+from kivy.clock import Clock
 from os import path
+from functools import partial
+import posixpath
+import queue
 import stat
 
 
@@ -11,64 +17,236 @@ ex_log = mk_logger(name=f'{__name__}-EX',
                    _format='[%(levelname)-8s] [%(asctime)s] [%(name)s] [%(funcName)s] [%(lineno)d] [%(message)s]')
 ex_log = ex_log.exception
 
+# rm -rf of a big tree takes long, after this the rest is removed over sftp
+rm_timeout = 300
 
-class RemoveRemoteDirectory(Thread):
+
+class RemoveRemote(Thread):
+    """
+    Removes files and directory trees given in data['paths'] as list of (path, is_dir).
+
+    Trees are walked by one worker per connection. Files and then directories (deepest first)
+    are removed with many requests in flight on each connection. Besides the connection
+    given by manager, idle connections from manager's pool are borrowed for the time of removing.
+    With data['fast_remove'] whole selection is removed with single 'rm -rf' if server allows exec.
+    """
     def __init__(self, manager, sftp, data):
         super().__init__()
-        self.remote_path = data['remote_path']
+        self.paths = data['paths']
         self.sftp = sftp
-        self.on_remove = data['on_remove']
+        self.on_removed = data.get('on_removed')
         self.progress_box = data['progress_box']
+        self.fast_remove = data.get('fast_remove')
+        self.max_connections = data.get('max_connections', 4)
         self.manager = manager
+        self.connections = [sftp]
+        self.files = []
+        self.dirs = []
+        self.failed_paths = set()
+        # paths confirmed removed by the server
+        self.done = set()
+        self.errors = []
+        self.removed = 0
+        self.lock = Lock()
+        self.info = self.progress_box.mk_info(f'Removing {self.label()}')
+        self.progress_box.add_bar(self.info)
 
     def run(self):
-        self.rmdir(self.remote_path)
+        try:
+            if not (self.fast_remove and self.remove_with_exec()):
+                self.borrow_connections()
+                self.walk()
+                self.remove_files()
+                self.remove_dirs()
+        except Exception as ex:
+            ex_log(f'Failed to remove {self.label()} {ex}')
+            self.errors.append(str(ex))
+        else:
+            self.remove_thumbnails()
+        finally:
+            mtimes = self.dir_mtimes()
+            for sftp in self.connections:
+                self.manager.sftp_queue.put(sftp)
+            self.manager.thread_queue.put('.')
+            self.finish(mtimes)
+
+    def label(self):
+        if len(self.paths) == 1:
+            return path.split(self.paths[0][0])[1]
+        return f'{len(self.paths)} items'
 
-    def rmdir(self, _path):
+    def total(self):
+        return len(self.files) + len(self.dirs)
 
+    def remove_with_exec(self):
+        for _path, _ in self.paths:
+            if _path.rstrip('/') in ('', '.', '..'):
+                return False
+
+        command = f'rm -rf -- {quote_paths(_path for _path, _ in self.paths)}'
         try:
-            for f in self.sftp.listdir_attr(_path):
-                rpath = posix_path(_path, f.filename)
-                if stat.S_ISDIR(f.st_mode):
-                    self.rmdir(rpath)
-                else:
+            status, _, err = exec_command(self.sftp, command, timeout=rm_timeout)
+        except ExecUnavailable as eu:
+            logger.info(f'Exec not available, removing over sftp. {eu}')
+            return False
+
+        # on timeout rm may still be running, sftp removes what is left and skips what is gone
+        if status != 0:
+            logger.info(f'rm -rf exited with {status} {err}, removing over sftp')
+            return False
+
+        self.files = [_path for _path, is_dir in self.paths if not is_dir]
+        self.dirs = [(0, _path) for _path, is_dir in self.paths if is_dir]
+        self.removed = len(self.paths)
+        self.report()
+        logger.info(f'Removed {self.label()} with rm -rf')
+        return True
+
+    def remove_thumbnails(self):
+        """Drops thumbnails of removed paths from thumbnails bundles of their directories"""
+        dirs = {}
+        for _path in self.removed_paths():
+            directory, name = posixpath.split(_path.rstrip('/'))
+            dirs.setdefault(directory, []).append(f'{name}.jpg')
+        for directory, thumbnails in dirs.items():
+            for level in thumb_levels:
+                try:
+                    ThumbBundle(self.sftp.sftp_client, directory, level).remove_many(thumbnails)
+                except IOError:
+                    # directory has no bundle
+                    pass
+
+    def borrow_connections(self):
+        while len(self.connections) < self.max_connections:
+            sftp = self.manager.idle_sftp()
+            if not sftp:
+                break
+            self.connections.append(sftp)
+
+    def walk(self):
+        pending = queue.Queue()
+        for _path, is_dir in self.paths:
+            if is_dir:
+                self.dirs.append((0, _path))
+                pending.put((_path, 0))
+            else:
+                self.files.append(_path)
+
+        workers = [Thread(target=self.walk_worker, args=(sftp, pending)) for sftp in self.connections]
+        for worker in workers:
+            worker.start()
+        pending.join()
+        for _ in workers:
+            pending.put(None)
+        for worker in workers:
+            worker.join()
+
+    def walk_worker(self, sftp, pending):
+        while True:
+            item = pending.get()
+            if item is None:
+                pending.task_done()
+                break
+            _path, depth = item
+            try:
+                for f in sftp.sftp_client.listdir_iter(_path):
                     rpath = posix_path(_path, f.filename)
-                    self.sftp.remove(rpath)
-                    # avoid to inform about files from directories like .thumbnails
-                    for name in forbidden_names:
-                        if name in _path:
-                            break
+                    if stat.S_ISDIR(f.st_mode):
+                        with self.lock:
+                            self.dirs.append((depth + 1, rpath))
+                        pending.put((rpath, depth + 1))
                     else:
-                        self.info(f.filename)
+                        self.files.append(rpath)
+            except FileNotFoundError:
+                # removed meanwhile, e.g. by rm -rf which timed out
+                pass
+            except Exception as ex:
+                self.failed(_path, ex)
+            finally:
+                pending.task_done()
 
-        except Exception as ex:
-            ex_log(f'Failed to remove directory {ex}')
-            self.error(ex)
-            return
+    def in_parallel(self, target, paths):
+        """
+        Splits paths between connections and runs target(sftp, paths) for each part.
+        When target fails, paths of its part not confirmed removed are failed.
+        """
+        def run(sftp, part):
+            try:
+                target(sftp, part)
+            except Exception as ex:
+                ex_log(f'Failed to remove {len(part)} paths {ex}')
+                for _path in part:
+                    if _path not in self.done:
+                        self.failed(_path, ex)
 
-        try:
-            self.sftp.rmdir(_path)
-        except Exception as ex:
-            ex_log(f'Failed to remove directory {ex}')
-            self.error(ex)
+        n = len(self.connections)
+        workers = [Thread(target=run, args=(sftp, paths[i::n])) for i, sftp in enumerate(self.connections)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+
+    def remove_files(self):
+        def worker(sftp, paths):
+            pipeline = RequestPipeline(sftp)
+            for _path in paths:
+                pipeline.remove(_path, self.response)
+            pipeline.drain()
+
+        self.in_parallel(worker, self.files)
+
+    def remove_dirs(self):
+        def worker(sftp, paths):
+            pipeline = RequestPipeline(sftp)
+            for _path in paths:
+                pipeline.rmdir(_path, self.response)
+            pipeline.drain()
+
+        # directory can be removed only when it is empty so remove level by level from the deepest one
+        levels = {}
+        for depth, _path in self.dirs:
+            levels.setdefault(depth, []).append(_path)
+        for depth in sorted(levels, reverse=True):
+            self.in_parallel(worker, levels[depth])
+
+    def response(self, _path, code, text):
+        if code in (SFTP_OK, SFTP_NO_SUCH_FILE):
+            with self.lock:
+                self.removed += 1
+                self.done.add(_path)
+            self.report()
         else:
-            self.info(path.split(_path)[1])
-            if _path == self.remote_path:
-                self.on_remove()
-
-
-    def forbidden(self, filename):
-        if filename in forbidden_names:
-            return True
-        return False
-
-    def error(self, ex):
-        filename = path.split(self.remote_path)[1]
-        if not self.forbidden(filename):
-            error = InfoLabel(text=f'Failed to remove  {filename}: {type(ex)}')
-            self.progress_box.add_bar(error)
-
-    def info(self, filename):
-        if not self.forbidden(filename):
-            info = InfoLabel(text=f'Successfully removed {filename}')
-            self.progress_box.add_bar(info)
+            self.failed(_path, text)
+
+    def failed(self, _path, error):
+        logger.info(f'Failed to remove {_path} {error}')
+        with self.lock:
+            self.failed_paths.add(_path)
+            self.errors.append(f'{path.split(_path)[1]}: {error}')
+
+    def dir_mtimes(self):
+        """{directory: mtime} of directories of removed paths, for listings cached before removing"""
+        directories = {posixpath.dirname(_path.rstrip('/')) for _path in self.removed_paths()}
+        return {directory: remote_mtime(directory, self.sftp) for directory in directories}
+
+    def removed_paths(self):
+        """Selected paths removed with all their content"""
+        removed = []
+        for _path, _ in self.paths:
+            prefix = _path.rstrip('/') + '/'
+            if _path in self.failed_paths or any(failed.startswith(prefix) for failed in self.failed_paths):
+                continue
+            removed.append(_path)
+        return removed
+
+    def report(self):
+        self.info.set_values(f'Removing {self.label()}: {self.removed}/{self.total()} removed')
+
+    def finish(self, mtimes):
+        if self.errors:
+            self.info.set_values(f'Failed to remove {len(self.errors)} of {self.label()}: {self.errors[0]}')
+        else:
+            self.info.set_values(f'Successfully removed {self.label()}')
+
+        if self.on_removed:
+            Clock.schedule_once(partial(self.on_removed, self.removed_paths(), mtimes))
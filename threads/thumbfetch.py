@@ -0,0 +1,323 @@
+from threading import Thread, Lock, Condition
+from collections import OrderedDict
+from common import mk_logger, posix_path, pure_windows_path, publish_thumbnails, thumbnail_bundles
+from common import thumb_level_dir, thumb_sizes, base_level
+from managers.thumbindex import thumb_index
+from sftp.thumbbundle import ThumbBundle, is_bundle_file, index_name
+from sftp.remotethumb import remote_thumbnail, can_have_thumbnail
+from processes import thumbengine
+import stat
+import os
+
+logger = mk_logger(__name__)
+ex_log = mk_logger(name=f'{__name__}-EX',
+                   level=40,
+                   _format='[%(levelname)-8s] [%(asctime)s] [%(name)s] [%(funcName)s] [%(lineno)d] [%(message)s]')
+ex_log = ex_log.exception
+
+
+class FetchWorker(Thread):
+    """Takes jobs of ThumbFetcher on a connection of its own, the connection is kept for next directories"""
+    def __init__(self, fetcher):
+        super().__init__(daemon=True)
+        self.fetcher = fetcher
+        self.sftp = None
+
+    def run(self):
+        while True:
+            job = self.fetcher.next_job()
+            if not self.sftp or not self.sftp._transport.is_active():
+                self.sftp = self.fetcher.connect()
+                if not self.sftp:
+                    self.fetcher.job_failed(job)
+                    return
+            try:
+                job(self.sftp)
+            except Exception as ex:
+                ex_log(f'Thumbnail fetch failed {ex}')
+
+
+class ThumbFetcher:
+    """
+    Downloads thumbnails of a remote directory in background while the directory is already shown.
+    Thumbnails directory is listed once and only thumbnails other than the cached ones are fetched,
+    thumbnails of visible files first, by a few workers in parallel, each on its own connection.
+    Thumbnails packed in a bundle are fetched in batches, each batch with one ranged read of the pack.
+    Visible files with no thumbnail on the server get one made from their embedded preview
+    (see sftp.remotethumb), after all stored thumbnails are fetched. Made thumbnails are uploaded
+    to the server if publishing is enabled in settings.
+    Only the level of thumbnails shown by icons is fetched. Thumbnails the server has only
+    at the base level are fetched at it and scaled down to the level here.
+    on_fetched(path, thumbnail) is called in a worker thread after each download.
+    fetch() of another directory drops what was not fetched yet.
+    """
+    def __init__(self, connect, on_fetched, workers=3):
+        self.connect = connect
+        self.on_fetched = on_fetched
+        self.max_workers = workers
+        self.workers = []
+        self.lock = Lock()
+        self.ready = Condition(self.lock)
+        self.path = None
+        self.generation = 0
+        self.to_list = None
+        self.level = base_level
+        # thumbnail name: (remote mtime, bundle entry or None, level on server), the first ones are fetched first
+        self.pending = OrderedDict()
+        # level: bundle entries
+        self.bundle_entries = {}
+        self.batch = 64
+        # thumbnails stored on the server, None until listed
+        self.listed = None
+        # names of visible files to make thumbnails of, files tried in current directory
+        self.to_make = OrderedDict()
+        self.tried = set()
+        self.publish = False
+        self.bundle = False
+        self.visible = []
+
+    def fetch(self, path, level=base_level):
+        with self.lock:
+            self.generation += 1
+            self.path = path
+            self.level = level
+            self.to_list = path
+            self.pending.clear()
+            self.bundle_entries = {}
+            self.listed = None
+            self.to_make.clear()
+            self.tried.clear()
+            self.visible = []
+            self.publish = publish_thumbnails()
+            self.bundle = thumbnail_bundles()
+            self.ready.notify()
+        if not self.workers:
+            self.add_worker()
+
+    def cancel(self):
+        with self.lock:
+            self.generation += 1
+            self.to_list = None
+            self.pending.clear()
+            self.to_make.clear()
+
+    def prioritize(self, path, names):
+        """names of files which icons are visible, their thumbnails go first"""
+        thumbnails = [f'{name}.jpg' for name in names]
+        with self.lock:
+            if path != self.path:
+                return
+            self.visible = thumbnails
+            for thumbnail in reversed(thumbnails):
+                if thumbnail in self.pending:
+                    self.pending.move_to_end(thumbnail, last=False)
+            self.queue_making()
+
+    def add_worker(self):
+        worker = FetchWorker(self)
+        self.workers.append(worker)
+        worker.start()
+
+    def next_job(self):
+        with self.lock:
+            while True:
+                if self.to_list:
+                    path, self.to_list = self.to_list, None
+                    generation, level = self.generation, self.level
+                    return lambda sftp: self.list_thumbnails(sftp, generation, path, level)
+                if self.pending:
+                    thumbnail, (mtime, entry, source) = self.pending.popitem(last=False)
+                    generation, path, level = self.generation, self.path, self.level
+                    if entry:
+                        # next bundled thumbnails of the same level are read together
+                        batch = {thumbnail: mtime}
+                        for other, (other_mtime, other_entry, other_source) in list(self.pending.items()):
+                            if len(batch) >= self.batch:
+                                break
+                            if other_entry and other_source == source:
+                                batch[other] = other_mtime
+                                del self.pending[other]
+                        entries = self.bundle_entries[source]
+                        return lambda sftp: self.get_bundled(sftp, generation, path, level, source, entries, batch)
+                    return lambda sftp: self.get_thumbnail(sftp, generation, path, level, source, thumbnail, mtime)
+                if self.to_make:
+                    name, _ = self.to_make.popitem(last=False)
+                    generation, path, level = self.generation, self.path, self.level
+                    return lambda sftp: self.make_thumbnail(sftp, generation, path, level, name)
+                self.ready.wait()
+
+    def queue_making(self):
+        """Queues visible files which have no thumbnail on the server, called with lock held"""
+        if self.listed is None:
+            return
+        self.to_make.clear()
+        for thumbnail in self.visible:
+            name = thumbnail[:-len('.jpg')]
+            if thumbnail not in self.listed and name not in self.tried and can_have_thumbnail(name):
+                self.to_make[name] = None
+        if self.to_make:
+            self.ready.notify()
+
+    def job_failed(self, _):
+        """Worker could not connect, it ends and the job is dropped"""
+        logger.info('Thumbnail fetcher could not connect')
+        with self.lock:
+            self.workers = [worker for worker in self.workers if worker.is_alive() and worker.sftp]
+
+    @staticmethod
+    def list_level(client, path, level):
+        """Returns {thumbnail: (mtime, bundle entry or None, level)} of thumbnails of level on server"""
+        try:
+            remote_attrs = client.listdir_attr(thumb_level_dir(path, level))
+        except IOError:
+            return {}, None
+
+        # newest of thumbnail file and bundle entry wins
+        remote = {attrs.filename: (attrs.st_mtime, None, level) for attrs in remote_attrs
+                  if not is_bundle_file(attrs.filename) and not attrs.filename.endswith('.tmp')
+                  and not stat.S_ISDIR(attrs.st_mode or 0)}
+        entries = None
+        if index_name in {attrs.filename for attrs in remote_attrs}:
+            try:
+                entries = ThumbBundle(client, path, level).read_index()
+            except IOError as ie:
+                logger.info(f'Thumbnails bundle of {path} not read {ie}')
+            else:
+                for thumbnail, entry in entries.items():
+                    if thumbnail not in remote or remote[thumbnail][0] < entry[2]:
+                        remote[thumbnail] = (entry[2], entry, level)
+        return remote, entries
+
+    def list_thumbnails(self, sftp, generation, path, level):
+        client = sftp.sftp_client
+        remote, entries = self.list_level(client, path, level)
+        bundle_entries = {level: entries}
+        if level != base_level:
+            # thumbnails of the level go before the base ones unless the base one is newer,
+            # e.g. replaced by a client which does not make levels
+            base, bundle_entries[base_level] = self.list_level(client, path, base_level)
+            remote = {**base, **{thumbnail: value for thumbnail, value in remote.items()
+                                 if thumbnail not in base or value[0] >= base[thumbnail][0]}}
+
+        local = thumb_index.mtimes(path, level)
+        needed = [(thumbnail, value) for thumbnail, value in remote.items() if local.get(thumbnail) != value[0]]
+
+        with self.lock:
+            if generation != self.generation:
+                return
+            self.listed = set(remote)
+            self.queue_making()
+            if not needed:
+                return
+            self.bundle_entries = bundle_entries
+            self.pending.update(needed)
+            for thumbnail in reversed(self.visible):
+                if thumbnail in self.pending:
+                    self.pending.move_to_end(thumbnail, last=False)
+            self.ready.notify_all()
+            missing = min(self.max_workers, len(self.pending)) - len(self.workers)
+
+        for _ in range(missing):
+            self.add_worker()
+        logger.info(f'Fetching {len(needed)} thumbnails of {path}')
+
+    @staticmethod
+    def store(path, level, thumbnail, data, mtime):
+        """Writes thumbnail of level to the cache, with mtime of the remote one"""
+        local_dir = thumb_index.local_dir(path, level)
+        os.makedirs(local_dir, exist_ok=True)
+        local_path = pure_windows_path(local_dir, thumbnail)
+        tmp_path = f'{local_path}.part'
+        with open(tmp_path, 'wb') as file:
+            file.write(data)
+        os.utime(tmp_path, (mtime, mtime))
+        os.replace(tmp_path, local_path)
+        thumb_index.add(path, thumbnail, level)
+
+    def deliver(self, path, level, source, thumbnail, data, mtime):
+        """Caches thumbnail fetched at level source, scaled down to level if needed"""
+        self.store(path, source, thumbnail, data, mtime)
+        if source != level:
+            scaled = thumbengine.scale(data, {level: thumb_sizes[level]})
+            self.store(path, level, thumbnail, scaled[level], mtime)
+        self.on_fetched(path, thumbnail)
+
+    def get_thumbnail(self, sftp, generation, path, level, source, thumbnail, mtime):
+        if generation != self.generation:
+            return
+        cached = thumb_index.get(path, thumbnail[:-len('.jpg')], source)
+        if source != level and cached and thumb_index.mtimes(path, source).get(thumbnail) == mtime:
+            # base thumbnail is cached already, only the level is made of it
+            with open(cached, 'rb') as file:
+                scaled = thumbengine.scale(file.read(), {level: thumb_sizes[level]})
+            self.store(path, level, thumbnail, scaled[level], mtime)
+            self.on_fetched(path, thumbnail)
+            return
+        try:
+            # no exists check, a missing thumbnail just fails
+            with sftp.sftp_client.open(posix_path(thumb_level_dir(path, source), thumbnail), 'rb') as file:
+                file.prefetch()
+                data = file.read()
+        except IOError as ie:
+            logger.info(f'Thumbnail {thumbnail} not fetched {ie}')
+            return
+        self.deliver(path, level, source, thumbnail, data, mtime)
+
+    def get_bundled(self, sftp, generation, path, level, source, entries, batch):
+        """batch is {thumbnail: mtime} of thumbnails in the bundle of level source of path"""
+        if generation != self.generation:
+            return
+        try:
+            for thumbnail, data in ThumbBundle(sftp.sftp_client, path, source).read(entries, batch):
+                if generation != self.generation:
+                    return
+                self.deliver(path, level, source, thumbnail, data, batch[thumbnail])
+        except IOError as ie:
+            logger.info(f'Thumbnails bundle of {path} not fetched {ie}')
+
+    def make_thumbnail(self, sftp, generation, path, level, name):
+        """Makes thumbnail of remote file name from its embedded preview or on the server"""
+        with self.lock:
+            if generation != self.generation:
+                return
+            self.tried.add(name)
+        remote_path = posix_path(path, name)
+        thumbnail = f'{name}.jpg'
+        try:
+            mtime = sftp.sftp_client.stat(remote_path).st_mtime
+            # cached thumbnail made before is up to date
+            cached = thumb_index.mtimes(path, level).get(thumbnail)
+            if cached and cached >= mtime:
+                return
+            data = remote_thumbnail(sftp, remote_path, thumb_sizes[base_level])
+        except IOError as ie:
+            logger.info(f'Thumbnail of {remote_path} not made {ie}')
+            return
+        if not data:
+            return
+
+        levels = thumbengine.scale(data, {other: size for other, size in thumb_sizes.items() if other != base_level})
+        levels[base_level] = data
+        for other, other_data in levels.items():
+            self.store(path, other, thumbnail, other_data, mtime)
+        self.on_fetched(path, thumbnail)
+        logger.info(f'Thumbnail of {remote_path} made from remote file')
+
+        if self.publish:
+            for other, other_data in levels.items():
+                self.publish_thumbnail(sftp.sftp_client, path, other, thumbnail, other_data, mtime)
+
+    def publish_thumbnail(self, client, path, level, thumbnail, data, mtime):
+        """Uploads thumbnail made from remote file so other clients do not have to make it"""
+        try:
+            bundle = ThumbBundle(client, path, level)
+            if self.bundle:
+                bundle.append(thumbnail, data, mtime)
+                return
+            bundle.makedirs()
+            remote_path = posix_path(bundle.dir, thumbnail)
+            with client.open(remote_path, 'wb') as file:
+                file.write(data)
+            client.utime(remote_path, (mtime, mtime))
+        except IOError as ie:
+            logger.info(f'Thumbnail {thumbnail} of {path} not published {ie}')
@@ -0,0 +1,61 @@
+from threading import Thread
+from common import posix_path, pure_windows_path, mk_logger, thumb_levels, thumb_level_dir
+from managers.thumbindex import thumb_index
+from sftp.thumbbundle import ThumbBundle
+import os
+
+
+logger = mk_logger(__name__)
+ex_log = mk_logger(name=f'{__name__}-EX',
+                   level=40,
+                   _format='[%(levelname)-8s] [%(asctime)s] [%(name)s] [%(funcName)s] [%(lineno)d] [%(message)s]')
+ex_log = ex_log.exception
+
+
+def upload_levels(sftp, dst_path, thumb_name, bundle=False):
+    """Uploads all levels of thumbnail thumb_name found in the local cache of dst_path"""
+    for level in thumb_levels:
+        local_path = pure_windows_path(thumb_index.local_dir(dst_path, level), thumb_name)
+        if not os.path.exists(local_path):
+            continue
+        if bundle:
+            with open(local_path, 'rb') as file:
+                data = file.read()
+            ThumbBundle(sftp.sftp_client, dst_path, level).append(thumb_name, data, os.stat(local_path).st_mtime)
+        else:
+            remote_dir = thumb_level_dir(dst_path, level)
+            if not sftp.exists(remote_dir):
+                sftp.makedirs(remote_dir)
+            sftp.put(localpath=local_path,
+                     remotepath=posix_path(remote_dir, thumb_name),
+                     preserve_mtime=True)
+
+
+class ThumbUpload(Thread):
+    """
+    Uploads thumbnail made by ThumbnailPool, all its levels, to thumbnails directories of dst_path,
+    or appends them to the thumbnails bundles of dst_path if bundles are enabled.
+    These tasks run only when no other transfer waits and have no progress bar.
+    """
+    def __init__(self, data, manager, sftp):
+        super().__init__()
+        self.data = data
+        self.src_path = data['src_path']
+        self.dst_path = data['dst_path']
+        self.thumb_name = data['name']
+        self.bundle = data.get('bundle')
+        self.manager = manager
+        self.sftp = sftp
+        self.done = False
+
+    def run(self):
+        try:
+            upload_levels(self.sftp, self.dst_path, self.thumb_name, self.bundle)
+        except Exception as ex:
+            ex_log(f'Failed to upload thumbnail {self.thumb_name} {ex}')
+        else:
+            self.done = True
+            logger.info(f'Thumbnail {self.thumb_name} uploaded')
+        finally:
+            self.manager.sftp_queue.put(self.sftp)
+            self.manager.thread_queue.put('.')
@@ -1,6 +1,5 @@
 from threading import Thread
-from common import posix_path, mk_logger, thumb_dir
-from processes.thumbnail import ThumbnailGenerator
+from common import posix_path, mk_logger, remote_mtime
 import os
 
 logger = mk_logger(__name__)
@@ -25,7 +24,7 @@ class Upload(Thread):
         self.done = False
         self.waiting_for_directory = None
         self.attrs = None
-        self.thumbnails = data['thumbnails']
+        self.thumbnails = data.get('thumbnails')
 
     def run(self):
         self.bar.my_thread = self
@@ -44,6 +43,7 @@ class Upload(Thread):
         except FileNotFoundError:
             ex_log(f'File {self.file_name} does\'t exists')
             self.bar.set_values(desc=f'File {self.file_name} does\'t exists')
+            self.drop_thumbnail()
 
         except FileExistsError:
             logger.info(f'File {self.file_name} exists')
@@ -64,34 +64,19 @@ class Upload(Thread):
 
         except Exception as ex:
             ex_log(f'Uploading {self.file_name} {type(ex)}. {ex}')
+            self.drop_thumbnail()
 
         else:
             logger.info(f'Uploading {self.file_name} completed successfully')
             self.done = True
-            self.upload_thumbnail()
-            self.manager.uploaded(self.dst_path, self.attrs)
+            if self.thumbnails:
+                self.manager.thumbnail_ready(self.dst_path, self.file_name, uploaded=True)
+            self.manager.uploaded(self.dst_path, self.attrs, remote_mtime(self.dst_path, self.sftp))
             self.bar.done()
         finally:
             self.manager.sftp_queue.put(self.sftp)
             self.manager.thread_queue.put('.')
 
-    def upload_thumbnail(self):
-        if self.thumbnails:
-            try:
-                th = ThumbnailGenerator(self.src_path, self.dst_path)
-                th.start()
-                th.join()
-                if th.ok:
-                    self.bar.flush()
-                    self.bar.set_values(f'Uploading thumbnail of {self.file_name}')
-
-                    if self.thumb_dir_exists():
-                        self.put(th.thumb_path, posix_path(self.dst_path, thumb_dir, th.thumb_name), True)
-                    else:
-                        logger.info(f'Thumbnail for {self.file_name} not uploaded')
-            except Exception as ex:
-                ex_log(f'Failed to upload thumbnail for {self.file_name}. {ex}')
-
     def file_exists(self):
         if self.sftp.exists(self.full_remote_path):
             raise FileExistsError
@@ -108,22 +93,17 @@ class Upload(Thread):
         self.attrs.filename = self.file_name
         self.attrs.longname = str(self.attrs)
 
-    def thumb_dir_exists(self):
-        try:
-            thdr = posix_path(self.dst_path, thumb_dir)
-            if not self.sftp.exists(thdr):
-                self.sftp.makedirs(thdr)
-        except Exception as ex:
-            ex_log(f'Failed to make thumbnail directory {ex}')
-            return False
-        else:
-            return True
-
     def overwrite(self):
         if not self.done:
             self.manager.put_transfer({**self.data, 'overwrite': True}, bar=self.bar)
             self.manager.run()
 
+    def drop_thumbnail(self):
+        """Upload ended without the file, its thumbnail is not uploaded"""
+        if self.thumbnails:
+            self.manager.thumbnail_ready(self.dst_path, self.file_name, failed=True)
+
     def skip(self):
+        self.drop_thumbnail()
         self.done = True
         self.bar.set_values(f'Uploading {self.src_path} to {self.dst_path} - Skipped')
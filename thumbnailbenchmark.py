@@ -0,0 +1,104 @@
+"""
+Measures how fast thumbnails are made from a corpus of photos, RAW files and videos.
+
+    python thumbnailbenchmark.py <corpus dir> [--workers N] [--size 300x200]
+
+Every file is made into a thumbnail by thumbengine and, for comparison, by full decoding
+of the image followed by resampling. Results are grouped by kind of file.
+"""
+from concurrent.futures import ProcessPoolExecutor
+from collections import defaultdict
+from processes import thumbengine, videothumb
+from PIL import Image
+from time import perf_counter
+import argparse
+import tempfile
+import os
+
+
+def engine(src_path, size, out_path):
+    kind = thumbengine.signature(src_path)
+    if not kind:
+        return kind, None
+    start = perf_counter()
+    if kind == thumbengine.VIDEO:
+        data = videothumb.extract(src_path, size)
+        if not data:
+            return kind, None
+    else:
+        data = thumbengine.encode(thumbengine.make(src_path, size, kind))
+    thumbengine.write(out_path, data)
+    return kind, perf_counter() - start
+
+
+def full_decode(src_path, size, out_path):
+    start = perf_counter()
+    image = Image.open(src_path)
+    image.load()
+    image = image.convert('RGB')
+    image.thumbnail(size, reducing_gap=None)
+    image.save(out_path, 'JPEG')
+    return perf_counter() - start
+
+
+def measure(args):
+    src_path, size, out_dir = args
+    out_path = os.path.join(out_dir, f'{os.getpid()}.jpg')
+    try:
+        kind, fast = engine(src_path, size, out_path)
+    except Exception:
+        return None, None, None
+    if fast is None:
+        return kind, None, None
+    if kind == thumbengine.VIDEO:
+        return kind, fast, None
+    try:
+        slow = full_decode(src_path, size, out_path)
+    except Exception:
+        slow = None
+    return kind, fast, slow
+
+
+def corpus(path):
+    for root, _, files in os.walk(path):
+        for file in files:
+            yield os.path.join(root, file)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Thumbnail engine benchmark')
+    parser.add_argument('corpus')
+    parser.add_argument('--workers', type=int, default=1)
+    parser.add_argument('--size', default='300x200')
+    args = parser.parse_args()
+    size = tuple(int(value) for value in args.size.split('x'))
+
+    fast = defaultdict(list)
+    slow = defaultdict(list)
+    skipped = 0
+    with tempfile.TemporaryDirectory() as out_dir:
+        jobs = [(src_path, size, out_dir) for src_path in corpus(args.corpus)]
+        start = perf_counter()
+        with ProcessPoolExecutor(max_workers=args.workers) as executor:
+            for kind, fast_time, slow_time in executor.map(measure, jobs, chunksize=4):
+                if fast_time is None:
+                    skipped += 1
+                    continue
+                fast[kind].append(fast_time)
+                if slow_time is not None:
+                    slow[kind].append(slow_time)
+        wall = perf_counter() - start
+
+    print(f'{"kind":<8}{"files":>8}{"engine ms":>12}{"full ms":>12}{"speedup":>10}')
+    for kind, times in sorted(fast.items()):
+        engine_ms = sum(times) / len(times) * 1000
+        line = f'{kind:<8}{len(times):>8}{engine_ms:>12.1f}'
+        if slow[kind]:
+            full_ms = sum(slow[kind]) / len(slow[kind]) * 1000
+            line += f'{full_ms:>12.1f}{full_ms / engine_ms:>9.1f}x'
+        print(line)
+    print(f'{skipped} files skipped, {len(jobs)} files in {wall:.1f} s with {args.workers} workers')
+
+
+if __name__ == '__main__':
+    main()